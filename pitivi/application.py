@@ -39,6 +39,9 @@ from pitivi.settings import GlobalSettings
 from pitivi.settings import xdg_cache_home
 from pitivi.shortcuts import ShortcutsManager
 from pitivi.shortcuts import show_shortcuts
+from pitivi.timeline.previewers import AssetAnalyzer
+from pitivi.timeline.previewers import Previewer
+from pitivi.timeline.previewers import PreviewsCacheManager
 from pitivi.undo.project import ProjectObserver
 from pitivi.undo.undo import UndoableActionLog
 from pitivi.utils import loggable
@@ -46,6 +49,7 @@ from pitivi.utils.loggable import Loggable
 from pitivi.utils.misc import path_from_uri
 from pitivi.utils.misc import quote_uri
 from pitivi.utils.proxy import ProxyManager
+from pitivi.utils.system import ConcurrencyController
 from pitivi.utils.system import get_system
 from pitivi.utils.threads import ThreadMaster
 from pitivi.utils.timeline import Zoomable
@@ -56,8 +60,12 @@ class Pitivi(Gtk.Application, Loggable):
 
     Attributes:
         action_log (UndoableActionLog): The undo/redo log for the current project.
+        concurrency_controller (ConcurrencyController): Adapts the number
+            of transcoders and previewers to the load.
         effects (EffectsManager): The effects which can be applied to a clip.
         gui (MainWindow): The main window of the app.
+        previews_cache_manager (PreviewsCacheManager): Keeps the
+            thumbnails and waveforms cache within its budget.
         recent_manager (Gtk.RecentManager): Manages recently used projects.
         project_manager (ProjectManager): The holder of the current project.
         settings (GlobalSettings): The application-wide settings.
@@ -145,6 +153,26 @@ class Pitivi(Gtk.Application, Loggable):
         self.threads = ThreadMaster()
         self.effects = EffectsManager()
         self.proxy_manager = ProxyManager(self)
+        self.previews_cache_manager = PreviewsCacheManager.get(xdg_cache_home())
+        self.previews_cache_manager.max_size = self.settings.previewers_cache_max_size
+        self.previews_cache_manager.schedule_eviction()
+        Previewer.manager.max_jobs = self.settings.previewers_max_jobs
+        Previewer.manager.max_cpu_usage = self.settings.previewers_max_cpu
+        AssetAnalyzer.max_jobs = self.settings.previewers_max_jobs
+        AssetAnalyzer.max_cpu_usage = self.settings.previewers_max_cpu
+        self.concurrency_controller = ConcurrencyController(self.settings.target_cpu_usage)
+        if self.settings.adaptive_concurrency:
+            # The settings become the maximum number of jobs.
+            self.concurrency_controller.add_consumer(
+                "transcoders", self.settings.numTranscodingJobs,
+                self.proxy_manager.set_max_jobs, self.proxy_manager.set_cpu_usage)
+            self.concurrency_controller.add_consumer(
+                "previewers", self.settings.previewers_max_jobs,
+                Previewer.manager.set_max_jobs)
+            self.concurrency_controller.add_consumer(
+                "analyzers", self.settings.previewers_max_jobs,
+                AssetAnalyzer.set_max_jobs)
+            self.concurrency_controller.start()
         self.system = get_system()
         self.plugin_manager = PluginManager(self)
 
@@ -237,6 +265,7 @@ class Pitivi(Gtk.Application, Loggable):
         if self.gui:
             self.gui.destroy()
         self.threads.stopAllThreads()
+        self.concurrency_controller.stop()
         self.settings.storeSettings()
         self.quit()
         return True
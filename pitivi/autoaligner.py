@@ -16,29 +16,62 @@
 # License along with this program; if not, write to the
 # Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
 # Boston, MA 02110-1301, USA.
-# TODO reimplement after GES port
 """Automatic alignment of `Clip`s."""
-import array
+import collections
+import multiprocessing
 import os
 import time
+from gettext import gettext as _
 
+import numpy
+from gi.repository import GES
+from gi.repository import GLib
+from gi.repository import GObject
 from gi.repository import Gst
 from gi.repository import Gtk
 
-
-try:
-    import numpy
-except ImportError:
-    numpy = None
-
-from gettext import gettext as _
-
 import pitivi.configure as configure
-
-from pitivi.utils.ui import beautify_ETA
-from pitivi.utils.misc import call_false
+from pitivi.settings import get_dir
+from pitivi.settings import xdg_cache_home
+from pitivi.timeline.previewers import get_wavefile_location_for_uri
+from pitivi.timeline.previewers import PreviewsCacheManager
+from pitivi.timeline.previewers import SAMPLE_DURATION
+from pitivi.timeline.previewers import WaveformPeaks
+from pitivi.utils.extract import AudioExtractor
 from pitivi.utils.extract import Extractee
+from pitivi.utils.fingerprints import FingerprintIndex
 from pitivi.utils.loggable import Loggable
+from pitivi.utils.misc import call_false
+from pitivi.utils.proxy import get_proxy_target
+from pitivi.utils.ui import beautify_ETA
+
+
+# The maximum number of cross-correlation samples computed at once by
+# rigidalign, about 128 MB of complex spectra.
+RIGIDALIGN_BATCH_SAMPLES = 2 ** 23
+# The maximum length of the envelopes correlated with FFTs by pyramidalign,
+# about 40 minutes at the AutoAligner's BLOCKRATE.
+PYRAMID_MAX_BLOCKS = 2 ** 16
+# The decimation factor between the levels of the pyramid.
+PYRAMID_FACTOR = 4
+# The number of best shifts found on the coarsest level which are refined.
+PYRAMID_CANDIDATES = 3
+# The number of lags on each side of a candidate shift checked when refining.
+PYRAMID_RADIUS = 2 * PYRAMID_FACTOR
+# The number of target samples correlated at once when refining.
+PYRAMID_CHUNK = 2 ** 16
+# The range of the number of target samples in the blocks matched by
+# affinealign, about 10 to 80 seconds at the AutoAligner's BLOCKRATE.
+AFFINE_MIN_BLOCK = 2 ** 8
+AFFINE_MAX_BLOCK = 2 ** 11
+# The maximum size of the FFTs computed by affinealign when matching a block.
+AFFINE_MAX_FFT = 2 ** 16
+# The minimum correlation coefficient of a block with the reference for
+# its shift to be used when estimating the drift.
+AFFINE_MIN_CORRELATION = 0.3
+# The maximum distance in samples between the shift of a block and the
+# line fitted by affinealign.
+AFFINE_TOLERANCE = 2.0
 
 
 def nextpow2(x):
@@ -48,6 +81,33 @@ def nextpow2(x):
     return a
 
 
+def next_fast_len(x):
+    """Gets the smallest 5-smooth number not smaller than x.
+
+    The FFT of numpy is fast for the sizes having only 2, 3 and 5 as prime
+    factors, which are much closer to x than the next power of 2.
+
+    Args:
+        x (int): The minimum size.
+
+    Returns:
+        int: The size to use for the FFT.
+    """
+    best = nextpow2(x)
+    power5 = 1
+    while power5 < best:
+        power35 = power5
+        while power35 < best:
+            # The smallest power of 2 bringing power35 to at least x.
+            size = power35
+            while size < x:
+                size *= 2
+            best = min(best, size)
+            power35 *= 3
+        power5 *= 5
+    return best
+
+
 def submax(left, middle, right):
     """
     Find the maximum of a quadratic function from three samples.
@@ -83,222 +143,356 @@ def submax(left, middle, right):
 
 
 def rigidalign(reference, targets):
-    """
-    Estimate the relative shift between reference and targets.
+    """Estimates the relative shift between reference and targets.
 
     The algorithm works by subtracting the mean, and then locating
-    the maximum of the cross-correlation.  For inputs of length M{N},
-    the running time is M{O(C{len(targets)}*N*log(N))}.
-
-    @param reference: the waveform to regard as fixed
-    @type reference: Sequence(Number)
-    @param targets: the waveforms that should be aligned to reference
-    @type targets: Sequence(Sequence(Number))
-    @returns: The shift necessary to bring each target into alignment
-        with the reference.  The returned shift may not be an integer,
-        indicating that the best alignment would be achieved by a
-        non-integer shift and appropriate interpolation.
-    @rtype: Sequence(Number)
-
+    the maximum of the cross-correlation.  The targets are stacked in a
+    single array so the cross-correlations with the reference are all
+    computed by one FFT. For inputs of length N, the running time is
+    O(len(targets) * N * log(N)).
+
+    Args:
+        reference (numpy.ndarray): The waveform to regard as fixed.
+        targets (List[numpy.ndarray]): The waveforms that should be aligned
+            to reference.
+
+    Returns:
+        List[float]: The shift necessary to bring each target into
+            alignment with the reference.  The returned shift may not be
+            an integer, indicating that the best alignment would be achieved
+            by a non-integer shift and appropriate interpolation.
     """
+    lengths = numpy.array([len(t) for t in targets])
     # L is the maximum size of a cross-correlation between the
     # reference and any of the targets.
-    L = len(reference) + max(len(t) for t in targets) - 1
-    # We round up L to the next power of 2 for speed in the FFT.
-    L = nextpow2(L)
+    L = len(reference) + lengths.max() - 1
+    # We round up L to a size for which the FFT is fast.
+    L = next_fast_len(L)
     reference = reference - numpy.mean(reference)
     fref = numpy.fft.rfft(reference, L).conj()
-    shifts = []
-    for t in targets:
-        t = t - numpy.mean(t)
-        # Compute cross-correlation
-        xcorr = numpy.fft.irfft(fref * numpy.fft.rfft(t, L))
+    # The targets are correlated in batches to bound the memory used.
+    batch_size = max(1, RIGIDALIGN_BATCH_SAMPLES // L)
+    shifts = numpy.zeros(len(targets))
+    for first in range(0, len(targets), batch_size):
+        batch = targets[first:first + batch_size]
+        stacked = numpy.zeros((len(batch), lengths.max()))
+        for row, t in zip(stacked, batch):
+            row[:len(t)] = t - numpy.mean(t)
+        # Compute the cross-correlations, one per row.
+        fxcorr = numpy.fft.rfft(stacked, L, axis=1)
+        fxcorr *= fref
+        xcorr = numpy.fft.irfft(fxcorr, L, axis=1)
+        rows = numpy.arange(len(batch))
         # shift maximizes dotproduct(t[shift:],reference)
-        # int() to convert numpy.int32 to python int
-        shift = int(numpy.argmax(xcorr))
-        subsample_shift = submax(xcorr[(shift - 1) % L],
-                                 xcorr[shift],
-                                 xcorr[(shift + 1) % L])
-        shift = shift + subsample_shift
-        # shift is now a float indicating the interpolated maximum
-        if shift >= len(t):  # Negative shifts appear large and positive
-            shift -= L       # This corrects them to be negative
-        shifts.append(-shift)
-        # Sign reversed to move the target instead of the reference
+        peaks = numpy.argmax(xcorr, axis=1)
+        subsample_shifts = submax(xcorr[rows, (peaks - 1) % L],
+                                  xcorr[rows, peaks],
+                                  xcorr[rows, (peaks + 1) % L])
+        shifts[first:first + len(batch)] = peaks + subsample_shifts
+    # shifts are now floats indicating the interpolated maxima.
+    # Negative shifts appear large and positive, this corrects them.
+    shifts = numpy.where(shifts >= lengths, shifts - L, shifts)
+    # Sign reversed to move the target instead of the reference
+    return [-float(shift) for shift in shifts]
+
+
+def _decimate(a):
+    """Averages the consecutive PYRAMID_FACTOR samples of an envelope."""
+    length = len(a) - len(a) % PYRAMID_FACTOR
+    return a[:length].reshape((-1, PYRAMID_FACTOR)).mean(axis=1)
+
+
+def _candidates(reference, target, count):
+    """Finds the best shifts of a target by correlating it entirely.
+
+    Returns:
+        List[int]: The shifts of the highest local maxima of the
+            cross-correlation, best first.
+    """
+    L = next_fast_len(len(reference) + len(target) - 1)
+    fxcorr = numpy.fft.rfft(target, L)
+    fxcorr *= numpy.fft.rfft(reference, L).conj()
+    xcorr = numpy.fft.irfft(fxcorr, L)
+    peaks = numpy.flatnonzero((xcorr >= numpy.roll(xcorr, 1)) &
+                              (xcorr >= numpy.roll(xcorr, -1)))
+    peaks = peaks[numpy.argsort(xcorr[peaks])[::-1][:count]]
+    # Negative shifts appear large and positive, and the sign is reversed
+    # to move the target instead of the reference, as in rigidalign.
+    return [int(L - peak if peak >= len(target) else -peak) for peak in peaks]
+
+
+def _segment(a, start, length):
+    """Copies a part of an envelope, padded with zeros outside of it."""
+    segment = numpy.zeros(length)
+    begin = max(0, start)
+    end = min(len(a), start + length)
+    if begin < end:
+        segment[begin - start:end - start] = a[begin:end]
+    return segment
+
+
+def _refine(reference, target, center, radius):
+    """Correlates a target with the reference around a shift.
+
+    The target is processed in chunks, so the memory used does not depend
+    on the length of the envelopes.
+
+    Returns:
+        numpy.ndarray: The correlations for the shifts from center - radius
+            to center + radius.
+    """
+    values = numpy.zeros(2 * radius + 1)
+    for first in range(0, len(target), PYRAMID_CHUNK):
+        chunk = target[first:first + PYRAMID_CHUNK]
+        # The part of the reference facing the chunk, for all the shifts.
+        segment = _segment(reference, first + center - radius,
+                           len(chunk) + 2 * radius)
+        values += numpy.correlate(segment, chunk, "valid")
+    return values
+
+
+def pyramidalign(reference, targets):
+    """Estimates the relative shift between reference and targets.
+
+    Same as rigidalign, but for long envelopes the cross-correlation is
+    computed coarse to fine. The envelopes are decimated until they are
+    short enough, and entirely correlated to find a few candidate shifts.
+    Each candidate is then refined on the finer levels by correlating the
+    envelopes only around it, and the best one is interpolated with submax.
+    This way the memory used is bounded whatever the length of the
+    envelopes.
+
+    Args:
+        reference (numpy.ndarray): The waveform to regard as fixed.
+        targets (List[numpy.ndarray]): The waveforms that should be aligned
+            to reference.
+
+    Returns:
+        List[float]: The shift necessary to bring each target into
+            alignment with the reference.
+    """
+    longest = max(len(reference), max(len(t) for t in targets))
+    if longest <= PYRAMID_MAX_BLOCKS:
+        return rigidalign(reference, targets)
+
+    def pyramid(a):
+        levels = [numpy.asarray(a, dtype=numpy.float64)]
+        while longest / PYRAMID_FACTOR ** (len(levels) - 1) > PYRAMID_MAX_BLOCKS:
+            levels.append(_decimate(levels[-1]))
+        # The levels are centered so only the variations are correlated.
+        return [level - numpy.mean(level) for level in levels]
+
+    references = pyramid(reference)
+    shifts = []
+    for target in targets:
+        levels = pyramid(target)
+        best_value = None
+        best_shift = 0.0
+        for shift in _candidates(references[-1], levels[-1], PYRAMID_CANDIDATES):
+            for level in range(len(levels) - 2, -1, -1):
+                center = shift * PYRAMID_FACTOR
+                values = _refine(references[level], levels[level], center,
+                                 PYRAMID_RADIUS)
+                index = int(numpy.argmax(values))
+                shift = center - PYRAMID_RADIUS + index
+            if best_value is None or values[index] > best_value:
+                best_value = values[index]
+                best_shift = shift
+                if 0 < index < len(values) - 1:
+                    best_shift += submax(values[index - 1], values[index],
+                                         values[index + 1])
+        shifts.append(float(best_shift))
     return shifts
 
 
-def _findslope(a):
-    # Helper function for affinealign
-    # The provided matrix a contains a bright line whose slope we want to know,
-    # against a noisy background.
-    # The line starts at 0,0.  If the slope is positive, it runs toward the
-    # center of the matrix (i.e. toward (-1,-1))
-    # If the slope is negative, it wraps from 0,0 to 0,-1 and continues toward
-    # the center, (i.e. toward (-1,0)).
-    # The line segment terminates at the midline along the X direction.
-    # We locate the line by simply checking the sum along each possible line
-    # up to the Y-max edge of a.  The caller sets the limit by choosing the
-    # size of a.
-    # The function returns a floating-point slope assuming that the matrix
-    # has "square pixels".
-    Y, X = a.shape
-    X /= 2
-    x_pos = numpy.arange(1, X)
-    x_neg = numpy.arange(2 * X - 1, X, -1)
-    best_end = 0
-    max_sum = 0
-    for end in range(Y):
-        y = (x_pos * end) // X
-        s = numpy.sum(a[y, x_pos])
-        if s > max_sum:
-            max_sum = s
-            best_end = end
-        s = numpy.sum(a[y, x_neg])
-        if s > max_sum:
-            max_sum = s
-            best_end = -end
-    return float(best_end) / X
+def _match_block(reference, block, first, lags):
+    """Finds the shift of a block of a target best matching the reference.
 
+    The lags are correlated with FFTs of at most AFFINE_MAX_FFT samples,
+    so the memory used does not depend on the number of lags.
 
-def affinealign(reference, targets, max_drift=0.02):
-    """ EXPERIMENTAL FUNCTION.
-
-    Perform an affine registration between a reference and a number of
-    targets.  Designed for aligning the amplitude envelopes of recordings of
-    the same event by different devices.
-
-    NOTE: This method is currently NOT USED by Pitivi, as it has proven both
-    unnecessary and unusable.  So far every test case has been registered
-    successfully by rigidalign, and until Pitivi supports time-stretching of
-    audio, the drift calculation cannot actually be used.
-
-    @param reference: the reference signal to which others will be registered
-    @type reference: array(number)
-    @param targets: the signals to register
-    @type targets: ordered iterable(array(number))
-    @param max_drift: the maximum absolute clock drift rate
-                  (i.e. stretch factor) that will be considered during search
-    @type max_drift: positive L{float}
-    @return: (offsets, drifts).  offsets[i] is the point in reference at which
-           targets[i] starts.  drifts[i] is the speed of targets[i] relative to
-           the reference (positive is faster, meaning the target should be
-           slowed down to be in sync with the reference)
+    Args:
+        reference (numpy.ndarray): The centered reference.
+        block (numpy.ndarray): The centered block.
+        first (int): The position of the block in the target.
+        lags (range): The shifts of the target to consider.
+
+    Returns:
+        Tuple[float, float]: The interpolated shift and the correlation
+            coefficient of the block with the reference at that shift.
+    """
+    # Each window of lags is correlated with one more lag on each side,
+    # for interpolating the maximum.
+    window = AFFINE_MAX_FFT - len(block) - 2
+    L = next_fast_len(len(block) + min(window, len(lags)) + 1)
+    fblock = numpy.fft.rfft(block, L).conj()
+    best_value = None
+    best_shift = lags.start
+    for lag in range(lags.start, lags.stop, window):
+        count = min(window, lags.stop - lag)
+        segment = _segment(reference, first + lag - 1, len(block) + count + 1)
+        values = numpy.fft.irfft(numpy.fft.rfft(segment, L) * fblock, L)
+        index = int(numpy.argmax(values[1:count + 1])) + 1
+        if best_value is None or values[index] > best_value:
+            best_value = values[index]
+            best_shift = lag - 1 + index + submax(values[index - 1],
+                                                  values[index],
+                                                  values[index + 1])
+
+    facing = _segment(reference, first + int(round(best_shift)), len(block))
+    norm = numpy.sqrt(numpy.sum(block ** 2) * numpy.sum(facing ** 2))
+    if not norm:
+        return best_shift, 0.0
+    return best_shift, best_value / norm
+
+
+def _match_blocks(reference, target, shift, max_drift, block_size):
+    """Matches the blocks of a target with the reference.
+
+    Args:
+        reference (numpy.ndarray): The centered reference.
+        target (numpy.ndarray): The centered target.
+        shift (float): The estimated shift of the target.
+        max_drift (float): The maximum absolute clock drift rate.
+        block_size (int): The number of samples of the blocks.
+
+    Returns:
+        Tuple[List[float], List[float], List[float]]: The centers of the
+            blocks which matched, their shifts and correlation coefficients.
+    """
+    # The shift of a block can be anywhere within the drift accumulated
+    # over the whole target.
+    radius = int(numpy.ceil(max_drift * len(target))) + PYRAMID_RADIUS
+    center = int(round(shift))
+    lags = range(center - radius, center + radius + 1)
+    positions = []
+    shifts = []
+    weights = []
+    for first in range(0, len(target) - block_size + 1, block_size):
+        block = target[first:first + block_size]
+        block_shift, correlation = _match_block(reference, block, first, lags)
+        if correlation >= AFFINE_MIN_CORRELATION:
+            positions.append(first + block_size / 2)
+            shifts.append(block_shift)
+            weights.append(correlation)
+    return positions, shifts, weights
+
+
+def _fit_line(matches):
+    """Fits a line through the matched blocks, ignoring the outliers.
+
+    Args:
+        matches (Tuple[List[float], List[float], List[float]]): The blocks
+            returned by _match_blocks.
+
+    Returns:
+        Optional[Tuple[float, float, int]]: The shift at position 0, the
+            slope and the number of blocks on the line, or None if not
+            enough blocks matched.
     """
-    L = len(reference) + max(len(t) for t in targets) - 1
-    L2 = nextpow2(L)
-    bsize = int(20. / max_drift)  # NEEDS TUNING
-    num_blocks = nextpow2(1.0 * len(reference) // bsize)  # NEEDS TUNING
-    bspace = (len(reference) - bsize) // num_blocks
-    reference -= numpy.mean(reference)
-
-    # Construct FFT'd reference blocks
-    freference_blocks = numpy.zeros((L2 / 2 + 1, num_blocks),
-                                    dtype=numpy.complex)
-    for i in range(num_blocks):
-        s = i * bspace
-        tmp = numpy.zeros((L2,))
-        tmp[s:s + bsize] = reference[s:s + bsize]
-        freference_blocks[:, i] = numpy.fft.rfft(tmp, L2).conj()
-    freference_blocks[:10, :] = 0  # High-pass to ignore slow volume variations
+    positions, shifts, weights = (numpy.array(values) for values in matches)
+    keep = numpy.ones(len(positions), dtype=bool)
+    while keep.sum() >= 2:
+        slope, offset = numpy.polyfit(positions[keep], shifts[keep], 1,
+                                      w=weights[keep])
+        residuals = numpy.abs(shifts - (offset + slope * positions))
+        # The shift within a block is about constant, so the blocks on the
+        # line are at most a few samples away from it.
+        worst = residuals[keep].max()
+        if worst <= AFFINE_TOLERANCE:
+            return offset, slope, int(keep.sum())
+        keep &= residuals <= max(AFFINE_TOLERANCE, worst / 2)
+    return None
+
 
+def affinealign(reference, targets, max_drift=0.02):
+    """Estimates the offset and the clock drift of the targets.
+
+    Long recordings made by different devices drift because of their
+    clocks running at slightly different speeds. The global offset of each
+    target is found by pyramidalign. The target is then cut in blocks, and
+    each block is matched with the reference among the shifts allowed by
+    max_drift around the global offset. A line fitted through the shifts
+    of the matching blocks gives the offset and the drift.
+
+    The blocks are processed one at a time and the FFTs are no larger than
+    AFFINE_MAX_FFT, so the memory used does not depend on the length of
+    the envelopes.
+
+    Args:
+        reference (numpy.ndarray): The reference signal to which others
+            will be registered.
+        targets (List[numpy.ndarray]): The signals to register.
+        max_drift (float): The maximum absolute clock drift rate (i.e.
+            stretch factor) that will be considered during search.
+
+    Returns:
+        Tuple[List[float], List[float]]: The offsets and the drifts.
+            offsets[i] is the point in reference at which targets[i] starts.
+            drifts[i] is the speed of targets[i] relative to the reference
+            minus 1 (positive is faster, meaning the target should be slowed
+            down to be in sync with the reference).
+    """
+    # Within a block, the drift moves the target by up to
+    # max_drift * block_size samples, which blurs the correlation.
+    block_size = int(min(AFFINE_MAX_BLOCK, max(AFFINE_MIN_BLOCK, 4 / max_drift)))
+    rigid_shifts = pyramidalign(reference, targets)
+    reference = reference - numpy.mean(reference)
     offsets = []
     drifts = []
-    for t in targets:
-        t -= numpy.mean(t)
-        ft = numpy.fft.rfft(t, L2)
-        # fxcorr is the FFT'd cross-correlation with the reference blocks
-        fxcorr_blocks = numpy.zeros((L2 / 2 + 1, num_blocks),
-                                    dtype=numpy.complex)
-        for i in range(num_blocks):
-            fxcorr_blocks[:, i] = ft * freference_blocks[:, i]
-            fxcorr_blocks[:, i] /= numpy.sqrt(
-                numpy.sum(fxcorr_blocks[:, i] ** 2))
-        del ft
-        # At this point xcorr_blocks would show a distinct bright line, nearly
-        # orthogonal to time, indicating where each of these blocks found their
-        # peak.  Each point on this line represents the time in t where block i
-        # found its match.  The time-intercept gives the time in b at which the
-        # reference starts, and the slope gives the amount by which the
-        # reference is faster relative to b.
-
-        # The challenge now is to find this line.  Our strategy is to reduce the
-        # search to one dimension by first finding the slope.
-        # The Fourier Transform of a smooth real line in 2D is an orthogonal
-        # line through the origin, with phase that gives its position.
-        # Unfortunately this line is not clearly visible in fxcorr_blocks, so
-        # we discard the phase (by taking the absolute value) and then inverse
-        # transform.  This places the line at the origin, so we can find its
-        # slope.
-
-        # Construct the half-autocorrelation matrix
-        # (A true autocorrelation matrix would be ifft(abs(fft(x))**2), but this
-        # is just ifft(abs(fft(x))).)
-        # Construction is stepwise partly in an attempt to save memory
-        # The width is 2*num_blocks in order to avoid overlapping positive and
-        # negative correlations
-        halfautocorr = numpy.fft.fft(fxcorr_blocks, 2 * num_blocks, 1)
-        halfautocorr = numpy.abs(halfautocorr)
-        halfautocorr = numpy.fft.ifft(halfautocorr, None, 1)
-        halfautocorr = numpy.fft.irfft(halfautocorr, None, 0)
-        # Now it's actually the half-autocorrelation.
-        # Chop out the bit we don't care about
-        halfautocorr = halfautocorr[:bspace * num_blocks * max_drift, :]
-        # Remove the local-correlation peak.
-        halfautocorr[-1:2, -1:2] = 0  # NEEDS TUNING
-        # Normalize each column (appears to be necessary)
-        for i in range(2 * num_blocks):
-            halfautocorr[:, i] /= numpy.sqrt(
-                numpy.sum(halfautocorr[:, i] ** 2))
-        drift = _findslope(halfautocorr) / bspace
-        del halfautocorr
-
-        # inverse transform and shift everything into alignment
-        xcorr_blocks = numpy.fft.irfft(fxcorr_blocks, None, 0)
-        del fxcorr_blocks
-        # TODO: see if phase ramps are worthwhile here
-        for i in range(num_blocks):
-            blockcenter = i * bspace + bsize / 2
-            shift = int(blockcenter * drift)
-            if shift > 0:
-                temp = xcorr_blocks[:shift, i].copy()
-                xcorr_blocks[:-shift, i] = xcorr_blocks[shift:, i].copy()
-                xcorr_blocks[-shift:, i] = temp
-            elif shift < 0:
-                temp = xcorr_blocks[shift:, i].copy()
-                xcorr_blocks[-shift:, i] = xcorr_blocks[:shift, i].copy()
-                xcorr_blocks[:-shift, i] = temp
-
-        # xcorr is the drift-compensated cross-correlation
-        xcorr = numpy.sum(xcorr_blocks, axis=1)
-        del xcorr_blocks
-
-        offset = numpy.argmax(xcorr)
-        del xcorr
-        if offset >= len(t):
-            offset -= L2
-
-        # now offset is the point in target at which reference starts and
-        # drift is the speed with which the reference drifts relative to the
-        # target.  We reverse these relationships for the caller.
-        slope = 1 + drift
-        offsets.append(-offset / slope)
-        drifts.append(1 / slope - 1)
+    for target, rigid_shift in zip(targets, rigid_shifts):
+        target = target - numpy.mean(target)
+        fit = _fit_line(_match_blocks(reference, target, rigid_shift,
+                                      max_drift, block_size))
+        if fit is None or fit[2] < len(target) // block_size / 2:
+            # When the drift is large, the target as a whole does not
+            # correlate well with the reference, but its middle part does.
+            length = min(AFFINE_MAX_BLOCK, 4 * block_size)
+            first = max(0, (len(target) - length) // 2)
+            middle = target[first:first + length]
+            if len(middle):
+                middle_shift = pyramidalign(reference, [middle])[0] - first
+                middle_fit = _fit_line(_match_blocks(reference, target,
+                                                     middle_shift, max_drift,
+                                                     block_size))
+                if middle_fit is not None and \
+                        (fit is None or middle_fit[2] > fit[2]):
+                    fit = middle_fit
+
+        if fit is None:
+            # Not enough blocks matched to measure the drift.
+            offsets.append(rigid_shift)
+            drifts.append(0.0)
+            continue
+
+        offset, slope, unused_inliers = fit
+        # The target sample at position p faces the reference sample at
+        # offset + (1 + slope) * p.
+        offsets.append(float(offset))
+        drifts.append(float(slope))
     return offsets, drifts
 
 
+# The meta of the aligned clips holding their clock drift relative to the
+# reference clip, as returned by affinealign.
+DRIFT_META = "pitivi::drift"
+
+
 def getAudioTrack(clip):
-    """
-    Helper function for getting an audio track from a Clip
+    """Gets the audio track element of a clip.
+
+    Args:
+        clip (GES.Clip): The clip in which to look for an audio source.
 
-    @param clip: The Clip from which to locate an audio track
-    @type clip: L{Clip}
-    @returns: An audio track from clip, or None if clip has no audio track
-    @rtype: audio L{TrackElement} or L{NoneType}
+    Returns:
+        Optional[GES.TrackElement]: The audio source of the clip, or None
+            if the clip has no audio.
     """
-    for track in clip.track_elements:
-        if track.stream_type == AudioStream:
-            return track
+    if not isinstance(clip, GES.UriClip):
+        return None
+    for track_element in clip.find_track_elements(None, GES.TrackType.AUDIO,
+                                                  GObject.TYPE_NONE):
+        return track_element
     return None
 
 
@@ -398,28 +592,30 @@ class EnvelopeExtractee(Extractee, Loggable):
         @type blocksize: L{int}
         @param callback: a function to call when the extraction is complete.
             The function's first argument will be a numpy array
-            representing the envelope, and any later argument to this
-            function will be passed as subsequent arguments to callback.
+            representing the envelope, or None if the extraction failed,
+            and any later argument to this function will be passed as
+            subsequent arguments to callback.
 
         """
         Loggable.__init__(self)
         self._blocksize = blocksize
         self._cb = callback
         self._cbargs = cbargs
-        self._blocks = numpy.zeros((0,), dtype=numpy.float32)
-        self._empty = array.array('f', [])
+        # The envelope computed so far, in chunks.
+        self._blocks = []
+        self._num_blocks = 0
         # self._samples buffers up to self._threshold samples, before
         # their envelope is computed and store in self._blocks, in order
         # to amortize some of the function call overheads.
-        self._samples = array.array('f', [])
+        self._samples = []
+        self._num_samples = 0
         self._threshold = 2000 * blocksize
         self._progress_watchers = []
 
     def receive(self, a):
-        self._samples.extend(a)
-        if len(self._samples) < self._threshold:
-            return
-        else:
+        self._samples.append(numpy.asarray(a, dtype=numpy.float32))
+        self._num_samples += len(a)
+        if self._num_samples >= self._threshold:
             self._process_samples()
 
     def addWatcher(self, w):
@@ -433,40 +629,141 @@ class EnvelopeExtractee(Extractee, Loggable):
         self._progress_watchers.append(w)
 
     def _process_samples(self):
-        excess = len(self._samples) % self._blocksize
-        if excess != 0:
-            samples_to_process = self._samples[:-excess]
-            self._samples = self._samples[-excess:]
-        else:
-            samples_to_process = self._samples
-            self._samples = array.array('f', [])
+        samples = numpy.concatenate(self._samples) if self._samples else \
+            numpy.zeros((0,), dtype=numpy.float32)
+        excess = len(samples) % self._blocksize
+        newblocks = len(samples) // self._blocksize
+        self._samples = [samples[len(samples) - excess:]]
+        self._num_samples = excess
         self.debug("Adding %s samples to %s blocks",
-                   len(samples_to_process), len(self._blocks))
-        newblocks = len(samples_to_process) // self._blocksize
+                   len(samples) - excess, self._num_blocks)
         samples_abs = numpy.abs(
-            samples_to_process).reshape((newblocks, self._blocksize))
-        self._blocks.resize((len(self._blocks) + newblocks,))
+            samples[:newblocks * self._blocksize]).reshape((newblocks, self._blocksize))
         # This numpy.sum() call relies on samples_abs being a
         # floating-point type. If samples_abs.dtype is int16
         # then the sum may overflow.
-        self._blocks[-newblocks:] = numpy.sum(samples_abs, 1)
+        self._blocks.append(numpy.sum(samples_abs, 1))
+        self._num_blocks += newblocks
         for w in self._progress_watchers:
-            w(self._blocksize * len(self._blocks) + excess)
+            w(self._blocksize * self._num_blocks + excess)
 
     def finalize(self):
         self._process_samples()  # absorb any remaining buffered samples
-        self._cb(self._blocks, *self._cbargs)
+        self._cb(numpy.concatenate(self._blocks), *self._cbargs)
 
+    def fail(self):
+        self._cb(None, *self._cbargs)
 
-class AutoAligner(Loggable):
 
+class EnvelopeCache(Loggable):
+    """Persistent cache of the envelopes of the assets.
+
+    The envelope of the whole audio stream of an asset is saved once per
+    block rate, as float32 in a .npy file named after the hash of the media
+    file. The files are next to the waveforms, so they are evicted by the
+    `PreviewsCacheManager` as well. The envelope of a clip is a slice of
+    the envelope of its asset.
+
+    Attributes:
+        cache_dir (str): The directory containing the Pitivi cache.
     """
-    Class for aligning a set of L{Clip}s automatically.
+
+    # The caches, by cache directory.
+    caches_by_dir = {}
+
+    def __init__(self, cache_dir):
+        Loggable.__init__(self)
+        self.cache_dir = cache_dir
+
+    @classmethod
+    def get(cls, cache_dir):
+        """Gets the EnvelopeCache for the specified cache directory."""
+        if cache_dir not in cls.caches_by_dir:
+            cls.caches_by_dir[cache_dir] = EnvelopeCache(cache_dir)
+        return cls.caches_by_dir[cache_dir]
+
+    def location(self, uri, blockrate):
+        """Computes the path of the envelope of a media file.
+
+        Args:
+            uri (str): The URI of the media file.
+            blockrate (int): The number of envelope samples per second.
+
+        Returns:
+            str: The path of the .npy file.
+        """
+        fingerprints = FingerprintIndex.get(self.cache_dir)
+        filehash = fingerprints.fingerprint(Gst.uri_get_location(uri))
+        waves_dir = get_dir(os.path.join(self.cache_dir, "waves"))
+        return os.path.join(waves_dir, "%s.%d.envelope.npy" % (filehash, blockrate))
+
+    def get_envelope(self, uri, blockrate, in_point, duration):
+        """Gets the envelope of a part of a media file.
+
+        Args:
+            uri (str): The URI of the media file.
+            blockrate (int): The number of envelope samples per second.
+            in_point (int): The start of the part, in nanoseconds.
+            duration (int): The duration of the part, in nanoseconds.
+
+        Returns:
+            Optional[numpy.ndarray]: The envelope, or None if the envelope
+                of the media file has not been saved.
+        """
+        try:
+            # Fails if the media file is missing, e.g. only its proxy is left.
+            path = self.location(uri, blockrate)
+            envelope = numpy.load(path, mmap_mode="r")
+        except FileNotFoundError:
+            return None
+        except (IOError, ValueError) as e:
+            self.warning("Could not load the envelope of %s: %s", uri, e)
+            return None
+        self.__touch(path)
+        start = int(in_point * blockrate / Gst.SECOND)
+        end = start + int(duration * blockrate / Gst.SECOND)
+        return numpy.array(envelope[start:end], dtype=numpy.float32)
+
+    def save(self, uri, blockrate, envelope):
+        """Saves the envelope of a whole media file.
+
+        Args:
+            uri (str): The URI of the media file.
+            blockrate (int): The number of envelope samples per second.
+            envelope (numpy.ndarray): The envelope.
+        """
+        try:
+            path = self.location(uri, blockrate)
+            temp_path = path + ".tmp"
+            with open(temp_path, "wb") as envelope_file:
+                numpy.save(envelope_file, numpy.asarray(envelope, dtype=numpy.float32))
+            os.replace(temp_path, path)
+        except OSError as e:
+            self.warning("Could not save the envelope of %s: %s", uri, e)
+            return
+        self.__touch(path)
+
+    def __touch(self, path):
+        manager = PreviewsCacheManager.get(self.cache_dir)
+        manager.touch(PreviewsCacheManager.KIND_WAVE, os.path.basename(path))
+        manager.schedule_eviction()
+
+
+class AutoAligner(Loggable):
+    """Aligns a set of clips automatically.
 
     The alignment is based on their contents, so that the shifted tracks
     are synchronized.  The current implementation only analyzes audio
-    data, so timeline objects without an audio track cannot be aligned.
+    data, so clips without an audio track cannot be aligned.
+
+    The envelopes of the assets are extracted concurrently and saved in the
+    EnvelopeCache, so aligning the clips again is instant. When the
+    waveform of an asset has already been computed for the timeline, the
+    envelope is derived from it instead of decoding the audio again.
 
+    Attributes:
+        MAX_EXTRACTIONS (int): The maximum number of envelopes extracted
+            at the same time.
     """
 
     BLOCKRATE = 25
@@ -486,72 +783,128 @@ class AutoAligner(Loggable):
 
     """
 
-    def __init__(self, clips, callback):
-        """
-        @param clips: an iterable of L{Clip}s.
-            In this implementation, only L{Clip}s with at least one
-            audio track will be aligned.
-        @type clips: iter(L{Clip})
-        @param callback: A function to call when alignment is complete.  No
-            arguments will be provided.
-        @type callback: function
+    MAX_EXTRACTIONS = multiprocessing.cpu_count()
 
+    def __init__(self, clips, callback, drift=False):
+        """
+        Args:
+            clips (List[GES.Clip]): The clips to align. Only the clips with
+                an audio track will be aligned.
+            callback (function): The function to call when the alignment
+                is complete. No arguments will be provided.
+            drift (Optional[bool]): Whether to measure the clock drift of
+                the clips relative to the reference clip with affinealign.
+                The drift is saved in the DRIFT_META meta of the clips.
         """
         Loggable.__init__(self)
         # self._clips maps each object to its envelope.  The values
         # are initially None prior to envelope extraction.
         self._clips = dict.fromkeys(clips)
         self._callback = callback
-        # stack of (Track, Extractee) pairs waiting to be processed
-        # When start() is called, the stack will be populated, and then
-        # processed sequentially.  Only one item from the stack will be
-        # actively in process at a time.
-        self._extraction_stack = []
+        self._drift = drift
+        self._envelope_cache = EnvelopeCache.get(xdg_cache_home())
+        # The (uri, duration, extractor, extractee) waiting to be processed.
+        self._pending_extractions = collections.deque()
+        # Maps the URIs to the (extractor, duration) currently running.
+        self._running_extractions = {}
+        # Maps the URIs of the extracted assets to their clips.
+        self._clips_by_uri = {}
 
     @staticmethod
     def canAlign(clips):
-        """
-        Can an AutoAligner align these objects?
+        """Checks whether the clips can all be aligned together.
 
-        Determine whether a group of timeline objects can all
-        be aligned together by an AutoAligner.
-
-        @param clips: a group of timeline objects
-        @type clips: iterable(L{Clip})
-        @returns: True iff the objects can aligned.
-        @rtype: L{bool}
+        Args:
+            clips (List[GES.Clip]): The clips to check.
 
+        Returns:
+            bool: True iff the clips can be aligned.
         """
-        # numpy is a "soft dependency".  If you're running without numpy,
-        # this False return value is your only warning not to
-        # use the AutoAligner, which will crash immediately.
         return all(getAudioTrack(t) is not None for t in clips)
 
-    def _extractNextEnvelope(self):
-        audiotrack, extractee = self._extraction_stack.pop()
-        r = RandomAccessAudioExtractor(audiotrack.factory,
-                                       audiotrack.stream)
-        r.extract(extractee, audiotrack.in_point,
-                  audiotrack.out_point - audiotrack.in_point)
+    def _startExtractions(self):
+        while self._pending_extractions and \
+                len(self._running_extractions) < self.MAX_EXTRACTIONS:
+            uri, duration, extractor, extractee = self._pending_extractions.popleft()
+            self._running_extractions[uri] = (extractor, duration)
+            # The whole asset is extracted so the envelope can be cached.
+            extractor.extract(extractee, 0, duration)
         return False
 
-    def _envelopeCb(self, array, clip):
-        self.debug("Receiving envelope for %s", clip)
-        self._clips[clip] = array
-        if self._extraction_stack:
-            self._extractNextEnvelope()
+    def _envelopeCb(self, array, uri):
+        self.debug("Receiving envelope for %s", uri)
+        unused_extractor, duration = self._running_extractions.pop(uri)
+        clips = self._clips_by_uri.pop(uri)
+        if array is None:
+            # The clips without envelope are ignored by _finish.
+            self.warning("Failed extracting the envelope of %s", uri)
+            clips = []
+        elif len(array) + 1 < int(duration * self.BLOCKRATE / Gst.SECOND):
+            # Don't cache it, it would be used for the whole asset.
+            self.warning("The envelope of %s is truncated: %d blocks",
+                         uri, len(array))
+        else:
+            self._envelope_cache.save(uri, self.BLOCKRATE, array)
+        for clip in clips:
+            audiotrack = getAudioTrack(clip)
+            start = int(audiotrack.props.in_point * self.BLOCKRATE / Gst.SECOND)
+            end = start + int(audiotrack.props.duration * self.BLOCKRATE / Gst.SECOND)
+            self._clips[clip] = array[start:end]
+        if self._pending_extractions or self._running_extractions:
+            self._startExtractions()
         else:  # This was the last envelope
+            self._finish()
+
+    def _finish(self):
+        for clip, envelope in list(self._clips.items()):
+            if envelope is None or not len(envelope):
+                self.warning("Could not extract the envelope of %s", clip)
+                self._clips.pop(clip)
+        if len(self._clips) >= 2:
             self._performShifts()
-            self._callback()
+        self._callback()
 
-    def start(self):
+    def _envelopeFromWaveform(self, asset, audiotrack):
+        """Gets the envelope of a clip from the waveform of its asset.
+
+        The waveforms saved for the timeline have the RMS of the audio for
+        each SAMPLE_DURATION, which are aggregated to BLOCKRATE.
+
+        Args:
+            asset (GES.UriClipAsset): The asset of the clip.
+            audiotrack (GES.TrackElement): The audio source of the clip.
+
+        Returns:
+            Optional[numpy.ndarray]: The envelope, or None if the waveform
+                of the asset has not been computed yet.
         """
-        Initiate the auto-alignment process.
+        factor = int(Gst.SECOND / self.BLOCKRATE / SAMPLE_DURATION)
+        if factor * SAMPLE_DURATION * self.BLOCKRATE != Gst.SECOND:
+            return None
+        try:
+            wavefile = get_wavefile_location_for_uri(get_proxy_target(asset).props.id)
+        except FileNotFoundError:
+            # Only the proxy of the asset is available.
+            return None
+        if not os.path.exists(wavefile):
+            return None
+        try:
+            peaks = WaveformPeaks.load(wavefile)
+        except (IOError, ValueError) as e:
+            self.warning("Could not load %s: %s", wavefile, e)
+            return None
+
+        start = int(audiotrack.props.in_point / SAMPLE_DURATION)
+        end = start + int(audiotrack.props.duration / SAMPLE_DURATION)
+        rms = peaks.rms(start, end).astype(numpy.float64)
+        rms = rms[:len(rms) - len(rms) % factor].reshape((-1, factor))
+        return numpy.sqrt(numpy.mean(rms ** 2, axis=1))
 
-        @returns: a L{ProgressMeter} indicating the progress of the
-            alignment
-        @rtype: L{ProgressMeter}
+    def start(self):
+        """Initiates the auto-alignment process.
 
+        Returns:
+            ProgressAggregator: The progress of the alignment.
         """
         progress_aggregator = ProgressAggregator()
         pairs = []  # (Clip, {audio}TrackElement) pairs
@@ -563,48 +916,62 @@ class AutoAligner(Loggable):
                 self._clips.pop(clip)
         if len(pairs) >= 2:
             for clip, audiotrack in pairs:
+                asset = clip.get_asset()
+                uri = get_proxy_target(asset).props.id
+                envelope = self._envelope_cache.get_envelope(
+                    uri, self.BLOCKRATE, audiotrack.props.in_point,
+                    audiotrack.props.duration)
+                if envelope is None:
+                    envelope = self._envelopeFromWaveform(asset, audiotrack)
+                if envelope is not None:
+                    self.debug("Reusing the envelope of %s", uri)
+                    self._clips[clip] = envelope
+                    continue
+
+                if uri in self._clips_by_uri:
+                    # The asset is already being extracted for another clip.
+                    self._clips_by_uri[uri].append(clip)
+                    continue
+                self._clips_by_uri[uri] = [clip]
+
+                rate = asset.get_info().get_audio_streams()[0].get_sample_rate()
                 # blocksize is the number of samples per block
-                blocksize = audiotrack.stream.rate // self.BLOCKRATE
+                blocksize = rate // self.BLOCKRATE
                 extractee = EnvelopeExtractee(
-                    blocksize, self._envelopeCb, clip)
-                # numsamples is the total number of samples in the track,
+                    blocksize, self._envelopeCb, uri)
+                duration = asset.get_duration()
+                # numsamples is the total number of samples in the asset,
                 # which is used by progress_aggregator to determine
                 # the percent completion.
-                numsamples = ((audiotrack.duration / Gst.SECOND) *
-                              audiotrack.stream.rate)
+                numsamples = ((duration / Gst.SECOND) * rate)
                 extractee.addWatcher(
                     progress_aggregator.getPortionCB(numsamples))
-                self._extraction_stack.append((audiotrack, extractee))
-            # After we return, start the extraction cycle.
-            # This GLib.idle_add call should not be necessary;
-            # we should be able to invoke _extractNextEnvelope directly
-            # here.  However, there is some as-yet-unexplained
-            # race condition between the Python GIL, GTK UI updates,
-            # GLib mainloop, and pygst multithreading, resulting in
-            # occasional deadlocks during autoalignment.
-            # This call to idle_add() reportedly eliminates the deadlock.
-            # No one knows why.
-            GLib.idle_add(self._extractNextEnvelope)
+                extractor = AudioExtractor(asset.props.id, rate)
+                self._pending_extractions.append((uri, duration, extractor,
+                                                  extractee))
+            if self._pending_extractions:
+                # After we return, start the extraction cycle.
+                GLib.idle_add(self._startExtractions)
+            else:
+                GLib.idle_add(call_false, self._finish)
         else:  # We can't do anything without at least two audio tracks
             # After we return, call the callback function (once)
             GLib.idle_add(call_false, self._callback)
         return progress_aggregator
 
     def _chooseReference(self):
-        """
-        Chooses the timeline object to use as a reference.
+        """Chooses the clip to use as a reference.
 
         This function currently selects the one with lowest priority,
         i.e. appears highest in the GUI.  The behavior of this function
         affects user interaction, because the user may want to
         determine which object moves and which stays put.
 
-        @returns: the timeline object with lowest priority.
-        @rtype: L{Clip}
-
+        Returns:
+            GES.Clip: The clip in the layer with the lowest priority.
         """
         def priority(clip):
-            return clip.priority
+            return clip.get_layer().get_priority()
         return min(iter(self._clips.keys()), key=priority)
 
     def _performShifts(self):
@@ -612,29 +979,37 @@ class AutoAligner(Loggable):
         reference = self._chooseReference()
         # By using pop(), this line also removes the reference
         # Clip and its envelope from further consideration,
-        # saving some CPU time in rigidalign.
+        # saving some CPU time in pyramidalign.
         reference_envelope = self._clips.pop(reference)
         # We call list() because we need a reliable ordering of the pairs
         # (In python 3, dict.items() returns an unordered dictview)
         pairs = list(self._clips.items())
         envelopes = [p[1] for p in pairs]
-        offsets = rigidalign(reference_envelope, envelopes)
+        if self._drift:
+            offsets, drifts = affinealign(reference_envelope, envelopes)
+            reference.set_double(DRIFT_META, 0.0)
+            for (movable, unused_envelope), drift in zip(pairs, drifts):
+                self.debug("Drift of %s: %f", movable, drift)
+                movable.set_double(DRIFT_META, drift)
+        else:
+            offsets = pyramidalign(reference_envelope, envelopes)
+        reference_start = reference.props.start
         for (movable, envelope), offset in zip(pairs, offsets):
             # tshift is the offset rescaled to units of nanoseconds
             tshift = int((offset * Gst.SECOND) / self.BLOCKRATE)
             self.debug("Shifting %s to %i ns from %i",
-                       movable, tshift, reference.start)
-            newstart = reference.start + tshift
+                       movable, tshift, reference_start)
+            newstart = reference_start + tshift
             if newstart >= 0:
-                movable.start = newstart
+                movable.set_start(newstart)
             else:
                 # Timeline objects always must have a positive start point, so
                 # if alignment would move an object to start at negative time,
                 # we instead make it start at zero and chop off the required
                 # amount at the beginning.
-                movable.start = 0
-                movable.in_point = movable.in_point - newstart
-                movable.duration += newstart
+                movable.set_start(0)
+                movable.set_inpoint(movable.props.in_point - newstart)
+                movable.set_duration(movable.props.duration + newstart)
 
 
 class AlignmentProgressDialog:
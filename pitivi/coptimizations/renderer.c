@@ -1,61 +1,154 @@
 #include <Python.h>
+#include <math.h>
 #include <stdio.h>
+#include <string.h>
 #include <cairo.h>
 #include <py3cairo.h>
 #include <gst/gst.h>
 
 static GObjectClass * gobject_class;
 
+/* The samples, either as a buffer or as a sequence of floats. */
+typedef struct
+{
+  Py_buffer view;
+  PyObject *sequence;
+  Py_ssize_t length;
+  char format;
+} Samples;
+
+/* Converts an IEEE 754 half-precision float. */
+static double
+half_to_double (unsigned short half)
+{
+  int exponent = (half >> 10) & 0x1f;
+  int mantissa = half & 0x3ff;
+  double value;
+
+  if (exponent == 0)
+    value = ldexp (mantissa, -24);
+  else if (exponent == 31)
+    value = mantissa ? NAN : INFINITY;
+  else
+    value = ldexp (mantissa + 1024, exponent - 25);
+
+  return (half & 0x8000) ? -value : value;
+}
+
 /*
- * This function must be called with a range of samples, and a desired
- * width and height.
- * It will average samples if needed.
+ * Gets the samples without copying them when they support the buffer
+ * protocol, for example numpy arrays or memoryviews of floats.
+ * Other sequences of floats, like lists, are also accepted.
+ * When columns is 0 the samples must be one-dimensional, otherwise
+ * they must be two-dimensional with at least `columns` columns.
  */
-static PyObject *
-py_fill_surface (PyObject * self, PyObject * args)
+static int
+samples_get (Samples * samples, PyObject * obj, int columns)
+{
+  samples->sequence = NULL;
+  samples->view.obj = NULL;
+
+  if (PyObject_CheckBuffer (obj)) {
+    const char *format;
+
+    if (PyObject_GetBuffer (obj, &samples->view, PyBUF_RECORDS_RO) < 0)
+      return -1;
+
+    format = samples->view.format;
+    if (format[0] == '<' || format[0] == '=' || format[0] == '@')
+      format++;
+    if (strcmp (format, "d") && strcmp (format, "f") && strcmp (format, "e")) {
+      PyErr_Format (PyExc_TypeError, "unsupported sample format: %s",
+          samples->view.format);
+      PyBuffer_Release (&samples->view);
+      return -1;
+    }
+
+    if (samples->view.ndim != (columns ? 2 : 1) ||
+        (columns && samples->view.shape[1] < columns)) {
+      PyErr_SetString (PyExc_ValueError, "unexpected samples shape");
+      PyBuffer_Release (&samples->view);
+      return -1;
+    }
+
+    samples->length = samples->view.shape[0];
+    samples->format = format[0];
+    return 0;
+  }
+
+  if (columns) {
+    PyErr_SetString (PyExc_TypeError, "the envelope must be a buffer");
+    return -1;
+  }
+
+  samples->sequence = PySequence_Fast (obj, "samples must be a sequence");
+  if (samples->sequence == NULL)
+    return -1;
+
+  samples->length = PySequence_Fast_GET_SIZE (samples->sequence);
+  return 0;
+}
+
+/* Gets a value, setting a Python exception if not convertible to float. */
+static double
+samples_value (Samples * samples, Py_ssize_t row, int column)
 {
-  PyObject *samples;
-  PyObject *sampleObj;
-  int length, i;
+  const char *item;
+
+  if (samples->sequence)
+    return PyFloat_AsDouble (PySequence_Fast_GET_ITEM (samples->sequence, row));
+
+  item = (const char *) samples->view.buf + row * samples->view.strides[0];
+  if (samples->view.ndim == 2)
+    item += column * samples->view.strides[1];
+
+  switch (samples->format) {
+    case 'd':
+      return *(const double *) item;
+    case 'f':
+      return *(const float *) item;
+    default:
+      return half_to_double (*(const unsigned short *) item);
+  }
+}
+
+static void
+samples_release (Samples * samples)
+{
+  if (samples->sequence)
+    Py_DECREF (samples->sequence);
+  else if (samples->view.obj)
+    PyBuffer_Release (&samples->view);
+}
+
+/*
+ * Draws the RMS values as a filled curve, averaging the samples
+ * falling in the same pixel.
+ */
+static int
+draw_rms (cairo_t * ctx, Samples * samples, int width, int height)
+{
+  Py_ssize_t i;
   double sample;
-  cairo_surface_t *surface;
-  cairo_t *ctx;
-  int width, height;
   float pixelsPerSample;
   float currentPixel;
   int samplesInAccum;
   float x = 0.;
   double accum;
 
-  if (!PyArg_ParseTuple (args, "O!ii", &PyList_Type, &samples, &width, &height))
-    return NULL;
-
-  length = PyList_Size (samples);
-
-  surface = cairo_image_surface_create (CAIRO_FORMAT_ARGB32, width, height);
-
-  ctx = cairo_create (surface);
-
-  cairo_set_source_rgb (ctx, 0.2, 0.6, 0.0);
-  cairo_set_line_width (ctx, 0.5);
   cairo_move_to (ctx, 0, height);
 
-  pixelsPerSample = width / (float) length;
+  pixelsPerSample = width / (float) samples->length;
   currentPixel = 0.;
   samplesInAccum = 0;
   accum = 0.;
 
-  for (i = 0; i < length; i++) {
-    /* Guaranteed to return something */
-    sampleObj = PyList_GetItem (samples, i);
-    sample = PyFloat_AsDouble (sampleObj);
+  for (i = 0; i < samples->length; i++) {
+    sample = samples_value (samples, i, 0);
 
     /* If the object was not a float or convertible to float */
-    if (PyErr_Occurred ()) {
-      cairo_surface_finish (surface);
-      Py_DECREF (samples);
-      return NULL;
-    }
+    if (samples->sequence && PyErr_Occurred ())
+      return -1;
 
     currentPixel += pixelsPerSample;
     samplesInAccum += 1;
@@ -70,16 +163,152 @@ py_fill_surface (PyObject * self, PyObject * args)
     x += pixelsPerSample;
   }
 
-  Py_DECREF (samples);
   cairo_line_to (ctx, width, height);
+  return 0;
+}
+
+/*
+ * Fills the RMS values like draw_rms, then draws on top of them the
+ * band between the min and max values, keeping the lowest min and the
+ * highest max of the samples falling in the same pixel.
+ */
+static int
+draw_envelope (cairo_t * ctx, Samples * samples, int width, int height)
+{
+  Py_ssize_t i;
+  int column, columns, n_columns;
+  int *counts;
+  double *mins, *maxs, *rms;
+  double sample_min, sample_max, sample_rms;
+
+  if (samples->length == 0 || width <= 0)
+    return 0;
+
+  n_columns = MIN (width, samples->length);
+  mins = g_new (double, n_columns);
+  maxs = g_new (double, n_columns);
+  rms = g_new (double, n_columns);
+  counts = g_new (int, n_columns);
+  columns = 0;
+
+  for (i = 0; i < samples->length; i++) {
+    sample_min = samples_value (samples, i, 0);
+    sample_max = samples_value (samples, i, 1);
+    sample_rms = samples_value (samples, i, 2);
+
+    column = i * n_columns / samples->length;
+    if (column == columns) {
+      mins[column] = sample_min;
+      maxs[column] = sample_max;
+      rms[column] = sample_rms;
+      counts[column] = 1;
+      columns++;
+    } else {
+      mins[column] = MIN (mins[column], sample_min);
+      maxs[column] = MAX (maxs[column], sample_max);
+      rms[column] += sample_rms;
+      counts[column]++;
+    }
+  }
+
+  /* The RMS values, averaged, filled from the bottom. */
+  cairo_move_to (ctx, 0, height);
+  for (column = 0; column < columns; column++)
+    cairo_line_to (ctx, (column + 0.5) * width / n_columns,
+        height - rms[column] / counts[column]);
+  cairo_line_to (ctx, width, height);
+  cairo_close_path (ctx);
+  cairo_fill (ctx);
+
+  /* The min/max band: the top edge left to right, then the bottom
+   * edge right to left. */
+  cairo_set_source_rgba (ctx, 0.2, 0.6, 0.0, 0.5);
+  for (column = 0; column < columns; column++)
+    cairo_line_to (ctx, (column + 0.5) * width / n_columns,
+        height - maxs[column]);
+  for (column = columns - 1; column >= 0; column--)
+    cairo_line_to (ctx, (column + 0.5) * width / n_columns,
+        height - mins[column]);
+
+  g_free (mins);
+  g_free (maxs);
+  g_free (rms);
+  g_free (counts);
+  return 0;
+}
+
+/*
+ * This function must be called with a range of samples, and a desired
+ * width and height.
+ * It will average samples if needed.
+ *
+ * The samples can be any buffer of floats, for example a numpy array
+ * or a memoryview, which is read without copying it and without holding
+ * the GIL, or a list.
+ * When envelope is true, the samples must be a two-dimensional buffer
+ * whose first three columns are the min, max and RMS values, and the
+ * band between the min and max values is drawn over the RMS curve.
+ */
+static PyObject *
+py_fill_surface (PyObject * self, PyObject * args, PyObject * kwargs)
+{
+  static char *kwlist[] = { "samples", "width", "height", "envelope", NULL };
+  PyObject *obj;
+  Samples samples;
+  cairo_surface_t *surface;
+  cairo_t *ctx;
+  int width, height;
+  int envelope = 0;
+  int res;
+
+  if (!PyArg_ParseTupleAndKeywords (args, kwargs, "Oii|p", kwlist,
+          &obj, &width, &height, &envelope))
+    return NULL;
+
+  if (samples_get (&samples, obj, envelope ? 3 : 0) < 0)
+    return NULL;
+
+  surface = cairo_image_surface_create (CAIRO_FORMAT_ARGB32, width, height);
+
+  ctx = cairo_create (surface);
+
+  cairo_set_source_rgb (ctx, 0.2, 0.6, 0.0);
+  cairo_set_line_width (ctx, 0.5);
+
+  if (samples.sequence) {
+    if (envelope)
+      res = draw_envelope (ctx, &samples, width, height);
+    else
+      res = draw_rms (ctx, &samples, width, height);
+  } else {
+    /* Buffers are read without the Python API, so other threads,
+     * for example drawing other tiles, can run meanwhile. */
+    Py_BEGIN_ALLOW_THREADS;
+    if (envelope)
+      res = draw_envelope (ctx, &samples, width, height);
+    else
+      res = draw_rms (ctx, &samples, width, height);
+    Py_END_ALLOW_THREADS;
+  }
+
+  samples_release (&samples);
+
+  if (res < 0) {
+    cairo_destroy (ctx);
+    cairo_surface_destroy (surface);
+    return NULL;
+  }
+
   cairo_close_path (ctx);
   cairo_fill_preserve (ctx);
+  cairo_destroy (ctx);
 
   return PycairoSurface_FromSurface (surface, NULL);
 }
 
 static PyMethodDef renderer_methods[] = {
-  {"fill_surface", py_fill_surface, METH_VARARGS},
+  {"fill_surface", (PyCFunction) py_fill_surface,
+      METH_VARARGS | METH_KEYWORDS},
   {NULL, NULL}
 };
 
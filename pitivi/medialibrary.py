@@ -50,6 +50,7 @@ from pitivi.utils.misc import path_from_uri
 from pitivi.utils.misc import PathWalker
 from pitivi.utils.misc import quote_uri
 from pitivi.utils.proxy import get_proxy_target
+from pitivi.utils.proxy import ProxyJobState
 from pitivi.utils.proxy import ProxyingStrategy
 from pitivi.utils.proxy import ProxyManager
 from pitivi.utils.ui import beautify_asset
@@ -171,7 +172,21 @@ class FileChooserExtraWidget(Gtk.Grid, Loggable):
 
 
 class AssetThumbnail(Loggable):
-    """Provider of decorated thumbnails for an asset."""
+    """Provider of decorated thumbnails for an asset.
+
+    Args:
+        asset (GES.UriClipAsset): The asset.
+        proxy_manager (ProxyManager): The manager of the proxies.
+        job_state (Optional[str]): The `ProxyJobState` of the asset,
+            when already known.
+        lazy (Optional[bool]): Whether to show placeholder icons until
+            `load` is called, instead of reading the thumbnails now.
+
+    Attributes:
+        loaded (bool): Whether the thumbnails of the asset have been read.
+        state (str): The proxying state of the asset, which selects the
+            emblem of the decorated thumbnails.
+    """
 
     EMBLEMS = {}
     PROXIED = "asset-proxied"
@@ -189,12 +204,46 @@ class AssetThumbnail(Loggable):
             EMBLEMS[status].append(GdkPixbuf.Pixbuf.new_from_file_at_size(
                 os.path.join(get_pixmap_dir(), "%s.svg" % status), size, size))
 
-    def __init__(self, asset, proxy_manager):
+    def __init__(self, asset, proxy_manager, job_state=None, lazy=False):
         Loggable.__init__(self)
         self.__asset = asset
-        self.src_small, self.src_large = self.__get_thumbnails()
         self.proxy_manager = proxy_manager
-        self.decorate()
+        self.loaded = False
+        self.src_small, self.src_large = self.get_placeholder_icons(asset)
+        # The decorated thumbnails, by state.
+        self.__decorated = {}
+        self.__decorated_state = None
+        if lazy:
+            self.update_state(job_state)
+            self.small_thumb = self.src_small
+            self.large_thumb = self.src_large
+        else:
+            self.load(job_state)
+
+    def load(self, job_state=None):
+        """Reads the thumbnails of the asset and decorates them.
+
+        Args:
+            job_state (Optional[str]): The `ProxyJobState` of the asset,
+                when already known.
+        """
+        self.src_small, self.src_large = self.__get_thumbnails()
+        self.loaded = True
+        self.__decorated.clear()
+        self.decorate(job_state)
+
+    @classmethod
+    def get_placeholder_icons(cls, asset):
+        """Gets the icons shown until the thumbnails of the asset are read.
+
+        Returns:
+            List[GdkPixbuf.Pixbuf]: The small icon and the large icon.
+        """
+        if asset.is_image():
+            return cls.__get_icons("image-x-generic")
+        if asset.get_info().get_video_streams():
+            return cls.__get_icons("video-x-generic")
+        return cls.__get_icons("audio-x-generic")
 
     def __get_thumbnails(self):
         """Gets the base source thumbnails.
@@ -316,8 +365,24 @@ class AssetThumbnail(Loggable):
             icon = icon_theme.load_icon("dialog-question", size, 0)
         return icon
 
-    def __setState(self):
+    def update_state(self, job_state=None):
+        """Updates the state of the asset without decorating the thumbnails.
+
+        Args:
+            job_state (Optional[str]): The `ProxyJobState` of the asset,
+                when already known.
+        """
+        self.__setState(job_state)
+
+    @property
+    def needs_decorating(self):
+        """Whether the thumbnails don't show the current state."""
+        return self.__decorated_state != self.state
+
+    def __setState(self, job_state):
         asset = self.__asset
+        if job_state is None:
+            job_state = self.proxy_manager.state_for([asset])[asset]
         target = asset.get_proxy_target()
         if self.proxy_manager.is_proxy_asset(asset) and target \
                 and not target.get_error():
@@ -325,16 +390,30 @@ class AssetThumbnail(Loggable):
             self.state = self.PROXIED
         elif asset.proxying_error:
             self.state = self.ASSET_PROXYING_ERROR
-        elif self.proxy_manager.is_asset_queued(asset):
+        elif job_state != ProxyJobState.NONE:
             self.state = self.IN_PROGRESS
         else:
             self.state = self.NO_PROXY
 
-    def decorate(self):
-        self.__setState()
+    def decorate(self, job_state=None):
+        """Updates the thumbnails with the emblem of the asset's state.
+
+        Args:
+            job_state (Optional[str]): The `ProxyJobState` of the asset,
+                when already known.
+        """
+        self.__setState(job_state)
+        self.__decorated_state = self.state
+        try:
+            self.small_thumb, self.large_thumb = self.__decorated[self.state]
+            return
+        except KeyError:
+            pass
+
         if self.state == self.NO_PROXY:
             self.small_thumb = self.src_small
             self.large_thumb = self.src_large
+            self.__decorated[self.state] = (self.small_thumb, self.large_thumb)
             return
 
         self.small_thumb = self.src_small.copy()
@@ -358,6 +437,7 @@ class AssetThumbnail(Loggable):
                           scale_x=1.0, scale_y=1.0,
                           interp_type=GdkPixbuf.InterpType.BILINEAR,
                           overall_alpha=self.DEFAULT_ALPHA)
+        self.__decorated[self.state] = (self.small_thumb, self.large_thumb)
 
 
 class MediaLibraryWidget(Gtk.Box, Loggable):
@@ -371,11 +451,24 @@ class MediaLibraryWidget(Gtk.Box, Loggable):
         'play': (GObject.SignalFlags.RUN_LAST, None,
                  (GObject.TYPE_PYOBJECT,))}
 
+    # The number of rows added to the model in one main loop iteration.
+    IMPORT_CHUNK_SIZE = 100
+
     def __init__(self, app):
         Gtk.Box.__init__(self)
         Loggable.__init__(self)
 
         self._pending_assets = []
+        self.__flush_id = 0
+        self.__bulk_inserting = False
+        self.__load_thumbnails_id = 0
+        # The model rows, by the URI of their asset.
+        self.__iters_by_uri = {}
+        # The (creation progress, ready) of the assets when their rows
+        # have been last refreshed, by URI.
+        self.__row_keys = {}
+        # The assets which were loading at the previous progress update.
+        self.__loading_assets = set()
 
         self.app = app
         self._errors = []
@@ -546,6 +639,13 @@ class MediaLibraryWidget(Gtk.Box, Loggable):
         self._setupViewAsDragAndDropSource(self.treeview)
         self._setupViewAsDragAndDropSource(self.iconview)
 
+        # The thumbnails are read only for the rows being displayed.
+        for scrollwin in (self.treeview_scrollwin, self.iconview_scrollwin):
+            scrollwin.get_vadjustment().connect(
+                "value-changed", self.__visible_rows_changed_cb)
+        for view in (self.treeview, self.iconview):
+            view.connect("size-allocate", self.__visible_rows_changed_cb)
+
         # Hack so that the views have the same method as self
         self.treeview.getSelectedItems = self.getSelectedItems
 
@@ -584,6 +684,11 @@ class MediaLibraryWidget(Gtk.Box, Loggable):
     def finalize(self):
         self.debug("Finalizing %s", self)
 
+        self.__cancel_flush()
+        if self.__load_thumbnails_id:
+            GLib.source_remove(self.__load_thumbnails_id)
+        self.__load_thumbnails_id = 0
+
         self.app.project_manager.disconnect_by_func(self._new_project_loading_cb)
         self.app.project_manager.disconnect_by_func(self._newProjectLoadedCb)
         self.app.project_manager.disconnect_by_func(self._newProjectFailedCb)
@@ -683,6 +788,7 @@ class MediaLibraryWidget(Gtk.Box, Loggable):
         # and skipping that makes a huge difference in responsiveness.
         if len(entry.get_text()) != 1:
             self.modelFilter.refilter()
+            self.__schedule_thumbnails_loading()
 
     def _searchEntryIconClickedCb(self, entry, icon_pos, unused_event):
         if icon_pos == Gtk.EntryIconPosition.SECONDARY:
@@ -697,6 +803,9 @@ class MediaLibraryWidget(Gtk.Box, Loggable):
 
     def _setRowVisible(self, model, iter, data):
         """Toggles the visibility of a liststore row."""
+        if self.__bulk_inserting:
+            # The rows are filtered once all of them are added.
+            return True
         text = data.get_text().lower()
         if not text:
             # Avoid silly warnings.
@@ -737,6 +846,7 @@ class MediaLibraryWidget(Gtk.Box, Loggable):
         elif self.clip_view == SHOW_ICONVIEW:
             self.treeview_scrollwin.hide()
             self.iconview_scrollwin.show_all()
+        self.__schedule_thumbnails_loading()
 
     def __filter_unsupported(self, filter_info):
         """Returns whether the specified item should be displayed."""
@@ -801,38 +911,155 @@ class MediaLibraryWidget(Gtk.Box, Loggable):
             self._flushPendingAssets()
 
     def _flushPendingAssets(self):
+        if self.__flush_id:
+            # The bulk insert in progress takes the new assets as well.
+            return
+
         self.debug("Flushing %d pending model rows", len(self._pending_assets))
-        for asset in self._pending_assets:
-            thumbs_decorator = AssetThumbnail(asset, self.app.proxy_manager)
+        if len(self._pending_assets) <= self.IMPORT_CHUNK_SIZE:
+            self.__append_rows(self._pending_assets)
+            del self._pending_assets[:]
+            return
+
+        # Add the rows in chunks so the UI stays responsive, without
+        # sorting and filtering them on each insert.
+        self.__bulk_inserting = True
+        self.storemodel.set_sort_column_id(Gtk.TREE_SORTABLE_UNSORTED_SORT_COLUMN_ID,
+                                           Gtk.SortType.ASCENDING)
+        self.__flush_id = GLib.idle_add(self.__flush_chunk_cb,
+                                        priority=GLib.PRIORITY_LOW)
+
+    def __flush_chunk_cb(self):
+        chunk = self._pending_assets[:self.IMPORT_CHUNK_SIZE]
+        del self._pending_assets[:self.IMPORT_CHUNK_SIZE]
+        self.__append_rows(chunk)
+        if self._pending_assets:
+            return True
+
+        self.debug("Done flushing the pending model rows")
+        self.__flush_id = 0
+        self.__bulk_inserting = False
+        self.storemodel.set_sort_column_id(COL_URI, Gtk.SortType.ASCENDING)
+        self.modelFilter.refilter()
+        return False
+
+    def __append_rows(self, assets):
+        """Adds model rows for the specified assets."""
+        job_states = self.app.proxy_manager.state_for(assets)
+        for asset in assets:
+            thumbs_decorator = AssetThumbnail(asset, self.app.proxy_manager,
+                                              job_states[asset], lazy=True)
             name = info_name(asset)
 
-            self.storemodel.append((thumbs_decorator.small_thumb,
-                                    thumbs_decorator.large_thumb,
-                                    beautify_asset(asset),
-                                    asset,
-                                    asset.props.id,
-                                    name,
-                                    thumbs_decorator))
+            uri = asset.props.id
+            self.__iters_by_uri[uri] = self.storemodel.append((
+                thumbs_decorator.small_thumb,
+                thumbs_decorator.large_thumb,
+                beautify_asset(asset),
+                asset,
+                uri,
+                name,
+                thumbs_decorator))
+            self.__row_keys[uri] = self.__get_row_key(asset)
+        self.__schedule_thumbnails_loading()
 
+    @staticmethod
+    def __get_row_key(asset):
+        """Gets the values of the asset which its row displays."""
+        return min(int(asset.creation_progress), 100), asset.ready
+
+    def __cancel_flush(self):
+        """Drops the pending assets, stopping the bulk insert if any."""
+        if self.__flush_id:
+            GLib.source_remove(self.__flush_id)
+            self.__flush_id = 0
+        if self.__bulk_inserting:
+            self.__bulk_inserting = False
+            self.storemodel.set_sort_column_id(COL_URI, Gtk.SortType.ASCENDING)
         del self._pending_assets[:]
 
+    def __clear_rows(self):
+        self.__cancel_flush()
+        self.storemodel.clear()
+        self.__iters_by_uri.clear()
+        self.__row_keys.clear()
+        self.__loading_assets = set()
+
+    def __visible_rows_changed_cb(self, *unused_args):
+        self.__schedule_thumbnails_loading()
+
+    def __schedule_thumbnails_loading(self):
+        if not self.__load_thumbnails_id:
+            self.__load_thumbnails_id = GLib.idle_add(self.__load_thumbnails_cb)
+
+    def __load_thumbnails_cb(self):
+        """Reads the thumbnails of the rows being displayed."""
+        self.__load_thumbnails_id = 0
+        if self.clip_view == SHOW_TREEVIEW:
+            view = self.treeview
+        else:
+            view = self.iconview
+        visible_range = view.get_visible_range()
+        if not visible_range:
+            return False
+
+        start_path, end_path = visible_range
+        for index in range(start_path.get_indices()[0], end_path.get_indices()[0] + 1):
+            filter_iter = self.modelFilter.iter_nth_child(None, index)
+            if not filter_iter:
+                break
+            row = self.storemodel[self.modelFilter.convert_iter_to_child_iter(filter_iter)]
+            thumbs_decorator = row[COL_THUMB_DECORATOR]
+            if not thumbs_decorator.loaded:
+                thumbs_decorator.load()
+            elif thumbs_decorator.needs_decorating:
+                thumbs_decorator.decorate()
+            else:
+                continue
+            row[COL_ICON_64] = thumbs_decorator.small_thumb
+            row[COL_ICON_128] = thumbs_decorator.large_thumb
+        return False
+
     # medialibrary callbacks
 
     def _assetLoadingProgressCb(self, project, progress, estimated_time):
         self._progressbar.set_fraction(progress / 100)
 
+        # Only the rows of the loading assets can change, including the
+        # assets which just finished loading.
+        loading_assets = set(project.loading_assets)
+        assets = loading_assets | self.__loading_assets
+        self.__loading_assets = loading_assets
+
         proxying_files = []
-        for row in self.storemodel:
-            asset = row[COL_ASSET]
-            row[COL_INFOTEXT] = beautify_asset(asset)
+        rows = []
+        for asset in assets:
+            uri = asset.props.id
+            itr = self.__iters_by_uri.get(uri)
+            if not itr:
+                continue
 
             if not asset.ready:
                 proxying_files.append(asset)
-                if row[COL_THUMB_DECORATOR].state != AssetThumbnail.IN_PROGRESS:
-                    thumbs_decorator = AssetThumbnail(asset, self.app.proxy_manager)
-                    row[COL_ICON_64] = thumbs_decorator.small_thumb
-                    row[COL_ICON_128] = thumbs_decorator.large_thumb
-                    row[COL_THUMB_DECORATOR] = thumbs_decorator
+
+            row = self.storemodel[itr]
+            key = self.__get_row_key(asset)
+            if self.__row_keys.get(uri) != key:
+                self.__row_keys[uri] = key
+                row[COL_INFOTEXT] = beautify_asset(asset)
+                rows.append(row)
+            elif not asset.ready and \
+                    row[COL_THUMB_DECORATOR].state != AssetThumbnail.IN_PROGRESS:
+                rows.append(row)
+
+        if rows:
+            # Query the transcoding queue once for all the rows. The
+            # thumbnails are decorated when the rows are displayed.
+            job_states = self.app.proxy_manager.state_for(
+                [row[COL_ASSET] for row in rows])
+            for row in rows:
+                row[COL_THUMB_DECORATOR].update_state(job_states[row[COL_ASSET]])
+            self.__schedule_thumbnails_loading()
 
         if progress == 0:
             self._startImporting(project)
@@ -889,7 +1116,7 @@ class MediaLibraryWidget(Gtk.Box, Loggable):
 
     def _assetAddedCb(self, unused_project, asset):
         """Checks whether the asset added to the project should be shown."""
-        if asset in [row[COL_ASSET] for row in self.storemodel]:
+        if asset.props.id in self.__iters_by_uri:
             self.info("Asset %s already in!", asset.props.id)
             return
 
@@ -914,18 +1141,20 @@ class MediaLibraryWidget(Gtk.Box, Loggable):
 
     def __removeAsset(self, asset):
         """Removes the specified asset."""
-        uri = asset.get_id()
-        # Find the corresponding line in the storemodel and remove it.
-        found = False
-        for row in self.storemodel:
-            if uri == row[COL_URI]:
-                self.storemodel.remove(row.iter)
-                found = True
-                break
+        if asset in self._pending_assets:
+            # Its row has not been added yet.
+            self._pending_assets.remove(asset)
+            return
 
-        if not found:
+        uri = asset.get_id()
+        itr = self.__iters_by_uri.pop(uri, None)
+        if not itr:
             self.info("Failed to remove %s as it was not found"
                       "in the liststore", uri)
+            return
+
+        self.__row_keys.pop(uri, None)
+        self.storemodel.remove(itr)
 
     def _proxyingErrorCb(self, unused_project, asset):
         self.__removeAsset(asset)
@@ -1390,7 +1619,7 @@ class MediaLibraryWidget(Gtk.Box, Loggable):
 
         self._project = project
         self._resetErrorList()
-        self.storemodel.clear()
+        self.__clear_rows()
         self._welcome_infobar.show_all()
         self._connectToProject(project)
 
@@ -1399,13 +1628,13 @@ class MediaLibraryWidget(Gtk.Box, Loggable):
         self._flushPendingAssets()
 
     def _newProjectFailedCb(self, unused_project_manager, unused_uri, unused_reason):
-        self.storemodel.clear()
+        self.__clear_rows()
         self._project = None
 
     def _projectClosedCb(self, unused_project_manager, unused_project):
         self.__disconnectFromProject()
         self._project_settings_infobar.hide()
-        self.storemodel.clear()
+        self.__clear_rows()
         self._project = None
 
     def __paths_walked_cb(self, uris):
@@ -44,9 +44,11 @@ from pitivi.preset import VideoPresetManager
 from pitivi.render import Encoders
 from pitivi.settings import get_dir
 from pitivi.settings import xdg_cache_home
+from pitivi.timeline.previewers import AssetAnalyzer
 from pitivi.timeline.previewers import ThumbnailCache
 from pitivi.undo.project import AssetAddedIntention
 from pitivi.undo.project import AssetProxiedIntention
+from pitivi.utils.fingerprints import FingerprintIndex
 from pitivi.utils.loggable import Loggable
 from pitivi.utils.misc import fixate_caps_with_default_values
 from pitivi.utils.misc import isWritable
@@ -396,6 +398,8 @@ class ProjectManager(GObject.Object, Loggable):
                 # otherwise, subsequent saves will be to the old uri.
                 self.info("Setting the project instance's URI to: %s", uri)
                 self.current_project.uri = uri
+                self.app.proxy_manager.set_jobs_file(
+                    self.app.proxy_manager.get_jobs_file(uri))
                 self.disable_save = False
                 self.emit("project-saved", self.current_project, uri)
             else:
@@ -622,6 +626,126 @@ class ProjectManager(GObject.Object, Loggable):
         self.info("Loaded in %s", self.time_loaded - self.__start_loading_time)
 
 
+class LoadingAssets(object):
+    """The assets being loaded, with running totals of their progress.
+
+    The totals are updated for each asset event, so the progress of the
+    whole import is known without going over all the assets.
+
+    Attributes:
+        total_duration (int): The sum of the durations of the assets.
+        num_loaded (int): The number of assets fully loaded.
+    """
+
+    def __init__(self):
+        # Maps the assets to their (duration, creation_progress) when
+        # they have been last accounted.
+        self.__accounted = {}
+        self.total_duration = 0
+        self.num_loaded = 0
+        # The sum of the durations weighted by the progress of each asset.
+        self.__weighted_progress = 0
+
+    def __contains__(self, asset):
+        return asset in self.__accounted
+
+    def __iter__(self):
+        return iter(self.__accounted)
+
+    def __len__(self):
+        return len(self.__accounted)
+
+    def __repr__(self):
+        return repr(list(self.__accounted))
+
+    def add(self, asset):
+        """Starts tracking the specified asset, or updates it.
+
+        Args:
+            asset (GES.UriClipAsset): The asset being loaded.
+
+        Returns:
+            bool: Whether the asset just became loaded.
+        """
+        if asset not in self.__accounted:
+            self.__accounted[asset] = (0, 0)
+        return self.update(asset)
+
+    def remove(self, asset):
+        """Stops tracking the specified asset.
+
+        Raises:
+            KeyError: When the asset is not tracked.
+        """
+        self.__discount(asset, *self.__accounted.pop(asset))
+
+    def clear(self):
+        """Stops tracking all the assets."""
+        self.__accounted.clear()
+        self.total_duration = 0
+        self.num_loaded = 0
+        self.__weighted_progress = 0
+
+    def update(self, asset):
+        """Accounts for the current duration and progress of the asset.
+
+        Args:
+            asset (GES.UriClipAsset): The asset whose progress changed.
+
+        Returns:
+            bool: Whether the asset just became loaded.
+        """
+        try:
+            duration, progress = self.__accounted[asset]
+        except KeyError:
+            return False
+        self.__discount(asset, duration, progress)
+
+        # The duration is not known until the asset is discovered.
+        duration = asset.get_duration()
+        self.__accounted[asset] = (duration, asset.creation_progress)
+        self.total_duration += duration
+        self.__weighted_progress += duration * asset.creation_progress
+        if asset.creation_progress >= 100:
+            self.num_loaded += 1
+            return progress < 100
+        return False
+
+    def __discount(self, asset, duration, progress):
+        self.total_duration -= duration
+        self.__weighted_progress -= duration * progress
+        if progress >= 100:
+            self.num_loaded -= 1
+
+    @property
+    def all_loaded(self):
+        """Whether all the assets are loaded."""
+        return self.num_loaded == len(self.__accounted)
+
+    def progress_by_count(self):
+        """Gets the percentage of assets fully loaded.
+
+        Returns:
+            float: The progress, 100 when all the assets are loaded.
+        """
+        if self.all_loaded:
+            return 100
+        return self.num_loaded / len(self.__accounted) * 100
+
+    def progress_by_duration(self):
+        """Gets the progress of the assets, weighted by their durations.
+
+        Returns:
+            Optional[float]: The progress, 100 when all the assets are
+                loaded, or None if the durations are not known yet.
+        """
+        if self.all_loaded:
+            return 100
+        if self.total_duration <= 0:
+            return None
+        return self.__weighted_progress / self.total_duration
+
+
 class Project(Loggable, GES.Project):
     """A Pitivi project.
 
@@ -667,7 +791,7 @@ class Project(Loggable, GES.Project):
         self.loaded = False
         self.at_least_one_asset_missing = False
         self.app = app
-        self.loading_assets = set()
+        self.loading_assets = LoadingAssets()
 
         self.relocated_assets = {}
         self.app.proxy_manager.connect("progress", self.__assetTranscodingProgressCb)
@@ -1095,66 +1219,36 @@ class Project(Loggable, GES.Project):
     # ------------------------------#
     def __assetTranscodingProgressCb(self, unused_proxy_manager, asset,
                                      creation_progress, estimated_time):
+        self.__loading_asset_updated(asset)
         self.__updateAssetLoadingProgress(estimated_time)
 
-    def __get_loading_project_progress(self):
-        """Computes current advancement of asset loading during project loading.
-
-        During project loading we keep all loading assets to keep track of real advancement
-        during the whole process, whereas while adding new assets, they get removed from
-        the `loading_assets` list once the proxy is ready.
-
-        Returns:
-            int: The current asset loading progress (in percent).
-        """
-        num_loaded = 0
-        all_ready = True
-        for asset in self.loading_assets:
-            if asset.creation_progress < 100:
-                all_ready = False
-            else:
-                # Check that we are not recreating deleted proxy
-                proxy_uri = self.app.proxy_manager.getProxyUri(asset)
-                if proxy_uri and proxy_uri not in self.__deleted_proxy_files and \
-                        asset.props.id not in self.__awaited_deleted_proxy_targets:
-                    asset.ready = True
-                num_loaded += 1
-
-        if all_ready:
-            return 100
-
-        return (num_loaded / len(self.loading_assets)) * 100
-
-    def __get_loading_assets_progress(self):
-        """Computes current advancement of asset loading.
+    def __loading_asset_updated(self, asset, added=False):
+        """Accounts for the progress of an asset being loaded.
 
-        Returns:
-            int: The current asset loading progress (in percent).
+        Args:
+            asset (GES.UriClipAsset): The asset whose progress changed.
+            added (Optional[bool]): Whether to start tracking the asset.
         """
-        total_import_duration = 0
-        for asset in self.loading_assets:
-            total_import_duration += asset.get_duration()
-
-        if total_import_duration == 0:
-            self.info("No known duration yet")
+        if added:
+            loaded = self.loading_assets.add(asset)
+        else:
+            loaded = self.loading_assets.update(asset)
+        if not loaded:
             return
 
-        asset_loading_progress = 0
-        all_ready = True
-        for asset in self.loading_assets:
-            asset_weight = asset.get_duration() / total_import_duration
-            asset_loading_progress += asset_weight * asset.creation_progress
-
-            if asset.creation_progress < 100:
-                all_ready = False
-            elif not asset.ready:
-                self.setModificationState(True)
+        if not self.loaded:
+            # During project loading we keep all loading assets to keep track
+            # of real advancement during the whole process, whereas while
+            # adding new assets, they get removed from `loading_assets` once
+            # the proxy is ready.
+            # Check that we are not recreating deleted proxy
+            proxy_uri = self.app.proxy_manager.getProxyUri(asset)
+            if proxy_uri and proxy_uri not in self.__deleted_proxy_files and \
+                    asset.props.id not in self.__awaited_deleted_proxy_targets:
                 asset.ready = True
-
-        if all_ready:
-            asset_loading_progress = 100
-
-        return asset_loading_progress
+        elif not asset.ready:
+            self.setModificationState(True)
+            asset.ready = True
 
     def __updateAssetLoadingProgress(self, estimated_time=0):
         if not self.loading_assets:
@@ -1162,15 +1256,17 @@ class Project(Loggable, GES.Project):
             return
 
         if not self.loaded:
-            progress = self.__get_loading_project_progress()
+            progress = self.loading_assets.progress_by_count()
         else:
-            progress = self.__get_loading_assets_progress()
+            progress = self.loading_assets.progress_by_duration()
+            if progress is None:
+                self.info("No known duration yet")
 
         self.emit("asset-loading-progress", progress, estimated_time)
 
         if progress == 100:
             self.info("No more loading assets")
-            self.loading_assets = set()
+            self.loading_assets.clear()
 
     def __assetTranscodingCancelledCb(self, unused_proxy_manager, asset):
         self.__setProxy(asset, None)
@@ -1200,6 +1296,7 @@ class Project(Loggable, GES.Project):
 
         asset.proxying_error = error
         asset.creation_progress = 100
+        self.__loading_asset_updated(asset)
 
         self.emit("proxying-error", asset)
         self.__updateAssetLoadingProgress()
@@ -1228,7 +1325,11 @@ class Project(Loggable, GES.Project):
 
         if proxy:
             self.add_asset(proxy)
-            self.loading_assets.add(proxy)
+            self.__loading_asset_updated(proxy, added=True)
+        elif not self.app.proxy_manager.is_proxy_asset(asset):
+            # No transcoding pass creates the previews, decode the asset
+            # once for all of them.
+            AssetAnalyzer.analyze(asset)
 
         self.__updateAssetLoadingProgress()
 
@@ -1288,7 +1389,7 @@ class Project(Loggable, GES.Project):
             # Progress == 0 means "starting to import"
             self.emit("asset-loading-progress", 0, 0)
 
-        self.loading_assets.add(asset)
+        self.__loading_asset_updated(asset, added=True)
 
     def do_asset_removed(self, asset):
         self.app.proxy_manager.cancel_job(asset)
@@ -1314,6 +1415,8 @@ class Project(Loggable, GES.Project):
             self.info("Deleted proxy file %s now ready again.", asset.props.id)
             self.__deleted_proxy_files.remove(asset.props.id)
 
+        # The duration of the asset is known now.
+        self.__loading_asset_updated(asset)
         if self.loaded:
             if not asset.get_proxy_target() in self.list_assets(GES.Extractable):
                 self.app.proxy_manager.add_job(asset)
@@ -1321,6 +1424,7 @@ class Project(Loggable, GES.Project):
             self.debug("Project still loading, not using proxies: %s",
                     asset.props.id)
             asset.creation_progress = 100
+            self.__loading_asset_updated(asset)
             self.__updateAssetLoadingProgress()
 
     def do_loading_error(self, error, asset_id, unused_type):
@@ -1335,6 +1439,8 @@ class Project(Loggable, GES.Project):
         asset.creation_progress = 100
         if self.loaded:
             self.loading_assets.remove(asset)
+        else:
+            self.__loading_asset_updated(asset)
         self.__updateAssetLoadingProgress()
 
     def do_loaded(self, unused_timeline):
@@ -1347,8 +1453,10 @@ class Project(Loggable, GES.Project):
         self._ensureLayer()
 
         if self.uri:
-            self.loading_assets = set([asset for asset in self.loading_assets if
-                                       self.app.proxy_manager.is_asset_queued(asset)])
+            self.__resume_proxying_jobs()
+            for asset in list(self.loading_assets):
+                if not self.app.proxy_manager.is_asset_queued(asset):
+                    self.loading_assets.remove(asset)
 
             if self.loading_assets:
                 self.debug("The following assets are still being transcoded: %s."
@@ -1366,6 +1474,26 @@ class Project(Loggable, GES.Project):
             self.set_container_profile(profiles[0], reset_all=True)
             self._load_encoder_settings(profiles)
 
+    def __resume_proxying_jobs(self):
+        """Queues again the jobs interrupted when the project was closed."""
+        proxy_manager = self.app.proxy_manager
+        jobs_file = proxy_manager.get_jobs_file(self.uri)
+        jobs = proxy_manager.load_jobs(jobs_file)
+        proxy_manager.set_jobs_file(jobs_file)
+        if not jobs:
+            return
+
+        for asset in self.list_assets(GES.UriClip):
+            uri = asset.props.id
+            if uri not in jobs or asset.get_proxy() or \
+                    proxy_manager.is_asset_queued(asset):
+                continue
+
+            self.info("Resuming the proxying of %s", uri)
+            self._prepare_asset_processing(asset)
+            asset.force_proxying = True
+            proxy_manager.add_job(asset, pinned=jobs[uri])
+
     def set_container_profile(self, container_profile, reset_all=False):
         """Sets @container_profile as new profile if usable.
 
@@ -1468,6 +1596,8 @@ class Project(Loggable, GES.Project):
         self.app.proxy_manager.disconnect_by_func(self.__proxyErrorCb)
         self.app.proxy_manager.disconnect_by_func(self.__assetTranscodingCancelledCb)
         self.app.proxy_manager.disconnect_by_func(self.__proxyReadyCb)
+        # Keep the jobs file as it is, to resume the jobs next time.
+        self.app.proxy_manager.set_jobs_file(None)
 
     def save(self, ges_timeline, uri, formatter_asset, overwrite):
         for container_profile in self.list_encoding_profiles():
@@ -1610,6 +1740,11 @@ class Project(Loggable, GES.Project):
         Args:
             uris (List[str]): The URIs of the assets.
         """
+        # Hash the new files while they are discovered, so the previewers
+        # don't have to when the assets are added.
+        paths = [path_from_uri(uri) for uri in uris if uri.startswith("file://")]
+        FingerprintIndex.get(xdg_cache_home()).prefetch(paths)
+
         with self.app.action_log.started("assets-addition"):
             for uri in uris:
                 if self.create_asset(quote_uri(uri), GES.UriClip):
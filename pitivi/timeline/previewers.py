@@ -17,10 +17,17 @@
 # Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
 # Boston, MA 02110-1301, USA.
 """Previewers for the timeline."""
+import collections
+import concurrent.futures
 import contextlib
+import heapq
+import multiprocessing
 import os
 import random
 import sqlite3
+import threading
+import time
+import weakref
 
 import cairo
 import numpy
@@ -35,14 +42,16 @@ from gi.repository import Gtk
 from pitivi.settings import get_dir
 from pitivi.settings import GlobalSettings
 from pitivi.settings import xdg_cache_home
+from pitivi.utils.fingerprints import FingerprintIndex
 from pitivi.utils.loggable import Loggable
-from pitivi.utils.misc import hash_file
 from pitivi.utils.misc import path_from_uri
 from pitivi.utils.misc import quantize
 from pitivi.utils.misc import quote_uri
+from pitivi.utils.pipeline import create_cpu_throttling_clock
 from pitivi.utils.pipeline import MAX_BRINGING_TO_PAUSED_DURATION
 from pitivi.utils.proxy import get_proxy_target
 from pitivi.utils.system import CPUUsageTracker
+from pitivi.utils.threads import Thread
 from pitivi.utils.timeline import Zoomable
 from pitivi.utils.ui import EXPANDED_SIZE
 
@@ -60,9 +69,21 @@ THUMB_MARGIN_PX = 3
 THUMB_HEIGHT = EXPANDED_SIZE - 2 * THUMB_MARGIN_PX
 THUMB_PERIOD = int(Gst.SECOND / 2)
 assert Gst.SECOND % THUMB_PERIOD == 0
-# For the waveforms, ensures we always have a little extra surface when
-# scrolling while playing.
-MARGIN = 500
+# The minimum number of missing thumbnails for generating them by decoding
+# the clip sequentially instead of seeking for each of them.
+SWEEP_MIN_THUMBS = 8
+# The estimated cost of an accurate seek, as the duration of the content
+# decoded from the previous keyframe.
+SEEK_COST = 5 * Gst.SECOND
+# The width of the tiles the waveforms are drawn in. The tiles next to
+# the visible ones are also drawn, so there is always a little extra
+# surface when scrolling while playing.
+WAVEFORM_TILE_WIDTH = 256
+# The number of samples of a waveform level aggregated in a sample
+# of the next level, see WaveformPeaks.
+WAVEFORM_LEVEL_FACTOR = 4
+# The number of levels of a waveform: 1x, 4x, 16x, 64x.
+WAVEFORM_LEVELS = 4
 
 PREVIEW_GENERATOR_SIGNALS = {
     "done": (GObject.SIGNAL_RUN_LAST, None, ()),
@@ -76,6 +97,18 @@ GlobalSettings.addConfigOption("previewers_max_cpu",
                                key="max-cpu-usage",
                                default=90)
 
+# The maximum number of previewers running at the same time, per track type.
+GlobalSettings.addConfigOption("previewers_max_jobs",
+                               section="previewers",
+                               key="max-jobs",
+                               default=max(1, multiprocessing.cpu_count() // 4))
+
+# The maximum size in bytes of the thumbnails and waveforms cache.
+GlobalSettings.addConfigOption("previewers_cache_max_size",
+                               section="previewers",
+                               key="cache-max-size",
+                               default=4 * 1024 ** 3)
+
 
 class PreviewerBin(Gst.Bin, Loggable):
     """Baseclass for elements gathering datas to create previews."""
@@ -86,7 +119,9 @@ class PreviewerBin(Gst.Bin, Loggable):
         self.internal_bin = Gst.parse_bin_from_description(bin_desc, True)
         self.add(self.internal_bin)
         self.add_pad(Gst.GhostPad.new(None, self.internal_bin.sinkpads[0]))
-        self.add_pad(Gst.GhostPad.new(None, self.internal_bin.srcpads[0]))
+        # The bins ending with a sink, like ThumbnailBin, have no src pad.
+        if self.internal_bin.srcpads:
+            self.add_pad(Gst.GhostPad.new(None, self.internal_bin.srcpads[0]))
 
     def finalize(self, proxy=None):
         """Finalizes the previewer, saving data to the disk if needed."""
@@ -102,18 +137,26 @@ class ThumbnailBin(PreviewerBin):
                 "A URI",
                 "",
                 GObject.PARAM_READWRITE),
+        "height": (int,
+                   "Height",
+                   "The height of the thumbnails",
+                   1, GLib.MAXINT32, THUMB_HEIGHT,
+                   GObject.PARAM_READWRITE),
     }
 
+    CAPS = "video/x-raw,format=(string)RGBA,height=(int)%d," \
+        "pixel-aspect-ratio=(fraction)1/1,framerate=2/1"
+
     def __init__(self, bin_desc="videoconvert ! videorate ! "
                  "videoscale method=lanczos ! "
-                 "capsfilter caps=video/x-raw,format=(string)RGBA,"
-                 "height=(int)%d,pixel-aspect-ratio=(fraction)1/1,"
-                 "framerate=2/1 ! gdkpixbufsink name=gdkpixbufsink " %
-                 THUMB_HEIGHT):
+                 "capsfilter name=capsfilter caps=%s ! "
+                 "gdkpixbufsink name=gdkpixbufsink " % (CAPS % THUMB_HEIGHT)):
         PreviewerBin.__init__(self, bin_desc)
 
         self.uri = None
+        self.height = THUMB_HEIGHT
         self.thumb_cache = None
+        self.capsfilter = self.internal_bin.get_by_name("capsfilter")
         self.gdkpixbufsink = self.internal_bin.get_by_name("gdkpixbufsink")
 
     def __addThumbnail(self, message):
@@ -145,12 +188,20 @@ class ThumbnailBin(PreviewerBin):
         if prop.name == 'uri':
             return self.uri
 
+        if prop.name == 'height':
+            return self.height
+
         raise AttributeError('unknown property %s' % prop.name)
 
     def do_set_property(self, prop, value):
         if prop.name == 'uri':
             self.uri = value
-            self.thumb_cache = ThumbnailCache.get(self.uri)
+            self.thumb_cache = ThumbnailCache.get(self.uri, self.height)
+        elif prop.name == 'height':
+            self.height = value
+            self.capsfilter.props.caps = Gst.Caps.from_string(self.CAPS % value)
+            if self.uri:
+                self.thumb_cache = ThumbnailCache.get(self.uri, self.height)
         else:
             raise AttributeError('unknown property %s' % prop.name)
 
@@ -163,15 +214,18 @@ class TeedThumbnailBin(ThumbnailBin):
             self, bin_desc="tee name=t ! queue  "
             "max-size-buffers=0 max-size-bytes=0 max-size-time=0  ! "
             "videoconvert ! videorate ! videoscale method=lanczos ! "
-            "capsfilter caps=video/x-raw,format=(string)RGBA,height=(int)%d,"
-            "pixel-aspect-ratio=(fraction)1/1,"
-            "framerate=2/1 ! gdkpixbufsink name=gdkpixbufsink "
-            "t. ! queue " % THUMB_HEIGHT)
+            "capsfilter name=capsfilter caps=%s ! "
+            "gdkpixbufsink name=gdkpixbufsink "
+            "t. ! queue " % (ThumbnailBin.CAPS % THUMB_HEIGHT))
 
 
 # pylint: disable=too-many-instance-attributes
 class WaveformPreviewer(PreviewerBin):
-    """Bin to generate and save waveforms as a .npy file."""
+    """Bin to generate and save waveforms as a .npy file.
+
+    Attributes:
+        waveform (WaveformPeaks): The generated waveform, once finalized.
+    """
 
     __gproperties__ = {
         "uri": (str,
@@ -197,7 +251,7 @@ class WaveformPreviewer(PreviewerBin):
         self.uri = None
         self.wavefile = None
         self.passthrough = False
-        self.samples = []
+        self.waveform = None
         self.n_samples = 0
         self.duration = 0
         self.prev_pos = 0
@@ -236,46 +290,45 @@ class WaveformPreviewer(PreviewerBin):
                 stream_time = struct.get_value("stream-time")
 
                 if self.peaks is None:
-                    self.peaks = []
-                    for unused_channel in peaks:
-                        self.peaks.append([0] * int(self.n_samples))
+                    # One row per channel, allocated once for the whole stream.
+                    self.peaks = numpy.zeros((len(peaks), int(self.n_samples)))
 
                 pos = int(stream_time / SAMPLE_DURATION)
-                if pos >= len(self.peaks[0]):
+                if pos >= self.peaks.shape[1]:
                     return False
 
-                for i, val in enumerate(peaks):
-                    if val < 0:
-                        val = 10 ** (val / 20) * 100
-                    else:
-                        val = self.peaks[i][pos - 1]
-
-                    # Linearly joins values between to known samples values.
-                    unknowns = range(self.prev_pos + 1, pos)
-                    if unknowns:
-                        prev_val = self.peaks[i][self.prev_pos]
-                        linear_const = (val - prev_val) / len(unknowns)
-                        for temppos in unknowns:
-                            self.peaks[i][temppos] = self.peaks[i][temppos - 1] + linear_const
-
-                    self.peaks[i][pos] = val
-
+                values = numpy.array(
+                    [10 ** (val / 20) * 100 if val < 0 else self.peaks[channel, pos - 1]
+                     for channel, val in enumerate(peaks)])
+
+                # Linearly joins values between to known samples values,
+                # accumulating the steps in the same order as sample by
+                # sample, so the results are exactly the same.
+                n_unknowns = pos - 1 - self.prev_pos
+                if n_unknowns > 0:
+                    prev_values = self.peaks[:, self.prev_pos]
+                    steps = numpy.empty((len(values), n_unknowns + 1))
+                    steps[:, 0] = prev_values
+                    steps[:, 1:] = ((values - prev_values) / n_unknowns)[:, numpy.newaxis]
+                    self.peaks[:, self.prev_pos + 1:pos] = numpy.cumsum(steps, axis=1)[:, 1:]
+
+                self.peaks[:, pos] = values
                 self.prev_pos = pos
 
         return Gst.Bin.do_post_message(self, message)
 
     def finalize(self, proxy=None):
         """Finalizes the previewer, saving data to file if needed."""
-        if not self.passthrough and self.peaks:
+        if not self.passthrough and self.peaks is not None:
             # Let's go mono.
-            if len(self.peaks) > 1:
-                samples = (numpy.array(self.peaks[0]) + numpy.array(self.peaks[1])) / 2
-            else:
-                samples = numpy.array(self.peaks[0])
+            samples = self.peaks[:2].mean(axis=0)
+
+            self.waveform = WaveformPeaks.from_samples(samples)
+            self.waveform.save(self.wavefile)
 
-            self.samples = list(samples)
-            with open(self.wavefile, 'wb') as wavefile:
-                numpy.save(wavefile, samples)
+            manager = PreviewsCacheManager.get(xdg_cache_home())
+            manager.touch(PreviewsCacheManager.KIND_WAVE, os.path.basename(self.wavefile))
+            manager.schedule_eviction()
 
         if proxy and not proxy.get_error():
             proxy_wavefile = get_wavefile_location_for_uri(proxy.get_id())
@@ -295,20 +348,248 @@ Gst.Element.register(None, "teedthumbnailbin", Gst.Rank.NONE,
                      TeedThumbnailBin)
 
 
+class AssetAnalyzer(GObject.Object, Loggable):
+    """Decodes an asset once to create all its previews.
+
+    When an imported asset does not need a proxy, the thumbnails at all
+    the `heights` and the waveform are created in a single pass over the
+    file, instead of one pass for each previewer later. The waveform
+    peaks also provide the audio envelope and the loudness of the asset,
+    see `WaveformPeaks`.
+
+    The analyzers run `max_jobs` at a time, in the order the assets
+    have been imported.
+
+    Attributes:
+        asset (GES.UriClipAsset): The analyzed asset.
+        heights (List[int]): The heights of the missing thumbnails.
+        waveform (bool): Whether the waveform is missing.
+    """
+
+    __gsignals__ = {
+        "done": (GObject.SIGNAL_RUN_LAST, None, ()),
+    }
+
+    # The heights of the thumbnails created for each asset.
+    HEIGHTS = [THUMB_HEIGHT]
+    # The maximum number of analyzers running at the same time.
+    max_jobs = GlobalSettings.previewers_max_jobs
+    # The maximum CPU usage, see `create_cpu_throttling_clock`.
+    max_cpu_usage = GlobalSettings.previewers_max_cpu
+    # The analyzers waiting to be started.
+    pending = collections.deque()
+    # The analyzers running.
+    running = set()
+
+    def __init__(self, asset):
+        GObject.Object.__init__(self)
+        Loggable.__init__(self)
+        self.asset = asset
+        self.pipeline = None
+        self._bins = []
+
+        info = asset.get_info()
+        self.heights = []
+        if [video for video in info.get_video_streams() if not video.is_image()]:
+            self.heights = [height for height in self.HEIGHTS
+                            if not ThumbnailCache.get(asset, height).positions]
+        self.waveform = False
+        if info.get_audio_streams():
+            wavefile = get_wavefile_location_for_uri(asset.get_id())
+            # The waveforms created by older versions are still usable.
+            migrate_legacy_wavefile(wavefile)
+            self.waveform = not os.path.exists(wavefile)
+
+    @classmethod
+    def analyze(cls, asset):
+        """Queues the analysis of the specified asset, if anything is missing.
+
+        Args:
+            asset (GES.UriClipAsset): The asset to analyze.
+
+        Returns:
+            Optional[AssetAnalyzer]: The queued analyzer.
+        """
+        analyzer = cls(asset)
+        if not analyzer.heights and not analyzer.waveform:
+            return None
+
+        cls.pending.append(analyzer)
+        cls.__start_next()
+        return analyzer
+
+    @classmethod
+    def set_max_jobs(cls, max_jobs):
+        """Sets the maximum number of analyzers running at the same time."""
+        cls.max_jobs = max_jobs
+        cls.__start_next()
+
+    @classmethod
+    def __start_next(cls):
+        while cls.pending and len(cls.running) < cls.max_jobs:
+            analyzer = cls.pending.popleft()
+            cls.running.add(analyzer)
+            analyzer.connect("done", cls.__done_cb)
+            analyzer.start()
+
+    @classmethod
+    def __done_cb(cls, analyzer):
+        analyzer.disconnect_by_func(cls.__done_cb)
+        cls.running.discard(analyzer)
+        cls.__start_next()
+
+    def start(self):
+        """Starts decoding the asset."""
+        uri = self.asset.get_id()
+        self.debug("Analyzing %s, thumbnails: %s, waveform: %s",
+                   uri, self.heights, self.waveform)
+        self.pipeline = Gst.Pipeline.new("analysis")
+        decode = Gst.ElementFactory.make("uridecodebin", None)
+        decode.props.uri = uri
+        decode.connect("autoplug-select", self._autoplug_select_cb)
+        decode.connect("pad-added", self._pad_added_cb)
+        self.pipeline.add(decode)
+        self.pipeline.use_clock(create_cpu_throttling_clock(self.max_cpu_usage))
+
+        bus = self.pipeline.get_bus()
+        bus.add_signal_watch()
+        bus.connect("message", self._bus_message_cb)
+        self.pipeline.set_state(Gst.State.PLAYING)
+
+    def stop(self):
+        """Stops decoding the asset."""
+        if self.pipeline:
+            self.pipeline.set_state(Gst.State.NULL)
+            self.pipeline.get_bus().remove_signal_watch()
+            self.pipeline = None
+        self.emit("done")
+
+    def _autoplug_select_cb(self, unused_decode, unused_pad, unused_caps, factory):
+        # Don't decode the streams we don't need, expose them as they are.
+        klass = factory.get_klass()
+        if "Video" in klass and not self.heights:
+            return True
+        if "Audio" in klass and not self.waveform:
+            return True
+        return False
+
+    def _pad_added_cb(self, unused_decode, pad):
+        caps = pad.query_caps(None)
+        name = caps.get_structure(0).get_name()
+        if name == "video/x-raw" and self.heights:
+            elements = [Gst.ElementFactory.make("tee", None)]
+            for height in self.heights:
+                thumbnailbin = Gst.ElementFactory.make("thumbnailbin", None)
+                thumbnailbin.props.height = height
+                thumbnailbin.props.uri = self.asset.get_id()
+                self._bins.append(thumbnailbin)
+                # The thumbnailbin ends with a gdkpixbufsink.
+                elements.extend([Gst.ElementFactory.make("queue", None),
+                                 thumbnailbin])
+            for element in elements:
+                self.pipeline.add(element)
+            tee = elements[0]
+            for queue, thumbnailbin in zip(*[iter(elements[1:])] * 2):
+                tee.link(queue)
+                queue.link(thumbnailbin)
+            # Only the first video stream.
+            self.heights = []
+        elif name == "audio/x-raw" and self.waveform:
+            waveformbin = Gst.ElementFactory.make("waveformbin", None)
+            waveformbin.props.uri = self.asset.get_id()
+            waveformbin.props.duration = self.asset.get_duration()
+            self._bins.append(waveformbin)
+            fakesink = self.__make_fakesink()
+            elements = [waveformbin, fakesink]
+            for element in elements:
+                self.pipeline.add(element)
+            waveformbin.link(fakesink)
+            # Only the first audio stream.
+            self.waveform = False
+        else:
+            self.debug("Ignoring stream %s", name)
+            return
+
+        for element in elements:
+            element.sync_state_with_parent()
+        pad.link(elements[0].get_static_pad("sink"))
+
+    @staticmethod
+    def __make_fakesink():
+        fakesink = Gst.ElementFactory.make("fakesink", None)
+        fakesink.props.qos = False
+        fakesink.props.sync = True
+        return fakesink
+
+    def _bus_message_cb(self, unused_bus, message):
+        if message.type == Gst.MessageType.EOS:
+            for previewer_bin in self._bins:
+                previewer_bin.finalize()
+            self.stop()
+        elif message.type == Gst.MessageType.ERROR:
+            self.warning("Failed analyzing %s: %s", self.asset.get_id(),
+                         message.parse_error())
+            self.stop()
+
+
 class PreviewGeneratorManager(Loggable):
-    """Manager for running the previewers."""
+    """Manager for running the previewers.
+
+    Runs up to `max_jobs` previewers at a time per GES.TrackType, as long
+    as the CPU usage stays below `max_cpu_usage`. The queued previewers
+    are ranked by the distance of their clip to the viewport and then to
+    the playhead, the closest being started first.
+
+    Attributes:
+        max_jobs (int): The maximum number of concurrent previewers
+            per GES.TrackType.
+        max_cpu_usage (int): The CPU usage in percent above which
+            no additional previewer is started.
+        viewport (Optional[List[int]]): The start and end of the visible
+            part of the timeline, in nanoseconds.
+        playhead (int): The position of the playhead, in nanoseconds.
+    """
+
+    # Millis to wait before checking again whether more previewers
+    # can be started.
+    CPU_CHECK_INTERVAL = 1000
 
     def __init__(self):
         Loggable.__init__(self)
 
-        # The current Previewer per GES.TrackType.
-        self._current_previewers = {}
-        # The queue of Previewers.
+        self.max_jobs = GlobalSettings.previewers_max_jobs
+        self.max_cpu_usage = GlobalSettings.previewers_max_cpu
+        self.viewport = None
+        self.playhead = 0
+
+        # The running Previewers per GES.TrackType.
+        self._running_previewers = {
+            GES.TrackType.AUDIO: [],
+            GES.TrackType.VIDEO: []
+        }
+        # The heap of (priority, order, Previewer) entries per GES.TrackType.
         self._previewers = {
             GES.TrackType.AUDIO: [],
             GES.TrackType.VIDEO: []
         }
+        # The Previewers in the heaps.
+        self._queued_previewers = set()
+        # The order in which the Previewers have been queued, to start
+        # first the oldest among the ones with the same priority.
+        self.__order = 0
         self._running = True
+        self._cpu_usage_tracker = CPUUsageTracker()
+        self.__retry_id = None
+
+    @property
+    def queued_jobs(self):
+        """Gets the number of previewers waiting to be started."""
+        return len(self._queued_previewers)
+
+    @property
+    def running_jobs(self):
+        """Gets the number of previewers being run."""
+        return sum(len(previewers) for previewers in self._running_previewers.values())
 
     def add_previewer(self, previewer):
         """Adds the specified previewer to the queue.
@@ -318,38 +599,82 @@ class PreviewGeneratorManager(Loggable):
         """
         track_type = previewer.track_type
 
-        current = self._current_previewers.get(track_type)
-        if previewer in self._previewers[track_type] or previewer is current:
+        if previewer in self._queued_previewers or \
+                previewer in self._running_previewers[track_type]:
             # Already in the queue or already processing.
             return
 
-        if not self._previewers[track_type] and current is None:
-            self._start_previewer(previewer)
-        else:
-            self._previewers[track_type].insert(0, previewer)
+        self.__order += 1
+        entry = (self._priority(previewer), self.__order, previewer)
+        heapq.heappush(self._previewers[track_type], entry)
+        self._queued_previewers.add(previewer)
+        self.__start_next_previewers(track_type)
 
     def _start_previewer(self, previewer):
-        self._current_previewers[previewer.track_type] = previewer
+        self._running_previewers[previewer.track_type].append(previewer)
         previewer.connect("done", self.__previewer_done_cb)
         previewer.start_generation()
 
+    def _priority(self, previewer):
+        """Ranks the previewer, the lowest being started first.
+
+        Returns:
+            List[int]: The distances from the previewed clip to the viewport
+                and to the playhead, in nanoseconds.
+        """
+        start = previewer.ges_elem.props.start
+        end = start + previewer.ges_elem.props.duration
+        if self.viewport is None:
+            viewport_distance = 0
+        else:
+            viewport_start, viewport_end = self.viewport
+            viewport_distance = max(0, viewport_start - end, start - viewport_end)
+        playhead_distance = max(0, self.playhead - end, start - self.playhead)
+        return viewport_distance, playhead_distance
+
+    def set_viewport(self, start, end):
+        """Sets the visible part of the timeline and re-ranks the queue.
+
+        Args:
+            start (int): The start of the viewport, in nanoseconds.
+            end (int): The end of the viewport, in nanoseconds.
+        """
+        if self.viewport == (start, end):
+            return
+        self.viewport = (start, end)
+        self._rerank()
+
+    def _rerank(self):
+        """Updates the priorities of the queued previewers."""
+        for entries in self._previewers.values():
+            entries[:] = [(self._priority(previewer), order, previewer)
+                          for unused_priority, order, previewer in entries]
+            heapq.heapify(entries)
+
+    def _pop_next_previewer(self, track_type):
+        """Removes from the queue the previewer to be started next."""
+        unused_priority, unused_order, previewer = heapq.heappop(self._previewers[track_type])
+        self._queued_previewers.remove(previewer)
+        return previewer
+
     @contextlib.contextmanager
     def paused(self, interrupt=False):
         """Pauses (and flushes if interrupt=True) managed previewers."""
+        running_previewers = [previewer
+                              for previewers in self._running_previewers.values()
+                              for previewer in previewers]
         if interrupt:
-            for previewer in list(self._current_previewers.values()):
+            for previewer in running_previewers:
                 previewer.stop_generation()
 
-            for previewers in self._previewers.values():
-                for previewer in previewers:
-                    previewer.stop_generation()
+            for previewer in list(self._queued_previewers):
+                previewer.stop_generation()
         else:
-            for previewer in list(self._current_previewers.values()):
+            for previewer in running_previewers:
                 previewer.pause_generation()
 
-            for previewers in self._previewers.values():
-                for previewer in previewers:
-                    previewer.pause_generation()
+            for previewer in list(self._queued_previewers):
+                previewer.pause_generation()
 
         try:
             self._running = False
@@ -360,21 +685,56 @@ class PreviewGeneratorManager(Loggable):
         finally:
             self._running = True
             for track_type in self._previewers:
-                self.__start_next_previewer(track_type)
+                self.__start_next_previewers(track_type)
 
     def __previewer_done_cb(self, previewer):
-        self.__start_next_previewer(previewer.track_type)
-
-    def __start_next_previewer(self, track_type):
-        next_previewer = self._current_previewers.pop(track_type, None)
-        if next_previewer:
-            next_previewer.disconnect_by_func(self.__previewer_done_cb)
+        previewer.disconnect_by_func(self.__previewer_done_cb)
+        running = self._running_previewers[previewer.track_type]
+        if previewer in running:
+            running.remove(previewer)
+        self.__start_next_previewers(previewer.track_type)
 
+    def __start_next_previewers(self, track_type):
         if not self._running:
             return
 
-        if self._previewers[track_type]:
-            self._start_previewer(self._previewers[track_type].pop())
+        running = self._running_previewers[track_type]
+        if not self._previewers[track_type] or len(running) >= self.max_jobs:
+            return
+
+        if running:
+            # Sample the usage once per pass, over the time elapsed since
+            # the previous pass, otherwise the window would be too short.
+            usage = self._cpu_usage_tracker.usage()
+            self._cpu_usage_tracker.reset()
+            if usage >= self.max_cpu_usage:
+                self.log("Not starting more previewers, the CPU usage is %.1f%%", usage)
+                self.__schedule_retry()
+                return
+
+        while self._previewers[track_type] and len(running) < self.max_jobs:
+            self._start_previewer(self._pop_next_previewer(track_type))
+
+    def set_max_jobs(self, max_jobs):
+        """Sets the maximum number of concurrent previewers per track type.
+
+        The running previewers are not stopped when lowering it.
+        """
+        self.max_jobs = max_jobs
+        for track_type in self._previewers:
+            self.__start_next_previewers(track_type)
+
+    def __schedule_retry(self):
+        if self.__retry_id is not None:
+            return
+        self.__retry_id = GLib.timeout_add(self.CPU_CHECK_INTERVAL, self.__retry_cb,
+                                           priority=GLib.PRIORITY_LOW)
+
+    def __retry_cb(self):
+        self.__retry_id = None
+        for track_type in self._previewers:
+            self.__start_next_previewers(track_type)
+        return False
 
 
 class Previewer(Gtk.Layout):
@@ -447,6 +807,8 @@ class VideoPreviewer(Previewer, Zoomable, Loggable):
         # The positions for which we failed to get a pixbuf.
         self.failures = set()
         self._thumb_cb_id = None
+        # The [start, stop) range being decoded sequentially, if any.
+        self._sweep_range = None
 
         self.thumbs = {}
         self.thumb_height = THUMB_HEIGHT
@@ -473,6 +835,7 @@ class VideoPreviewer(Previewer, Zoomable, Loggable):
         self.connect("notify::height-request", self._height_changed_cb)
 
     def pause_generation(self):
+        self._sweep_range = None
         if self.pipeline:
             self.pipeline.set_state(Gst.State.READY)
 
@@ -506,6 +869,9 @@ class VideoPreviewer(Previewer, Zoomable, Loggable):
         decode = pipeline.get_by_name("decode")
         decode.connect("autoplug-select", self._autoplug_select_cb)
 
+        # Slows down the sweeps, see _start_sweep.
+        pipeline.use_clock(create_cpu_throttling_clock(self._max_cpu_usage))
+
         self.__preroll_timeout_id = GLib.timeout_add_seconds(MAX_BRINGING_TO_PAUSED_DURATION,
                                                              self.__preroll_timed_out_cb)
         pipeline.get_bus().add_signal_watch()
@@ -530,6 +896,10 @@ class VideoPreviewer(Previewer, Zoomable, Loggable):
             self.stop_generation()
             return
 
+        if self._should_sweep():
+            self._start_sweep()
+            return
+
         usage_percent = self.cpu_usage_tracker.usage()
         if usage_percent < self._max_cpu_usage:
             self.interval *= 0.9
@@ -603,6 +973,60 @@ class VideoPreviewer(Previewer, Zoomable, Loggable):
         # and then the next thumbnail generation operation will be scheduled.
         return False
 
+    def _should_sweep(self):
+        """Returns whether decoding sequentially is cheaper than seeking."""
+        if len(self.queue) < SWEEP_MIN_THUMBS:
+            return False
+        sweep_duration = max(self.queue) - min(self.queue)
+        return sweep_duration <= len(self.queue) * SEEK_COST
+
+    def _start_sweep(self):
+        """Creates the missing thumbnails by decoding the clip once.
+
+        All the frames output by videorate in the range are captured,
+        see _add_swept_pixbuf. The pipeline posts EOS at the end.
+        """
+        start = min(self.queue)
+        stop = max(self.queue) + THUMB_PERIOD
+        self._sweep_range = (start, stop)
+        self.debug("Sweeping %s - %s for %d thumbnails",
+                   Gst.TIME_ARGS(start), Gst.TIME_ARGS(stop), len(self.queue))
+        self.pipeline.seek(1.0,
+                           Gst.Format.TIME,
+                           Gst.SeekFlags.FLUSH | Gst.SeekFlags.ACCURATE,
+                           Gst.SeekType.SET, start,
+                           Gst.SeekType.SET, stop)
+        self.pipeline.set_state(Gst.State.PLAYING)
+
+    def _add_swept_pixbuf(self, stream_time, pixbuf):
+        """Saves a thumbnail obtained while sweeping."""
+        position = int(round(stream_time / THUMB_PERIOD)) * THUMB_PERIOD
+        if position not in self.thumb_cache.positions:
+            self.thumb_cache[position] = pixbuf
+        try:
+            self.queue.remove(position)
+        except ValueError:
+            pass
+
+        thumb = self.thumbs.get(position)
+        if thumb:
+            thumb.set_from_pixbuf(pixbuf)
+            thumb.set_visible(True)
+            self.queue_draw()
+
+    def _finish_sweep(self):
+        """Handles the end of the sweep."""
+        start, stop = self._sweep_range
+        self._sweep_range = None
+        self.pipeline.set_state(Gst.State.PAUSED)
+        for position in self.queue:
+            if start <= position < stop:
+                self.warning("Thumbnail generation failed at %s", position)
+                self.failures.add(position)
+        self.queue = [position for position in self.queue
+                      if position not in self.failures]
+        self._schedule_next_thumb_generation()
+
     @property
     def thumb_interval(self):
         """Gets the interval for which a thumbnail is displayed.
@@ -633,6 +1057,11 @@ class VideoPreviewer(Previewer, Zoomable, Loggable):
         element_left = quantize(self.ges_elem.props.in_point, interval)
         element_right = self.ges_elem.props.in_point + self.ges_elem.props.duration
         y = (self.props.height_request - self.thumb_height) / 2
+        pixbufs = {}
+        if not isinstance(self.ges_elem, GES.ImageSource):
+            # The thumbnails not decoded yet are set in _thumb_decoded_cb.
+            pixbufs = self.thumb_cache.get_range(element_left, element_right,
+                                                 interval, self._thumb_decoded_cb)
         for position in range(element_left, element_right, interval):
             x = Zoomable.nsToPixel(position) - self.nsToPixel(self.ges_elem.props.in_point)
             try:
@@ -647,9 +1076,10 @@ class VideoPreviewer(Previewer, Zoomable, Loggable):
                 thumb.set_from_pixbuf(self.__image_pixbuf)
                 thumb.set_visible(True)
             elif position in self.thumb_cache:
-                pixbuf = self.thumb_cache[position]
-                thumb.set_from_pixbuf(pixbuf)
-                thumb.set_visible(True)
+                pixbuf = pixbufs.get(position)
+                if pixbuf is not None:
+                    thumb.set_from_pixbuf(pixbuf)
+                    thumb.set_visible(True)
             else:
                 if position not in self.failures and position != self.position:
                     queue.append(position)
@@ -660,6 +1090,15 @@ class VideoPreviewer(Previewer, Zoomable, Loggable):
         if queue:
             self.become_controlled()
 
+    def _thumb_decoded_cb(self, position, pixbuf):
+        """Sets the pixbuf decoded from the cache for the specified position."""
+        thumb = self.thumbs.get(position)
+        if thumb is None:
+            # The zoom or the clip changed in the meanwhile.
+            return
+        thumb.set_from_pixbuf(pixbuf)
+        thumb.set_visible(True)
+
     def _set_pixbuf(self, pixbuf):
         """Sets the pixbuf for the thumbnail at the expected position."""
         position = self.position
@@ -697,11 +1136,20 @@ class VideoPreviewer(Previewer, Zoomable, Loggable):
             # We got a thumbnail pixbuf.
             struct = message.get_structure()
             struct_name = struct.get_name()
-            if struct_name == "preroll-pixbuf":
+            if self._sweep_range:
+                if struct_name == "pixbuf":
+                    self._add_swept_pixbuf(struct.get_value("stream-time"),
+                                           struct.get_value("pixbuf"))
+            elif struct_name == "preroll-pixbuf":
                 pixbuf = struct.get_value("pixbuf")
                 self._set_pixbuf(pixbuf)
         elif message.src == self.pipeline and \
-                message.type == Gst.MessageType.ASYNC_DONE:
+                message.type == Gst.MessageType.EOS:
+            if self._sweep_range:
+                self._finish_sweep()
+        elif message.src == self.pipeline and \
+                message.type == Gst.MessageType.ASYNC_DONE and \
+                not self._sweep_range:
             if self.position >= 0:
                 self.warning("Thumbnail generation failed at %s", self.position)
                 self.failures.add(self.position)
@@ -767,6 +1215,8 @@ class VideoPreviewer(Previewer, Zoomable, Loggable):
             GLib.source_remove(self._thumb_cb_id)
             self._thumb_cb_id = None
 
+        self._sweep_range = None
+
         if self.pipeline:
             self.pipeline.get_bus().remove_signal_watch()
             self.pipeline.set_state(Gst.State.NULL)
@@ -791,43 +1241,410 @@ class Thumbnail(Gtk.Image):
         self.props.height_request = height
 
 
+class ThumbnailStore(Loggable):
+    """Database holding the thumbnails of all the assets.
+
+    Thumbnails are keyed by (file hash, height, position) in a single
+    indexed table. Each thread gets its own connection to the database,
+    created the first time it's needed. Besides the main thread, only the
+    short-lived cache eviction threads use the store, and they close their
+    connection when done.
+
+    Attributes:
+        dbfile (str): The path to the sqlite3 database.
+    """
+
+    # The stores, by database file path.
+    stores_by_path = {}
+
+    def __init__(self, dbfile):
+        Loggable.__init__(self)
+        self.dbfile = dbfile
+        self.__connections = threading.local()
+
+        db = self.connection()
+        # Only effective when creating the database. Allows giving back
+        # the space freed by PreviewsCacheManager.
+        db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("CREATE TABLE IF NOT EXISTS Thumbs "
+                   "(Hash TEXT NOT NULL, "
+                   " Height INTEGER NOT NULL, "
+                   " Time INTEGER NOT NULL, "
+                   " Jpeg BLOB NOT NULL, "
+                   " PRIMARY KEY (Hash, Height, Time)) WITHOUT ROWID")
+        # Maps the hash of a file to the hash of the file whose thumbnails
+        # it shares, for example for a proxy and its target.
+        db.execute("CREATE TABLE IF NOT EXISTS Aliases "
+                   "(Hash TEXT NOT NULL PRIMARY KEY, "
+                   " Target TEXT NOT NULL)")
+        db.commit()
+
+    @classmethod
+    def get(cls, cache_dir):
+        """Gets the ThumbnailStore for the specified cache directory.
+
+        Args:
+            cache_dir (str): The directory containing the Pitivi cache.
+
+        Returns:
+            ThumbnailStore: The store saving its data in `cache_dir`.
+        """
+        dbfile = os.path.join(cache_dir, "thumbs.db")
+        if dbfile not in cls.stores_by_path:
+            cls.stores_by_path[dbfile] = ThumbnailStore(dbfile)
+        return cls.stores_by_path[dbfile]
+
+    def connection(self):
+        """Gets the connection to the database for the current thread."""
+        db = getattr(self.__connections, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.dbfile)
+            self.__connections.db = db
+        return db
+
+    def resolve(self, filehash):
+        """Gets the hash under which the thumbnails of `filehash` are saved."""
+        cur = self.connection().execute(
+            "SELECT Target FROM Aliases WHERE Hash = ?", (filehash,))
+        row = cur.fetchone()
+        if row:
+            return row[0]
+        return filehash
+
+    def alias(self, filehash, target_filehash):
+        """Makes `filehash` share the thumbnails of `target_filehash`."""
+        target_filehash = self.resolve(target_filehash)
+        if filehash == target_filehash:
+            return
+
+        db = self.connection()
+        db.execute("DELETE FROM Thumbs WHERE Hash = ?", (filehash,))
+        db.execute("INSERT OR REPLACE INTO Aliases VALUES (?, ?)",
+                   (filehash, target_filehash))
+        db.commit()
+
+    def migrate(self, filehash, legacy_dir, height):
+        """Imports the legacy per-asset database of `filehash`, if any.
+
+        Older versions saved the thumbnails of each asset in a separate
+        sqlite3 database named after the file hash, or in a symlink to
+        the database of the proxy target. The legacy file is removed
+        once imported.
+
+        Args:
+            filehash (str): The hash of the file.
+            legacy_dir (str): The directory containing the legacy databases.
+            height (int): The height of the thumbnails in the legacy database.
+        """
+        path = os.path.join(legacy_dir, filehash)
+        if os.path.islink(path):
+            target_filehash = os.path.basename(os.readlink(path))
+            self.migrate(target_filehash, legacy_dir, height)
+            self.alias(filehash, target_filehash)
+            os.remove(path)
+            return
+
+        if not os.path.isfile(path):
+            return
+
+        self.debug("Migrating legacy thumbnails database %s", path)
+        db = self.connection()
+        db.commit()
+        try:
+            db.execute("ATTACH DATABASE ? AS legacy", (path,))
+            try:
+                db.execute("INSERT OR IGNORE INTO Thumbs "
+                           "SELECT ?, ?, Time, Jpeg FROM legacy.Thumbs",
+                           (filehash, height))
+                db.commit()
+            finally:
+                db.execute("DETACH DATABASE legacy")
+        except sqlite3.DatabaseError as e:
+            self.warning("Failed to migrate %s: %s", path, e)
+        os.remove(path)
+
+    def commit(self):
+        """Saves the changes done with the current thread's connection."""
+        self.connection().commit()
+
+    def close(self):
+        """Saves the changes and closes the current thread's connection."""
+        db = getattr(self.__connections, "db", None)
+        if db is None:
+            return
+        del self.__connections.db
+        db.commit()
+        db.close()
+
+
+class CacheEvictionThread(Thread):
+    """Thread removing the least recently used previews above the budget.
+
+    Attributes:
+        manager (PreviewsCacheManager): The manager of the cache.
+        accesses (dict): The (kind, key) -> time accesses not saved yet.
+        protected (set): The hashes of the thumbnails which are in use.
+    """
+
+    def __init__(self, manager, accesses, protected):
+        Thread.__init__(self)
+        self.manager = manager
+        self.accesses = accesses
+        self.protected = protected
+
+    def process(self):
+        try:
+            evicted, evicted_size = self.manager.evict(self.accesses, self.protected)
+        except sqlite3.OperationalError as e:
+            self.warning("Failed to evict the previews: %s", e)
+            evicted, evicted_size = 0, 0
+        finally:
+            ThumbnailStore.get(self.manager.cache_dir).close()
+        GLib.idle_add(self.manager.eviction_done, evicted, evicted_size)
+
+
+class PreviewsCacheManager(Loggable):
+    """Keeps the previews cache below a maximum size.
+
+    The last access time of each thumbnails set and waveform file is
+    tracked, and the least recently used ones are evicted in a thread
+    when the total size exceeds `max_size`.
+
+    Attributes:
+        cache_dir (str): The directory containing the Pitivi cache.
+        max_size (int): The budget in bytes.
+        hits (int): The number of previews found in the cache.
+        misses (int): The number of previews not found in the cache.
+        evictions (int): The number of evicted entries.
+        evicted_size (int): The total size in bytes of the evicted entries.
+    """
+
+    KIND_THUMBS = "thumbs"
+    KIND_WAVE = "wave"
+
+    # Seconds to wait before evicting, to group the changes.
+    EVICTION_DELAY = 30
+
+    # The managers, by cache directory.
+    managers_by_dir = {}
+
+    def __init__(self, cache_dir):
+        Loggable.__init__(self)
+        self.cache_dir = cache_dir
+        self.max_size = GlobalSettings.previewers_cache_max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_size = 0
+
+        self._store = ThumbnailStore.get(cache_dir)
+        db = self._store.connection()
+        db.execute("CREATE TABLE IF NOT EXISTS Accesses "
+                   "(Kind TEXT NOT NULL, "
+                   " Key TEXT NOT NULL, "
+                   " Time REAL NOT NULL, "
+                   " PRIMARY KEY (Kind, Key)) WITHOUT ROWID")
+        db.commit()
+
+        # The accesses which have not been saved yet.
+        self.__accesses = {}
+        self.__eviction_id = None
+        self.__eviction_thread = None
+
+    @classmethod
+    def get(cls, cache_dir):
+        """Gets the PreviewsCacheManager for the specified cache directory."""
+        if cache_dir not in cls.managers_by_dir:
+            cls.managers_by_dir[cache_dir] = PreviewsCacheManager(cache_dir)
+        return cls.managers_by_dir[cache_dir]
+
+    def touch(self, kind, key):
+        """Marks the specified entry as just used.
+
+        Args:
+            kind (str): The kind of entry, KIND_THUMBS or KIND_WAVE.
+            key (str): The hash of the file for KIND_THUMBS, or the
+                name of the waveform file for KIND_WAVE.
+        """
+        self.__accesses[(kind, key)] = time.time()
+
+    def hit(self):
+        """Counts a preview found in the cache."""
+        self.hits += 1
+
+    def miss(self):
+        """Counts a preview not found in the cache."""
+        self.misses += 1
+
+    def schedule_eviction(self):
+        """Schedules the eviction of the least recently used entries."""
+        if self.__eviction_id is not None:
+            return
+        self.__eviction_id = GLib.timeout_add_seconds(self.EVICTION_DELAY,
+                                                      self.__eviction_cb,
+                                                      priority=GLib.PRIORITY_LOW)
+
+    def __eviction_cb(self):
+        self.__eviction_id = None
+        if self.__eviction_thread is not None:
+            # Still evicting, try again later.
+            self.schedule_eviction()
+            return False
+
+        accesses = self.__accesses
+        self.__accesses = {}
+        protected = {cache.filehash for cache in ThumbnailCache.instances}
+        self.__eviction_thread = CacheEvictionThread(self, accesses, protected)
+        self.__eviction_thread.start()
+        return False
+
+    def eviction_done(self, evicted, evicted_size):
+        """Handles the end of an eviction, in the main thread."""
+        self.__eviction_thread = None
+        self.evictions += evicted
+        self.evicted_size += evicted_size
+        self.debug("Cache stats: %d hits, %d misses, %d evictions (%d bytes)",
+                   self.hits, self.misses, self.evictions, self.evicted_size)
+        return False
+
+    def __entries(self, db):
+        """Yields the (kind, key, size) of the entries in the cache."""
+        cur = db.execute("SELECT Hash, SUM(LENGTH(Jpeg)) FROM Thumbs GROUP BY Hash")
+        for filehash, size in cur.fetchall():
+            yield self.KIND_THUMBS, filehash, size
+
+        waves_dir = os.path.join(self.cache_dir, "waves")
+        if os.path.isdir(waves_dir):
+            for entry in os.scandir(waves_dir):
+                yield self.KIND_WAVE, entry.name, entry.stat(follow_symlinks=False).st_size
+
+    def evict(self, accesses, protected):
+        """Removes the least recently used entries above the budget.
+
+        Meant to be called in a separate thread.
+
+        Args:
+            accesses (dict): The (kind, key) -> time accesses to save first.
+            protected (set): The hashes of the thumbnails not to be evicted.
+
+        Returns:
+            List[int]: The number of evicted entries and their total size.
+        """
+        db = self._store.connection()
+        db.executemany("INSERT OR REPLACE INTO Accesses VALUES (?, ?, ?)",
+                       [(kind, key, access_time)
+                        for (kind, key), access_time in accesses.items()])
+        db.commit()
+
+        cur = db.execute("SELECT Kind, Key, Time FROM Accesses")
+        last_accesses = {(kind, key): access_time
+                         for kind, key, access_time in cur.fetchall()}
+
+        now = time.time()
+        entries = []
+        unknown = []
+        total_size = 0
+        for kind, key, size in self.__entries(db):
+            total_size += size
+            try:
+                access_time = last_accesses[(kind, key)]
+            except KeyError:
+                # Consider the entries created before we tracked them as new.
+                access_time = now
+                unknown.append((kind, key, now))
+            entries.append((access_time, kind, key, size))
+        db.executemany("INSERT OR REPLACE INTO Accesses VALUES (?, ?, ?)", unknown)
+        db.commit()
+
+        self.log("The previews cache takes %d bytes out of %d", total_size, self.max_size)
+        evicted = 0
+        evicted_size = 0
+        entries.sort()
+        for unused_time, kind, key, size in entries:
+            if total_size <= self.max_size:
+                break
+            if kind == self.KIND_THUMBS:
+                if key in protected:
+                    continue
+                db.execute("DELETE FROM Thumbs WHERE Hash = ?", (key,))
+            else:
+                try:
+                    os.remove(os.path.join(self.cache_dir, "waves", key))
+                except FileNotFoundError:
+                    pass
+            db.execute("DELETE FROM Accesses WHERE Kind = ? AND Key = ?", (kind, key))
+            self.debug("Evicted %s %s (%d bytes)", kind, key, size)
+            total_size -= size
+            evicted += 1
+            evicted_size += size
+        db.commit()
+        if evicted:
+            db.execute("PRAGMA incremental_vacuum").fetchall()
+            db.commit()
+
+        return evicted, evicted_size
+
+
 class ThumbnailCache(Loggable):
     """Cache for the thumbnails of an asset.
 
-    Uses a separate sqlite3 database for each asset.
+    The thumbnails of all the assets are saved in a shared `ThumbnailStore`.
     """
 
-    # The cache of caches.
-    caches_by_uri = {}
-
-    def __init__(self, uri):
+    # The cache of caches, by (URI, height), least recently used first.
+    caches_by_uri = collections.OrderedDict()
+    # The maximum number of caches kept in `caches_by_uri`.
+    MAX_CACHES = 256
+    # All the existing caches.
+    instances = weakref.WeakSet()
+    # The decoded pixbufs, by (file hash, height, position),
+    # least recently used first.
+    pixbufs = collections.OrderedDict()
+    # The maximum number of decoded pixbufs kept in `pixbufs`.
+    MAX_PIXBUFS = 2000
+    # The thread pool decoding the JPEG data.
+    decoder_pool = None
+
+    def __init__(self, uri, height=THUMB_HEIGHT):
         Loggable.__init__(self)
-        self._filehash = hash_file(Gst.uri_get_location(uri))
-        thumbs_cache_dir = get_dir(os.path.join(xdg_cache_home(), "thumbs"))
-        self._dbfile = os.path.join(thumbs_cache_dir, self._filehash)
-        self._db = sqlite3.connect(self._dbfile)
-        self._cur = self._db.cursor()
-        self._cur.execute("CREATE TABLE IF NOT EXISTS Thumbs "
-                          "(Time INTEGER NOT NULL PRIMARY KEY, "
-                          " Jpeg BLOB NOT NULL)")
+        self.height = height
+        cache_dir = xdg_cache_home()
+        self._store = ThumbnailStore.get(cache_dir)
+        self._manager = PreviewsCacheManager.get(cache_dir)
+        filehash = FingerprintIndex.get(cache_dir).fingerprint(Gst.uri_get_location(uri))
+        self._store.migrate(filehash, os.path.join(cache_dir, "thumbs"), height)
+        self._filehash = self._store.resolve(filehash)
+        self._manager.touch(PreviewsCacheManager.KIND_THUMBS, self._filehash)
+        ThumbnailCache.instances.add(self)
         # The cached (width, height) of the images.
         self._image_size = (0, 0)
         # The cached positions available in the database.
         self.positions = self.__existing_positions()
         # The ID of the autosave event.
         self.__autosave_id = None
+        # The callbacks waiting for a pixbuf being decoded, by position.
+        self.__decoding = {}
+
+    @property
+    def filehash(self):
+        """Gets the hash under which the thumbnails are saved."""
+        return self._filehash
 
     def __existing_positions(self):
-        self._cur.execute("SELECT Time FROM Thumbs")
-        return {row[0] for row in self._cur.fetchall()}
+        cur = self._store.connection().execute(
+            "SELECT Time FROM Thumbs WHERE Hash = ? AND Height = ?",
+            (self._filehash, self.height))
+        return {row[0] for row in cur.fetchall()}
 
     @classmethod
-    def get(cls, obj):
+    def get(cls, obj, height=THUMB_HEIGHT):
         """Gets a ThumbnailCache for the specified object.
 
         Args:
             obj (str or GES.UriClipAsset): The object for which to get a cache,
                 it can be a string representing a URI, or a GES.UriClipAsset.
+            height (Optional[int]): The height of the thumbnails.
 
         Returns:
             ThumbnailCache: The cache for the object.
@@ -839,9 +1656,14 @@ class ThumbnailCache(Loggable):
         else:
             raise ValueError("Unhandled type: %s" % type(obj))
 
-        if uri not in cls.caches_by_uri:
-            cls.caches_by_uri[uri] = ThumbnailCache(uri)
-        return cls.caches_by_uri[uri]
+        key = (uri, height)
+        try:
+            cls.caches_by_uri.move_to_end(key)
+        except KeyError:
+            cls.caches_by_uri[key] = ThumbnailCache(uri, height)
+            if len(cls.caches_by_uri) > cls.MAX_CACHES:
+                cls.caches_by_uri.popitem(last=False)
+        return cls.caches_by_uri[key]
 
     def copy(self, uri):
         """Copies `self` to the specified `uri`.
@@ -849,15 +1671,9 @@ class ThumbnailCache(Loggable):
         Args:
             uri (str): The place where to copy/save the ThumbnailCache
         """
-        filehash = hash_file(Gst.uri_get_location(uri))
-        thumbs_cache_dir = get_dir(os.path.join(xdg_cache_home(), "thumbs"))
-        dbfile = os.path.join(thumbs_cache_dir, filehash)
-
-        try:
-            os.remove(dbfile)
-        except FileNotFoundError:
-            pass
-        os.symlink(self._dbfile, dbfile)
+        fingerprints = FingerprintIndex.get(xdg_cache_home())
+        filehash = fingerprints.fingerprint(Gst.uri_get_location(uri))
+        self._store.alias(filehash, self._filehash)
 
     @property
     def image_size(self):
@@ -867,8 +1683,10 @@ class ThumbnailCache(Loggable):
             List[int]: The width and height of the images in the cache.
         """
         if self._image_size[0] is 0:
-            self._cur.execute("SELECT * FROM Thumbs LIMIT 1")
-            row = self._cur.fetchone()
+            cur = self._store.connection().execute(
+                "SELECT Time, Jpeg FROM Thumbs WHERE Hash = ? AND Height = ? LIMIT 1",
+                (self._filehash, self.height))
+            row = cur.fetchone()
             if row:
                 pixbuf = self.__pixbuf_from_row(row)
                 self._image_size = (pixbuf.get_width(), pixbuf.get_height())
@@ -886,24 +1704,126 @@ class ThumbnailCache(Loggable):
     @staticmethod
     def __pixbuf_from_row(row):
         """Returns the GdkPixbuf.Pixbuf from the specified row."""
-        jpeg = row[1]
+        return ThumbnailCache.__pixbuf_from_jpeg(row[1])
+
+    @staticmethod
+    def __pixbuf_from_jpeg(jpeg):
+        """Returns the GdkPixbuf.Pixbuf from the specified JPEG data."""
         loader = GdkPixbuf.PixbufLoader.new()
         loader.write(jpeg)
         loader.close()
         pixbuf = loader.get_pixbuf()
         return pixbuf
 
+    def __get_decoded(self, position):
+        """Gets the decoded pixbuf for the specified position, if any."""
+        key = (self._filehash, self.height, position)
+        pixbuf = ThumbnailCache.pixbufs.get(key)
+        if pixbuf is not None:
+            ThumbnailCache.pixbufs.move_to_end(key)
+        return pixbuf
+
+    def __set_decoded(self, position, pixbuf):
+        """Keeps the decoded pixbuf for the specified position."""
+        key = (self._filehash, self.height, position)
+        ThumbnailCache.pixbufs[key] = pixbuf
+        ThumbnailCache.pixbufs.move_to_end(key)
+        if len(ThumbnailCache.pixbufs) > ThumbnailCache.MAX_PIXBUFS:
+            ThumbnailCache.pixbufs.popitem(last=False)
+
+    @classmethod
+    def __get_decoder_pool(cls):
+        if cls.decoder_pool is None:
+            cls.decoder_pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=max(1, multiprocessing.cpu_count() // 2))
+        return cls.decoder_pool
+
+    def get_range(self, start, end, interval, callback):
+        """Gets the thumbnails at the multiples of `interval` in [start, end).
+
+        The thumbnails decoded recently are returned right away. The others
+        are read from the database with a single query and decoded in a
+        thread pool, then passed to `callback` in the main thread.
+
+        Args:
+            start (int): The first position, included.
+            end (int): The last position, excluded.
+            interval (int): The interval between the positions.
+            callback (function): The function called with the position
+                and the GdkPixbuf.Pixbuf of each thumbnail being decoded.
+
+        Returns:
+            dict: The GdkPixbuf.Pixbuf thumbnails already decoded,
+                by position.
+        """
+        pixbufs = {}
+        missing = set()
+        for position in self.positions:
+            if position < start or position >= end or position % interval:
+                continue
+            pixbuf = self.__get_decoded(position)
+            if pixbuf is not None:
+                pixbufs[position] = pixbuf
+            elif position in self.__decoding:
+                self.__decoding[position].append(callback)
+            else:
+                missing.add(position)
+
+        if not missing:
+            return pixbufs
+
+        cur = self._store.connection().execute(
+            "SELECT Time, Jpeg FROM Thumbs WHERE Hash = ? AND Height = ? "
+            "AND Time >= ? AND Time < ? AND Time % ? = 0",
+            (self._filehash, self.height, start, end, interval))
+        pool = self.__get_decoder_pool()
+        for position, jpeg in cur.fetchall():
+            if position not in missing:
+                continue
+            self.__decoding[position] = [callback]
+            future = pool.submit(self.__pixbuf_from_jpeg, jpeg)
+            future.add_done_callback(
+                lambda future, position=position:
+                GLib.idle_add(self.__decoded_cb, position, future))
+
+        return pixbufs
+
+    def __decoded_cb(self, position, future):
+        callbacks = self.__decoding.pop(position, [])
+        try:
+            pixbuf = future.result()
+        except GLib.Error as e:
+            self.warning("Failed to decode the thumbnail at %s: %s", position, e)
+            return False
+
+        self.__set_decoded(position, pixbuf)
+        for callback in callbacks:
+            callback(position, pixbuf)
+        return False
+
     def __contains__(self, position):
         """Returns whether a row for the specified position exists in the DB."""
-        return position in self.positions
+        if position in self.positions:
+            self._manager.hit()
+            return True
+        self._manager.miss()
+        return False
 
     def __getitem__(self, position):
         """Gets the GdkPixbuf.Pixbuf for the specified position."""
-        self._cur.execute("SELECT * FROM Thumbs WHERE Time = ?", (position,))
-        row = self._cur.fetchone()
+        pixbuf = self.__get_decoded(position)
+        if pixbuf is not None:
+            return pixbuf
+
+        cur = self._store.connection().execute(
+            "SELECT Time, Jpeg FROM Thumbs WHERE Hash = ? AND Height = ? AND Time = ?",
+            (self._filehash, self.height, position))
+        row = cur.fetchone()
         if not row:
             raise KeyError(position)
-        return self.__pixbuf_from_row(row)
+        pixbuf = self.__pixbuf_from_row(row)
+        self.__set_decoded(position, pixbuf)
+        return pixbuf
 
     def __setitem__(self, position, pixbuf):
         """Sets a GdkPixbuf.Pixbuf for the specified position."""
@@ -914,9 +1834,11 @@ class ThumbnailCache(Loggable):
             return
         blob = sqlite3.Binary(jpeg)
         # Replace if a row with the same time already exists.
-        self._cur.execute("DELETE FROM Thumbs WHERE  time=?", (position,))
-        self._cur.execute("INSERT INTO Thumbs VALUES (?,?)", (position, blob,))
+        self._store.connection().execute(
+            "INSERT OR REPLACE INTO Thumbs VALUES (?, ?, ?, ?)",
+            (self._filehash, self.height, position, blob))
         self.positions.add(position)
+        self.__set_decoded(position, pixbuf)
         self._schedule_commit()
 
     def _schedule_commit(self):
@@ -940,23 +1862,219 @@ class ThumbnailCache(Loggable):
 
     def commit(self):
         """Saves the cache on disk (in the database)."""
-        self._db.commit()
+        self._store.commit()
         self.log("Saved thumbnail cache file: %s", self._filehash)
+        self._manager.touch(PreviewsCacheManager.KIND_THUMBS, self._filehash)
+        self._manager.schedule_eviction()
 
 
 def get_wavefile_location_for_uri(uri):
-    """Computes the URI where the wave.npy file should be stored."""
-    filename = hash_file(Gst.uri_get_location(uri)) + ".wave.npy"
+    """Computes the path where the peaks.npy file should be stored."""
+    fingerprints = FingerprintIndex.get(xdg_cache_home())
+    filename = fingerprints.fingerprint(Gst.uri_get_location(uri)) + ".peaks.npy"
     cache_dir = get_dir(os.path.join(xdg_cache_home(), "waves"))
 
     return os.path.join(cache_dir, filename)
 
 
+def migrate_legacy_wavefile(wavefile):
+    """Converts the legacy flat .wave.npy file to WaveformPeaks, if any.
+
+    Args:
+        wavefile (str): The path returned by get_wavefile_location_for_uri.
+    """
+    legacy_wavefile = wavefile[:-len(".peaks.npy")] + ".wave.npy"
+    if not os.path.isfile(legacy_wavefile):
+        return
+    with open(legacy_wavefile, "rb") as samples:
+        WaveformPeaks.from_samples(numpy.load(samples)).save(wavefile)
+    os.remove(legacy_wavefile)
+
+
+class WaveformPeaks:
+    """Multi-resolution envelope of an audio stream.
+
+    The envelope is saved as a pyramid of levels. The samples of the base
+    level cover SAMPLE_DURATION each and their min, max and RMS are all the
+    RMS measured by the `level` element. Each sample of the next levels
+    aggregates WAVEFORM_LEVEL_FACTOR samples of the previous level.
+
+    The levels are stored one after the other as rows of (min, max, RMS)
+    float16 values in a single .npy file, so it can be memory-mapped.
+
+    Attributes:
+        data (numpy.ndarray): The (min, max, RMS) rows of all the levels.
+        n_samples (int): The number of samples of the base level.
+    """
+
+    MIN = 0
+    MAX = 1
+    RMS = 2
+
+    def __init__(self, data):
+        self.data = data
+        self.n_samples = self.__base_length(len(data))
+        self.__offsets = [0]
+        for length in self.level_lengths(self.n_samples):
+            self.__offsets.append(self.__offsets[-1] + length)
+
+    @staticmethod
+    def level_lengths(n_samples):
+        """Gets the number of samples of each level."""
+        return [-(-n_samples // WAVEFORM_LEVEL_FACTOR ** level)
+                for level in range(WAVEFORM_LEVELS)]
+
+    @classmethod
+    def __base_length(cls, total_length):
+        """Gets the number of base samples for a total number of rows."""
+        low, high = 0, total_length
+        while low < high:
+            middle = (low + high) // 2
+            if sum(cls.level_lengths(middle)) < total_length:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    @classmethod
+    def from_samples(cls, samples):
+        """Creates the envelope from the RMS of the base samples.
+
+        Args:
+            samples (numpy.ndarray): The RMS values, one per SAMPLE_DURATION.
+
+        Returns:
+            WaveformPeaks: The envelope.
+        """
+        samples = numpy.asarray(samples, dtype=numpy.float64)
+        mins = samples
+        maxs = samples
+        squares = samples ** 2
+        levels = []
+        for level in range(WAVEFORM_LEVELS):
+            if level and len(mins):
+                indices = numpy.arange(0, len(mins), WAVEFORM_LEVEL_FACTOR)
+                counts = numpy.diff(numpy.append(indices, len(mins)))
+                mins = numpy.minimum.reduceat(mins, indices)
+                maxs = numpy.maximum.reduceat(maxs, indices)
+                squares = numpy.add.reduceat(squares, indices) / counts
+            levels.append(numpy.stack([mins, maxs, numpy.sqrt(squares)], axis=1))
+        return cls(numpy.concatenate(levels).astype(numpy.float16))
+
+    @classmethod
+    def load(cls, path):
+        """Memory-maps the envelope saved in the specified file."""
+        return cls(numpy.load(path, mmap_mode="r"))
+
+    def save(self, path):
+        """Saves the envelope in the specified file."""
+        with open(path, "wb") as peaks_file:
+            numpy.save(peaks_file, self.data)
+
+    @staticmethod
+    def level_for(samples_per_pixel):
+        """Gets the coarsest level having at least one sample per pixel.
+
+        Args:
+            samples_per_pixel (float): The number of base samples per pixel.
+        """
+        level = 0
+        while level + 1 < WAVEFORM_LEVELS and \
+                WAVEFORM_LEVEL_FACTOR ** (level + 1) <= samples_per_pixel:
+            level += 1
+        return level
+
+    def get(self, start, end, level=0):
+        """Gets the (min, max, RMS) rows of a level between two base samples.
+
+        Args:
+            start (int): The first base sample, included.
+            end (int): The last base sample, excluded.
+            level (Optional[int]): The level to read.
+
+        Returns:
+            numpy.ndarray: The rows, without copying them.
+        """
+        factor = WAVEFORM_LEVEL_FACTOR ** level
+        offset = self.__offsets[level]
+        length = self.__offsets[level + 1] - offset
+        start = min(max(0, start // factor), length)
+        end = min(max(start, -(-end // factor)), length)
+        return self.data[offset + start:offset + end]
+
+    def rms(self, start=0, end=None, samples_per_pixel=1):
+        """Gets the RMS values between two base samples.
+
+        Reads the coarsest level which still has a sample per pixel.
+
+        Args:
+            start (Optional[int]): The first base sample, included.
+            end (Optional[int]): The last base sample, excluded.
+            samples_per_pixel (Optional[float]): The number of base
+                samples drawn per pixel.
+
+        Returns:
+            numpy.ndarray: The RMS values, without copying them.
+        """
+        if end is None:
+            end = self.n_samples
+        level = self.level_for(samples_per_pixel)
+        return self.get(start, end, level)[:, self.RMS]
+
+    def envelope(self, start=0, end=None, samples_per_pixel=1):
+        """Gets the (min, max, RMS) rows between two base samples.
+
+        Reads the coarsest level which still has a sample per pixel.
+
+        Args:
+            start (Optional[int]): The first base sample, included.
+            end (Optional[int]): The last base sample, excluded.
+            samples_per_pixel (Optional[float]): The number of base
+                samples drawn per pixel.
+
+        Returns:
+            numpy.ndarray: The rows, without copying them.
+        """
+        if end is None:
+            end = self.n_samples
+        level = self.level_for(samples_per_pixel)
+        return self.get(start, end, level)
+
+    def loudness(self):
+        """Gets the loudness of the whole stream.
+
+        Returns:
+            Tuple[float, float]: The peak and the mean RMS levels in dBFS,
+                -inf for silence.
+        """
+        rms = self.rms().astype(numpy.float64)
+        if not len(rms):
+            return float("-inf"), float("-inf")
+        # The samples are 100 * 10 ** (dB / 20), see WaveformPreviewer.
+        with numpy.errstate(divide="ignore"):
+            peak, mean = 20 * numpy.log10(numpy.array(
+                [rms.max(), numpy.sqrt(numpy.mean(rms ** 2))]) / 100)
+        return float(peak), float(mean)
+
+
 class AudioPreviewer(Previewer, Zoomable, Loggable):
-    """Audio previewer using the results from the "level" GStreamer element."""
+    """Audio previewer using the results from the "level" GStreamer element.
+
+    The waveform is drawn in tiles of WAVEFORM_TILE_WIDTH pixels, in a thread
+    pool. The tiles are shared by the previewers of the same media file.
+    """
 
     __gsignals__ = PREVIEW_GENERATOR_SIGNALS
 
+    # The drawn tiles, by (URI, zoom ratio, height, in-point sample, index,
+    # width), least recently used first. The last tile of a clip can be
+    # narrower than WAVEFORM_TILE_WIDTH.
+    tiles = collections.OrderedDict()
+    # The maximum number of tiles kept in `tiles`.
+    MAX_TILES = 512
+    # The thread pool drawing the tiles.
+    tiles_pool = None
+
     def __init__(self, ges_elem, max_cpu_usage):
         Previewer.__init__(self, GES.TrackType.AUDIO, max_cpu_usage)
         Zoomable.__init__(self)
@@ -970,11 +2088,9 @@ class AudioPreviewer(Previewer, Zoomable, Loggable):
 
         asset = self.ges_elem.get_parent().get_asset()
         self.n_samples = asset.get_duration() / SAMPLE_DURATION
-        self.samples = None
-        self.peaks = None
-        self._start = 0
-        self._end = 0
-        self._surface_x = 0
+        self.waveform = None
+        # The futures of the tiles being drawn, by key.
+        self.__tile_futures = {}
 
         # Guard against malformed URIs
         self.wavefile = None
@@ -982,28 +2098,30 @@ class AudioPreviewer(Previewer, Zoomable, Loggable):
 
         self._num_failures = 0
         self.adapter = None
-        self.surface = None
-
-        self._force_redraw = True
 
         self.ges_elem.connect("notify::in-point", self._inpoint_changed_cb)
         self.connect("notify::height-request", self._height_changed_cb)
         self.become_controlled()
 
     def _inpoint_changed_cb(self, unused_b_element, unused_value):
-        self._force_redraw = True
+        self.queue_draw()
 
     def _height_changed_cb(self, unused_widget, unused_param_spec):
-        self._force_redraw = True
+        self.queue_draw()
 
     def _startLevelsDiscovery(self):
         filename = get_wavefile_location_for_uri(self._uri)
 
+        migrate_legacy_wavefile(filename)
+
+        manager = PreviewsCacheManager.get(xdg_cache_home())
         if os.path.exists(filename):
-            with open(filename, "rb") as samples:
-                self.samples = list(numpy.load(samples))
+            manager.hit()
+            manager.touch(PreviewsCacheManager.KIND_WAVE, os.path.basename(filename))
+            self.waveform = WaveformPeaks.load(filename)
             self._startRendering()
         else:
+            manager.miss()
             self.wavefile = filename
             self._launchPipeline()
 
@@ -1013,12 +2131,7 @@ class AudioPreviewer(Previewer, Zoomable, Loggable):
         self.pipeline = Gst.parse_launch("uridecodebin name=decode uri=" +
                                          self._uri + " ! waveformbin name=wave"
                                          " ! fakesink qos=false name=faked")
-        # This line is necessary so we can instantiate GstTranscoder's
-        # GstCpuThrottlingClock below.
-        Gst.ElementFactory.make("uritranscodebin", None)
-        clock = GObject.new(GObject.type_from_name("GstCpuThrottlingClock"))
-        clock.props.cpu_usage = self._max_cpu_usage
-        self.pipeline.use_clock(clock)
+        self.pipeline.use_clock(create_cpu_throttling_clock(self._max_cpu_usage))
         faked = self.pipeline.get_by_name("faked")
         faked.props.sync = True
         self._wavebin = self.pipeline.get_by_name("wave")
@@ -1034,15 +2147,16 @@ class AudioPreviewer(Previewer, Zoomable, Loggable):
         bus.connect("message", self._busMessageCb)
 
     def zoomChanged(self):
-        self._force_redraw = True
+        # The tiles are keyed by zoom ratio, so the new ones will be drawn.
+        self.queue_draw()
 
     def _prepareSamples(self):
         proxy = self.ges_elem.get_parent().get_asset().get_proxy_target()
         self._wavebin.finalize(proxy=proxy)
-        self.samples = self._wavebin.samples
+        self.waveform = self._wavebin.waveform
 
     def _startRendering(self):
-        self.n_samples = len(self.samples)
+        self.n_samples = self.waveform.n_samples
         self.discovered = True
         if self.adapter:
             self.adapter.stop()
@@ -1097,31 +2211,89 @@ class AudioPreviewer(Previewer, Zoomable, Loggable):
             return
 
         clipped_rect = Gdk.cairo_get_clip_rectangle(context)[1]
-
+        height = int(self.get_parent().get_allocation().height)
         num_inpoint_samples = self._get_num_inpoint_samples()
-        drawn_start = self.pixelToNs(clipped_rect.x)
-        drawn_duration = self.pixelToNs(clipped_rect.width)
-        start = int(drawn_start / SAMPLE_DURATION) + num_inpoint_samples
-        end = int((drawn_start + drawn_duration) / SAMPLE_DURATION) + num_inpoint_samples
-
-        if self._force_redraw or self._surface_x > clipped_rect.x or self._end < end:
-            self._start = start
-            end = int(min(self.n_samples, end + (self.pixelToNs(MARGIN) /
-                                                 SAMPLE_DURATION)))
-            self._end = end
-            self._surface_x = clipped_rect.x
-            surface_width = min(self.props.width_request - clipped_rect.x,
-                                clipped_rect.width + MARGIN)
-            surface_height = int(self.get_parent().get_allocation().height)
-            self.surface = renderer.fill_surface(self.samples[start:end],
-                                                 surface_width,
-                                                 surface_height)
-
-            self._force_redraw = False
+        first = clipped_rect.x // WAVEFORM_TILE_WIDTH
+        last = (clipped_rect.x + clipped_rect.width - 1) // WAVEFORM_TILE_WIDTH
 
         context.set_operator(cairo.OPERATOR_OVER)
-        context.set_source_surface(self.surface, self._surface_x, 0)
-        context.paint()
+        for index in range(first - 1, last + 2):
+            x = index * WAVEFORM_TILE_WIDTH
+            width = min(WAVEFORM_TILE_WIDTH, self.props.width_request - x)
+            if x < 0 or width <= 0:
+                continue
+
+            key = (self._uri, Zoomable.zoomratio, height, num_inpoint_samples, index, width)
+            surface = self.__get_tile(key)
+            if surface is None:
+                self.__draw_tile(key)
+            elif first <= index <= last:
+                context.set_source_surface(surface, x, 0)
+                context.rectangle(x, 0, surface.get_width(), surface.get_height())
+                context.fill()
+
+    @classmethod
+    def __get_tiles_pool(cls):
+        if cls.tiles_pool is None:
+            cls.tiles_pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=max(1, multiprocessing.cpu_count() // 2))
+        return cls.tiles_pool
+
+    @classmethod
+    def __get_tile(cls, key):
+        surface = cls.tiles.get(key)
+        if surface is not None:
+            cls.tiles.move_to_end(key)
+        return surface
+
+    def __draw_tile(self, key):
+        """Draws the specified tile in the thread pool."""
+        if key in self.__tile_futures:
+            return
+
+        unused_uri, unused_zoomratio, height, num_inpoint_samples, index, width = key
+        x = index * WAVEFORM_TILE_WIDTH
+
+        start = int(self.pixelToNs(x) / SAMPLE_DURATION) + num_inpoint_samples
+        end = int(self.pixelToNs(x + width) / SAMPLE_DURATION) + num_inpoint_samples
+        end = min(end, int(self.n_samples))
+        if end <= start:
+            return
+
+        # Read a coarser level when zoomed out, and draw its
+        # min/max envelope since each pixel covers several samples.
+        samples_per_pixel = (end - start) / width
+        if WaveformPeaks.level_for(samples_per_pixel):
+            samples = self.waveform.envelope(start, end, samples_per_pixel)
+            envelope = True
+        else:
+            samples = self.waveform.rms(start, end, samples_per_pixel)
+            envelope = False
+
+        future = self.__get_tiles_pool().submit(
+            renderer.fill_surface, samples, width, height, envelope=envelope)
+        self.__tile_futures[key] = future
+        future.add_done_callback(
+            lambda future, key=key:
+            GLib.idle_add(self.__tile_drawn_cb, key, future))
+
+    def __tile_drawn_cb(self, key, future):
+        if self.__tile_futures.get(key) is not future:
+            # Cancelled when the previewer has been released.
+            return False
+        del self.__tile_futures[key]
+
+        try:
+            surface = future.result()
+        except (TypeError, ValueError) as e:
+            self.warning("Failed to draw the waveform tile %s: %s", key, e)
+            return False
+
+        AudioPreviewer.tiles[key] = surface
+        if len(AudioPreviewer.tiles) > AudioPreviewer.MAX_TILES:
+            AudioPreviewer.tiles.popitem(last=False)
+        self.queue_draw()
+        return False
 
     def _emit_done_on_idle(self):
         self.emit("done")
@@ -1160,4 +2332,7 @@ class AudioPreviewer(Previewer, Zoomable, Loggable):
     def release(self):
         """Stops preview generation and cleans the object."""
         self.stop_generation()
+        for future in self.__tile_futures.values():
+            future.cancel()
+        self.__tile_futures.clear()
         Zoomable.__del__(self)
@@ -107,6 +107,11 @@ GlobalSettings.addConfigOption("timelineAutoRipple",
                                key="timeline-autoripple",
                                default=False)
 
+GlobalSettings.addConfigOption("alignmentMeasureDrift",
+                               section="user-interface",
+                               key="alignment-measure-drift",
+                               default=False)
+
 
 class Marquee(Gtk.Box, Loggable):
     """Widget representing a selection area inside the timeline.
@@ -399,6 +404,9 @@ class Timeline(Gtk.EventBox, Zoomable, Loggable):
         self.app.settings.connect("edgeSnapDeadbandChanged",
                                   self.__snap_distance_changed_cb)
 
+        self.hadj.connect("value-changed", self.__hadj_changed_cb)
+        self.hadj.connect("changed", self.__hadj_changed_cb)
+
     def resetSelectionGroup(self):
         self.debug("Reset selection group")
         if self.current_group:
@@ -489,6 +497,7 @@ class Timeline(Gtk.EventBox, Zoomable, Loggable):
             return
 
         self.__last_position = position
+        Previewer.manager.playhead = position
         self.layout.playhead_position = position
         self.layout.queue_draw()
         layout_width = self.layout.get_allocation().width
@@ -1112,6 +1121,16 @@ class Timeline(Gtk.EventBox, Zoomable, Loggable):
         self.zoomed_fitted = False
 
         self.updatePosition()
+        self.__update_previewers_viewport()
+
+    def __hadj_changed_cb(self, unused_hadj):
+        self.__update_previewers_viewport()
+
+    def __update_previewers_viewport(self):
+        """Lets the previewers of the visible clips be started first."""
+        start = self.pixelToNs(self.hadj.get_value())
+        end = self.pixelToNs(self.hadj.get_value() + self.hadj.get_page_size())
+        Previewer.manager.set_viewport(start, end)
 
     def set_best_zoom_ratio(self, allow_zoom_in=False):
         """Sets the zoom level so that the entire timeline is in view."""
@@ -1810,7 +1829,8 @@ class TimelineContainer(Gtk.Grid, Zoomable, Loggable):
             self._project.pipeline.commit_timeline()
             progress_dialog.window.destroy()
 
-        auto_aligner = AutoAligner(self.timeline.selection, alignedCb)
+        auto_aligner = AutoAligner(self.timeline.selection, alignedCb,
+                                   drift=self.app.settings.alignmentMeasureDrift)
         try:
             progress_meter = auto_aligner.start()
             progress_meter.addWatcher(progress_dialog.updatePosition)
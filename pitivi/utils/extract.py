@@ -17,233 +17,160 @@
 # License along with this program; if not, write to the
 # Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
 # Boston, MA 02110-1301, USA.
-"""
-Classes for extracting decoded contents of streams into Python
-
-Code derived from ui/previewer.py.
-"""
-# FIXME reimplement after GES port
-from collections import deque
-
+"""Classes for extracting decoded contents of streams into Python."""
+import numpy
 from gi.repository import Gst
 
 from pitivi.utils.loggable import Loggable
-# from pitivi.elements.singledecodebin import SingleDecodeBin
-# from pitivi.elements.extractionsink import ExtractionSink
-
-
-def linkDynamic(element, target):
-
-    def pad_added(unused_bin, pad, target):
-        compatpad = target.get_compatible_pad(pad)
-        if compatpad:
-            pad.link_full(compatpad, Gst.PAD_LINK_CHECK_NOTHING)
-    element.connect("pad-added", pad_added, target)
-
-
-def pipeline(graph):
-    E = iter(graph.items())
-    V = iter(graph.keys())
-    p = Gst.Pipeline()
-    p.add(*V)
-    for u, v in E:
-        if v:
-            try:
-                u.link(v)
-            except Gst.LinkError:
-                linkDynamic(u, v)
-    return p
 
 
 class Extractee:
-
-    """Abstract base class for receiving raw data from an L{Extractor}."""
+    """Abstract base class for receiving raw data from an `Extractor`."""
 
     def receive(self, array):
-        """
-        Receive a chunk of data from an Extractor.
-
-        @param array: The chunk of data as an array
-        @type array: any kind of numeric array
+        """Receives a chunk of data from an Extractor.
 
+        Args:
+            array (numpy.ndarray): The chunk of data.
         """
         raise NotImplementedError
 
     def finalize(self):
-        """
-        Inform the Extractee that receive() will not be called again.
+        """Informs the Extractee that receive() will not be called again.
 
         Indicates that the extraction is complete, so the Extractee should
-            process the data it has received.
-
+        process the data it has received.
         """
         raise NotImplementedError
 
+    def fail(self):
+        """Informs the Extractee that the extraction failed.
 
-class Extractor(Loggable):
-
-    """
-    Abstract base class for extraction of raw data from a stream.
-
-    Closely modeled on L{Previewer}.
-
-    """
-
-    def __init__(self, factory, stream_):
-        """
-        Create a new Extractor.
-
-        @param factory: the factory with which to decode the stream
-        @type factory: L{ObjectFactory}
-        @param stream_: the stream to decode
-        @type stream_: L{Stream}
-        """
-        Loggable.__init__(self)
-        self.debug("Initialized with %s %s", factory, stream_)
-
-    def extract(self, extractee, start, duration):
-        """
-        Extract the raw data corresponding to a segment of the stream.
-
-        @param extractee: the L{Extractee} that will receive the raw data
-        @type extractee: L{Extractee}
-        @param start: The point in the stream at which the segment starts
-            (nanoseconds)
-        @type start: L{long}
-        @param duration: The duration of the segment (nanoseconds)
-        @type duration: L{long}
-
+        receive() will not be called again, and the data received so far
+        covers only part of the requested segment.
         """
         raise NotImplementedError
 
 
-class RandomAccessExtractor(Extractor):
-
-    """
-    Abstract class for L{Extractor}s of random access streams.
-
-    Closely inspired by L{RandomAccessPreviewer}.
-
-    """
-
-    def __init__(self, factory, stream_):
-        Extractor.__init__(self, factory, stream_)
-        # FIXME:
-        # why doesn't this work?
-        # bin = factory.makeBin(stream_)
-        uri = factory.uri
-        caps = stream_.caps
-        bin = SingleDecodeBin(uri=uri, caps=caps, stream=stream_)
-
-        self._pipelineInit(factory, bin)
-
-    def _pipelineInit(self, factory, bin):
-        """
-        Create the pipeline for the preview process.
+class Extractor(Loggable):
+    """Abstract base class for extraction of raw data from a stream."""
 
-        Subclasses should
-        override this method and create a pipeline, connecting to
-        callbacks to the appropriate signals, and prerolling the
-        pipeline if necessary.
+    def extract(self, extractee, start, duration):
+        """Extracts the raw data corresponding to a segment of the stream.
 
+        Args:
+            extractee (Extractee): The object receiving the raw data.
+            start (int): The position in the stream where the segment
+                starts, in nanoseconds.
+            duration (int): The duration of the segment, in nanoseconds.
         """
         raise NotImplementedError
 
 
-class RandomAccessAudioExtractor(RandomAccessExtractor):
-
-    """
-    L{Extractor} for random access audio streams.
+class AudioExtractor(Extractor):
+    """Extractor of the mono float samples of an audio stream.
 
-    Closely inspired by L{RandomAccessAudioPreviewer}.
+    The decoded samples are pulled from an appsink and passed to the
+    extractee from the streaming thread as they come, so the stream is
+    never stored. The extractee is finalized from the main thread once
+    the segment has been decoded, or failed if decoding failed.
 
+    Args:
+        uri (str): The URI of the media file.
+        rate (int): The sample rate of the extracted samples.
     """
 
-    def __init__(self, factory, stream_):
-        self._queue = deque()
-        RandomAccessExtractor.__init__(self, factory, stream_)
-        self._ready = False
-
-    def _pipelineInit(self, factory, sbin):
-        self.audioSink = ExtractionSink()
-        self.audioSink.set_stopped_cb(self._finishSegment)
-        # This audiorate element ensures that the extracted raw-data
-        # timeline matches the timestamps used for seeking, even if the
-        # audio source has gaps or other timestamp abnormalities.
-        audiorate = Gst.ElementFactory.make("audiorate")
-        conv = Gst.ElementFactory.make("audioconvert")
-        q = Gst.ElementFactory.make("queue")
-        self.audioPipeline = pipeline({
-            sbin: audiorate,
-            audiorate: conv,
-            conv: q,
-            q: self.audioSink,
-            self.audioSink: None})
-        bus = self.audioPipeline.get_bus()
-        bus.add_signal_watch()
-        bus.connect("message::error", self._busMessageErrorCb)
-        self._donecb_id = bus.connect("message::async-done",
-                                      self._busMessageAsyncDoneCb)
-
-        self.audioPipeline.set_state(Gst.State.PAUSED)
-        # The audiopipeline.set_state() method does not take effect
-        # immediately, but the extraction process (and in particular
-        # self._startSegment) will not work properly until
-        # self.audioPipeline reaches the desired state (State.PAUSED).
-        # To ensure that this is the case, we wait until the ASYNC_DONE
-        # message is received before setting self._ready = True,
-        # which enables extraction to proceed.
-
-    def _busMessageErrorCb(self, unused_bus, message):
-        error, debug = message.parse_error()
-        self.error("Event bus error: %s; %s", error, debug)
-
-        return Gst.BusSyncReply.PASS
-
-    def _busMessageAsyncDoneCb(self, bus, unused_message):
-        self.debug("Pipeline is ready for seeking")
-        bus.disconnect(self._donecb_id)  # Don't call me again
-        self._ready = True
-        if self._queue:  # Someone called .extract() before we were ready
-            self._run()
-
-    def _startSegment(self, timestamp, duration):
-        self.debug("processing segment with timestamp=%i and duration=%i",
-                   timestamp, duration)
-        res = self.audioPipeline.seek(1.0,
-                                      Gst.Format.TIME,
-                                      Gst.SeekFlags.FLUSH | Gst.SeekFlags.ACCURATE,
-                                      Gst.SeekType.SET, timestamp,
-                                      Gst.SeekType.SET, timestamp + duration)
-        if not res:
-            self.warning("seek failed %s", timestamp)
-        self.audioPipeline.set_state(Gst.State.PLAYING)
-
-        return res
-
-    def _finishSegment(self):
-        self.audioSink.extractee.finalize()
-        self.audioSink.reset()
-        self._queue.popleft()
-        # If there's more to do, keep running
-        if self._queue:
-            self._run()
+    def __init__(self, uri, rate):
+        Extractor.__init__(self)
+        self.uri = uri
+        self.rate = rate
+        self.pipeline = None
+        self._extractee = None
+        self._segment = None
+        self._seeked = False
 
     def extract(self, extractee, start, duration):
-        stopped = not self._queue
-        self._queue.append((extractee, start, duration))
-        if stopped and self._ready:
-            self._run()
-        # if self._ready is False, self._run() will be called from
-        # self._busMessageDoneCb().
-
-    def _run(self):
-        # Control flows in a cycle:
-        # _run -> _startSegment -> busMessageSegmentDoneCb -> _finishSegment -> _run
-        # This forms a loop that extracts an entire segment (i.e. satisfies an
-        # extract request) in each cycle. The cycle
-        # runs until the queue of Extractees empties.  If the cycle is not
-        # running, extract() will kick it off again.
-        extractee, start, duration = self._queue[0]
-        self.audioSink.set_extractee(extractee)
-        self._startSegment(start, duration)
+        self.debug("Extracting %s from %s for %s", self.uri, start, duration)
+        self._extractee = extractee
+        self._segment = (start, duration)
+
+        self.pipeline = Gst.Pipeline.new("extractor")
+        decode = Gst.ElementFactory.make("uridecodebin", None)
+        decode.props.uri = self.uri
+        decode.props.caps = Gst.Caps.from_string("audio/x-raw")
+        convert = Gst.ElementFactory.make("audioconvert", None)
+        resample = Gst.ElementFactory.make("audioresample", None)
+        sink = Gst.ElementFactory.make("appsink", None)
+        sink.props.caps = Gst.Caps.from_string(
+            "audio/x-raw,format=F32LE,layout=interleaved,channels=1,rate=%d" % self.rate)
+        sink.props.sync = False
+        sink.props.emit_signals = True
+        sink.connect("new-sample", self._new_sample_cb)
+        for element in (decode, convert, resample, sink):
+            self.pipeline.add(element)
+        convert.link(resample)
+        resample.link(sink)
+        decode.connect("pad-added", self._pad_added_cb, convert)
+
+        bus = self.pipeline.get_bus()
+        bus.add_signal_watch()
+        bus.connect("message", self._bus_message_cb)
+        self.pipeline.set_state(Gst.State.PAUSED)
+
+    def _pad_added_cb(self, unused_decode, pad, convert):
+        sinkpad = convert.get_static_pad("sink")
+        if sinkpad.is_linked():
+            # Only the first audio stream is extracted.
+            return
+        pad.link(sinkpad)
+
+    def _new_sample_cb(self, sink):
+        # Called in the streaming thread.
+        sample = sink.emit("pull-sample")
+        buf = sample.get_buffer()
+        res, mapinfo = buf.map(Gst.MapFlags.READ)
+        if not res:
+            return Gst.FlowReturn.ERROR
+        try:
+            samples = numpy.frombuffer(mapinfo.data, dtype=numpy.float32).copy()
+        finally:
+            buf.unmap(mapinfo)
+        self._extractee.receive(samples)
+        return Gst.FlowReturn.OK
+
+    def _bus_message_cb(self, unused_bus, message):
+        if message.type == Gst.MessageType.ASYNC_DONE and not self._seeked:
+            # Prerolled, the segment can be selected now.
+            self._seeked = True
+            start, duration = self._segment
+            if not self.pipeline.seek(1.0, Gst.Format.TIME,
+                                      Gst.SeekFlags.FLUSH | Gst.SeekFlags.ACCURATE,
+                                      Gst.SeekType.SET, start,
+                                      Gst.SeekType.SET, start + duration):
+                self.warning("Failed seeking %s to %s", self.uri, start)
+            self.pipeline.set_state(Gst.State.PLAYING)
+        elif message.type == Gst.MessageType.EOS:
+            self._finish()
+        elif message.type == Gst.MessageType.ERROR:
+            error, debug = message.parse_error()
+            self.error("Failed extracting %s: %s; %s", self.uri, error, debug)
+            self._finish(failed=True)
+
+    def _finish(self, failed=False):
+        self.stop()
+        extractee = self._extractee
+        self._extractee = None
+        if not extractee:
+            return
+        if failed:
+            extractee.fail()
+        else:
+            extractee.finalize()
+
+    def stop(self):
+        """Stops the extraction, without finalizing the extractee."""
+        if not self.pipeline:
+            return
+        self.pipeline.set_state(Gst.State.NULL)
+        self.pipeline.get_bus().remove_signal_watch()
+        self.pipeline = None
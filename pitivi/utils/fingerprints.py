@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+# Pitivi video editor
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+# Boston, MA 02110-1301, USA.
+"""Persistent index of the hashes of the media files."""
+import concurrent.futures
+import os
+import sqlite3
+import threading
+
+from pitivi.utils.loggable import Loggable
+from pitivi.utils.misc import hash_file
+
+
+class FingerprintIndex(Loggable):
+    """Database remembering the `hash_file` hash of the media files.
+
+    A hash is valid as long as the (path, inode, size, mtime) of the file
+    did not change, so getting the hash of a known file only needs a stat
+    instead of reading the file. Each thread gets its own connection to
+    the database, created the first time it's needed.
+
+    Attributes:
+        dbfile (str): The path to the sqlite3 database.
+    """
+
+    # The indexes, by database file path.
+    indexes_by_path = {}
+
+    def __init__(self, dbfile):
+        Loggable.__init__(self)
+        self.dbfile = dbfile
+        self.__connections = threading.local()
+        # The hashes known by this process, by path.
+        self.__fingerprints = {}
+        self.__lock = threading.Lock()
+        self.__hashing_pool = None
+
+        db = self.connection()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("CREATE TABLE IF NOT EXISTS Fingerprints "
+                   "(Path TEXT NOT NULL PRIMARY KEY, "
+                   " Inode INTEGER NOT NULL, "
+                   " Size INTEGER NOT NULL, "
+                   " Mtime INTEGER NOT NULL, "
+                   " Hash TEXT NOT NULL)")
+        db.commit()
+
+    @classmethod
+    def get(cls, cache_dir):
+        """Gets the FingerprintIndex for the specified cache directory.
+
+        Args:
+            cache_dir (str): The directory containing the Pitivi cache.
+
+        Returns:
+            FingerprintIndex: The index saving its data in `cache_dir`.
+        """
+        dbfile = os.path.join(cache_dir, "fingerprints.db")
+        if dbfile not in cls.indexes_by_path:
+            cls.indexes_by_path[dbfile] = FingerprintIndex(dbfile)
+        return cls.indexes_by_path[dbfile]
+
+    def connection(self):
+        """Gets the connection to the database for the current thread."""
+        db = getattr(self.__connections, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.dbfile)
+            self.__connections.db = db
+        return db
+
+    def fingerprint(self, path):
+        """Gets the hash of the specified file, computing it if needed.
+
+        Args:
+            path (str): The path to the file.
+
+        Returns:
+            str: The same value as `hash_file`.
+        """
+        stat = os.stat(path)
+        key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        with self.__lock:
+            known = self.__fingerprints.get(path)
+        if known and known[0] == key:
+            return known[1]
+
+        db = self.connection()
+        row = db.execute("SELECT Hash FROM Fingerprints WHERE Path = ? "
+                         "AND Inode = ? AND Size = ? AND Mtime = ?",
+                         (path,) + key).fetchone()
+        if row:
+            filehash = row[0]
+        else:
+            self.debug("Hashing %s", path)
+            filehash = hash_file(path)
+            db.execute("INSERT OR REPLACE INTO Fingerprints VALUES (?, ?, ?, ?, ?)",
+                       (path,) + key + (filehash,))
+            db.commit()
+
+        with self.__lock:
+            self.__fingerprints[path] = (key, filehash)
+        return filehash
+
+    def prefetch(self, paths):
+        """Computes the missing hashes of the specified files in a thread.
+
+        Args:
+            paths (List[str]): The paths to the files, for example the
+                files being imported.
+
+        Returns:
+            concurrent.futures.Future: The future of the hashing, whose
+                result is the hashes by path.
+        """
+        if self.__hashing_pool is None:
+            self.__hashing_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        return self.__hashing_pool.submit(self.__prefetch, list(paths))
+
+    def __prefetch(self, paths):
+        fingerprints = {}
+        for path in paths:
+            try:
+                fingerprints[path] = self.fingerprint(path)
+            except OSError as e:
+                self.warning("Cannot hash %s: %s", path, e)
+        return fingerprints
@@ -230,16 +230,19 @@ class PathWalker(Thread):
         self.stopme.set()
 
 
+# The number of bytes at the start of a file hashed by `hash_file`.
+HASHED_SIZE = 256 * 1024
+
+
 def hash_file(uri):
-    """Hashes the first 256KB of the specified file."""
-    sha256 = hashlib.sha256()
+    """Hashes the first 256KB of the specified file.
+
+    Consider using `pitivi.utils.fingerprints.FingerprintIndex`, which
+    remembers the hashes of the files which did not change.
+    """
     with open(uri, "rb") as file:
-        for _ in range(1024):
-            chunk = file.read(256)
-            if not chunk:
-                break
-            sha256.update(chunk)
-    return sha256.hexdigest()
+        # Read everything at once, this matters on network file systems.
+        return hashlib.sha256(file.read(HASHED_SIZE)).hexdigest()
 
 
 def quantize(input, interval):
@@ -53,6 +53,23 @@ class PipelineError(Exception):
     pass
 
 
+def create_cpu_throttling_clock(max_cpu_usage):
+    """Creates a clock slowing down a pipeline to limit the CPU usage.
+
+    Args:
+        max_cpu_usage (int): The maximum CPU usage, in percent.
+
+    Returns:
+        Gst.Clock: The clock to be used by the pipeline.
+    """
+    # This line is necessary so we can instantiate GstTranscoder's
+    # GstCpuThrottlingClock below.
+    Gst.ElementFactory.make("uritranscodebin", None)
+    clock = GObject.new(GObject.type_from_name("GstCpuThrottlingClock"))
+    clock.props.cpu_usage = max_cpu_usage
+    return clock
+
+
 class SimplePipeline(GObject.Object, Loggable):
     """High-level pipeline.
 
@@ -16,6 +16,9 @@
 # License along with this program; if not, write to the
 # Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
 # Boston, MA 02110-1301, USA.
+import collections
+import json
+import multiprocessing
 import os
 import time
 
@@ -30,6 +33,7 @@ from gi.repository import GstTranscoder
 from pitivi.configure import get_gstpresets_dir
 from pitivi.settings import GlobalSettings
 from pitivi.utils.loggable import Loggable
+from pitivi.utils.pipeline import create_cpu_throttling_clock
 
 # Make sure gst knowns about our own GstPresets
 Gst.preset_set_app_dir(get_gstpresets_dir())
@@ -41,6 +45,13 @@ class ProxyingStrategy:
     NOTHING = "nothing"
 
 
+class ProxyJobState:
+    """The states of the assets in the transcoding queue."""
+    NONE = "none"
+    PENDING = "pending"
+    RUNNING = "running"
+
+
 GlobalSettings.addConfigSection("proxy")
 GlobalSettings.addConfigOption('proxyingStrategy',
                                section='proxy',
@@ -54,6 +65,17 @@ GlobalSettings.addConfigOption("max_cpu_usage",
                                section="proxy",
                                key="max-cpu-usage",
                                default=10)
+# The number of ranges transcoded concurrently for a long asset,
+# 1 to transcode the assets in a single pass.
+GlobalSettings.addConfigOption("numProxyingSegments",
+                               section="proxy",
+                               key="num-proxying-segments",
+                               default=max(1, multiprocessing.cpu_count() // 2))
+# The duration in seconds from which an asset is transcoded in segments.
+GlobalSettings.addConfigOption("segmentedProxyingMinDuration",
+                               section="proxy",
+                               key="segmented-proxying-min-duration",
+                               default=20 * 60)
 
 
 ENCODING_FORMAT_PRORES = "prores-opus-in-matroska.gep"
@@ -75,8 +97,345 @@ def createEncodingProfileSimple(container_caps, audio_caps, video_caps):
     return c
 
 
+class SegmentedTranscoder(GObject.Object, Loggable):
+    """Transcodes time ranges of a file concurrently, then joins them.
+
+    Each range is decoded and encoded by its own pipeline with the same
+    encoding profile as a GstTranscoder.Transcoder, into a part file. When
+    all the parts are ready they are concatenated into `dest_uri`.
+
+    The proxy formats are intra-frame only, so the ranges don't need to
+    start at keyframes of the encoded parts. The accurate seeks take care
+    of the keyframes of the source.
+
+    The throttling clock measures the CPU usage of the whole process, so
+    the pipelines of the ranges share a single clock, throttling them
+    together to the CPU usage of the job.
+
+    Has the same properties, methods and signals as the
+    GstTranscoder.Transcoder used by ProxyManager.
+    """
+
+    __gsignals__ = {
+        "position-updated": (GObject.SIGNAL_RUN_LAST, None, (GObject.TYPE_UINT64,)),
+        "done": (GObject.SIGNAL_RUN_LAST, None, ()),
+        "error": (GObject.SIGNAL_RUN_LAST, None, (object, object)),
+    }
+
+    src_uri = GObject.Property(type=str)
+    dest_uri = GObject.Property(type=str)
+    duration = GObject.Property(type=GObject.TYPE_UINT64)
+    position_update_interval = GObject.Property(type=int, default=100)
+
+    def __init__(self, src_uri, dest_uri, encoding_profile, duration, n_segments):
+        GObject.Object.__init__(self)
+        Loggable.__init__(self)
+        self.props.src_uri = src_uri
+        self.props.dest_uri = dest_uri
+        self.props.duration = duration
+        self.__encoding_profile = encoding_profile
+        self.__cpu_usage = 100
+
+        dest_path = Gst.uri_get_location(dest_uri)
+        step = duration // n_segments
+        # The (start, stop, part file) of the ranges.
+        self.__segments = [(index * step,
+                            duration if index == n_segments - 1 else (index + 1) * step,
+                            "%s.%d" % (dest_path, index))
+                           for index in range(n_segments)]
+        self.__pipelines = {}
+        self.__valves = {}
+        self.__seeked_segments = set()
+        self.__done_segments = set()
+        self.__joiner = None
+        self.__clock = None
+        self.__position_id = 0
+
+    def set_cpu_usage(self, cpu_usage):
+        """Sets the CPU usage the pipelines are throttled to, together."""
+        self.__cpu_usage = cpu_usage
+        if self.__clock:
+            self.__clock.props.cpu_usage = cpu_usage
+
+    def run_async(self):
+        """Starts transcoding the ranges."""
+        self.__clock = create_cpu_throttling_clock(self.__cpu_usage)
+        for index, (unused_start, unused_stop, part) in enumerate(self.__segments):
+            self.__pipelines[index] = self.__create_segment_pipeline(index, part)
+        self.__position_id = GLib.timeout_add(self.props.position_update_interval,
+                                              self.__update_position_cb)
+
+    def cancel(self):
+        """Stops transcoding and removes the part files."""
+        self.__stop()
+        self.__remove_parts()
+
+    def __create_segment_pipeline(self, index, part):
+        pipeline = Gst.Pipeline.new("segment%d" % index)
+        decode = Gst.ElementFactory.make("uridecodebin", None)
+        decode.props.uri = self.props.src_uri
+        encode = Gst.ElementFactory.make("encodebin", None)
+        encode.props.profile = self.__encoding_profile
+        sink = Gst.ElementFactory.make("filesink", None)
+        sink.props.location = part
+        # Go to PAUSED without prerolling, so nothing reaches the muxer
+        # before seeking to the start of the range.
+        sink.set_property("async", False)
+        for element in (decode, encode, sink):
+            pipeline.add(element)
+        encode.link(sink)
+        self.__valves[index] = []
+        decode.connect("pad-added", self.__decode_pad_added_cb, pipeline, encode,
+                       self.__valves[index])
+
+        pipeline.use_clock(self.__clock)
+        bus = pipeline.get_bus()
+        bus.add_signal_watch()
+        bus.connect("message", self.__segment_message_cb, index)
+        pipeline.set_state(Gst.State.PAUSED)
+        return pipeline
+
+    def __decode_pad_added_cb(self, unused_decode, pad, pipeline, encode, valves):
+        sinkpad = encode.emit("request-pad", pad.query_caps(None))
+        if not sinkpad:
+            self.debug("Ignoring stream %s", pad.query_caps(None))
+            return
+
+        # Drops the data until the pipeline seeks to the start of the range.
+        valve = Gst.ElementFactory.make("valve", None)
+        valve.props.drop = True
+        pipeline.add(valve)
+        valve.sync_state_with_parent()
+        pad.link(valve.get_static_pad("sink"))
+        valve.get_static_pad("src").link(sinkpad)
+        valves.append(valve)
+
+    def __segment_message_cb(self, unused_bus, message, index):
+        pipeline = self.__pipelines.get(index)
+        if pipeline is None or message.src != pipeline and \
+                message.type != Gst.MessageType.ERROR:
+            return
+
+        if message.type == Gst.MessageType.ASYNC_DONE:
+            if index in self.__seeked_segments:
+                return
+            self.__seeked_segments.add(index)
+            start, stop, unused_part = self.__segments[index]
+            self.debug("Transcoding %s from %s to %s", self.props.src_uri,
+                       Gst.TIME_ARGS(start), Gst.TIME_ARGS(stop))
+            pipeline.seek(1.0, Gst.Format.TIME,
+                          Gst.SeekFlags.FLUSH | Gst.SeekFlags.ACCURATE,
+                          Gst.SeekType.SET, start, Gst.SeekType.SET, stop)
+            for valve in self.__valves[index]:
+                valve.props.drop = False
+            pipeline.set_state(Gst.State.PLAYING)
+        elif message.type == Gst.MessageType.EOS:
+            self.__stop_pipeline(pipeline)
+            del self.__pipelines[index]
+            self.__done_segments.add(index)
+            if not self.__pipelines:
+                self.__join_parts()
+        elif message.type == Gst.MessageType.ERROR:
+            self.__error(message)
+
+    def __join_parts(self):
+        """Concatenates the part files into the destination file."""
+        self.debug("Joining the %d parts of %s", len(self.__segments), self.props.dest_uri)
+        pipeline = Gst.Pipeline.new("join")
+        mux = Gst.ElementFactory.make("matroskamux", None)
+        sink = Gst.ElementFactory.make("filesink", None)
+        sink.props.location = Gst.uri_get_location(self.props.dest_uri)
+        pipeline.add(mux)
+        pipeline.add(sink)
+        mux.link(sink)
+
+        # The concat elements, by stream type. Their sink pads are requested
+        # in the order of the parts, the order in which they are played.
+        concats = {}
+        for index, (unused_start, unused_stop, part) in enumerate(self.__segments):
+            src = Gst.ElementFactory.make("filesrc", None)
+            src.props.location = part
+            demux = Gst.ElementFactory.make("matroskademux", None)
+            pipeline.add(src)
+            pipeline.add(demux)
+            src.link(demux)
+            demux.connect("pad-added", self.__demux_pad_added_cb, pipeline, mux,
+                          concats, index)
+
+        bus = pipeline.get_bus()
+        bus.add_signal_watch()
+        bus.connect("message", self.__join_message_cb)
+        self.__joiner = pipeline
+        pipeline.set_state(Gst.State.PLAYING)
+
+    def __demux_pad_added_cb(self, unused_demux, pad, pipeline, mux, concats, index):
+        stream_type = pad.get_name().split("_")[0]
+        if stream_type not in concats:
+            concat = Gst.ElementFactory.make("concat", None)
+            queue = Gst.ElementFactory.make("queue", None)
+            pipeline.add(concat)
+            pipeline.add(queue)
+            concat.link(queue)
+            queue.link_pads("src", mux, "%s_%%u" % stream_type)
+            sinkpads = [concat.get_request_pad("sink_%u")
+                        for unused_segment in self.__segments]
+            concats[stream_type] = sinkpads
+            queue.sync_state_with_parent()
+            concat.sync_state_with_parent()
+
+        pad.link(concats[stream_type][index])
+
+    def __join_message_cb(self, unused_bus, message):
+        if message.type == Gst.MessageType.EOS:
+            self.__stop()
+            self.__remove_parts()
+            self.emit("done")
+        elif message.type == Gst.MessageType.ERROR:
+            self.__error(message)
+
+    def __update_position_cb(self):
+        position = 0
+        for index, (start, stop, unused_part) in enumerate(self.__segments):
+            if index in self.__done_segments:
+                position += stop - start
+                continue
+
+            pipeline = self.__pipelines.get(index)
+            if not pipeline:
+                continue
+            res, segment_position = pipeline.query_position(Gst.Format.TIME)
+            if res and segment_position > start:
+                position += min(segment_position, stop) - start
+
+        self.emit("position-updated", position)
+        return True
+
+    def __error(self, message):
+        error, details = message.parse_error()
+        self.error("Failed transcoding %s: %s (%s)", self.props.src_uri, error, details)
+        self.cancel()
+        self.emit("error", error, details)
+
+    @staticmethod
+    def __stop_pipeline(pipeline):
+        pipeline.set_state(Gst.State.NULL)
+        pipeline.get_bus().remove_signal_watch()
+
+    def __stop(self):
+        if self.__position_id:
+            GLib.source_remove(self.__position_id)
+            self.__position_id = 0
+
+        for pipeline in self.__pipelines.values():
+            self.__stop_pipeline(pipeline)
+        self.__pipelines = {}
+
+        if self.__joiner:
+            self.__stop_pipeline(self.__joiner)
+            self.__joiner = None
+
+    def __remove_parts(self):
+        for unused_start, unused_stop, part in self.__segments:
+            if os.path.exists(part):
+                os.remove(part)
+
+
+FileInfo = collections.namedtuple("FileInfo", ["size", "mtime"])
+
+
+class FileInfoCache(Loggable):
+    """Caches the size and modification time of files.
+
+    The files are not stat-ed again until their directory monitor reports
+    they changed. The directories which cannot be monitored are not
+    cached.
+    """
+
+    ATTRIBUTES = ",".join([Gio.FILE_ATTRIBUTE_STANDARD_SIZE,
+                           Gio.FILE_ATTRIBUTE_TIME_MODIFIED])
+
+    def __init__(self):
+        Loggable.__init__(self)
+        # Maps the URIs to their FileInfo, or to None for missing files.
+        self.__infos = {}
+        # Maps the URIs of the directories to their Gio.FileMonitor, or to
+        # None when the directory cannot be monitored.
+        self.__monitors = {}
+
+    def query(self, uri):
+        """Gets the size and the modification time of the specified file.
+
+        Args:
+            uri (str): The URI of the file.
+
+        Returns:
+            Optional[FileInfo]: The info of the file, or None if it's missing.
+        """
+        gfile = Gio.File.new_for_uri(uri)
+        key = gfile.get_uri()
+        try:
+            return self.__infos[key]
+        except KeyError:
+            pass
+
+        try:
+            info = gfile.query_info(self.ATTRIBUTES, Gio.FileQueryInfoFlags.NONE, None)
+            file_info = FileInfo(info.get_size(),
+                                 info.get_attribute_uint64(Gio.FILE_ATTRIBUTE_TIME_MODIFIED))
+        except GLib.Error as err:
+            if not err.matches(Gio.io_error_quark(), Gio.IOErrorEnum.NOT_FOUND):
+                raise
+            file_info = None
+
+        if self.__monitor(gfile):
+            self.__infos[key] = file_info
+        return file_info
+
+    def exists(self, uri):
+        """Returns whether the specified file exists."""
+        return self.query(uri) is not None
+
+    def invalidate(self, uri):
+        """Forgets the info of the specified file."""
+        self.__infos.pop(Gio.File.new_for_uri(uri).get_uri(), None)
+
+    def __monitor(self, gfile):
+        """Monitors the directory of the specified file.
+
+        Returns:
+            bool: Whether the directory is monitored.
+        """
+        parent = gfile.get_parent()
+        if not parent:
+            return False
+
+        parent_uri = parent.get_uri()
+        try:
+            return self.__monitors[parent_uri] is not None
+        except KeyError:
+            pass
+
+        try:
+            monitor = parent.monitor_directory(Gio.FileMonitorFlags.WATCH_MOVES, None)
+            monitor.connect("changed", self.__directory_changed_cb)
+        except GLib.Error as err:
+            self.debug("Not caching the files in %s: %s", parent_uri, err)
+            monitor = None
+        self.__monitors[parent_uri] = monitor
+        return monitor is not None
+
+    def __directory_changed_cb(self, unused_monitor, gfile, other_file, unused_event_type):
+        self.__infos.pop(gfile.get_uri(), None)
+        if other_file:
+            self.__infos.pop(other_file.get_uri(), None)
+
+
 class ProxyManager(GObject.Object, Loggable):
-    """Transcodes assets and manages proxies."""
+    """Transcodes assets and manages proxies.
+
+    Attributes:
+        max_jobs (int): The maximum number of concurrent transcoders.
+    """
 
     __gsignals__ = {
         "progress": (GObject.SIGNAL_RUN_LAST, None, (object, int, int)),
@@ -108,19 +467,37 @@ class ProxyManager(GObject.Object, Loggable):
         WHITELIST_FORMATS.append(a)
 
     proxy_extension = "proxy.mkv"
+    # The extension of the file saved next to the project file, listing
+    # the assets queued for transcoding so the jobs can be resumed.
+    jobs_extension = "proxy-jobs"
+    # The delay in milliseconds for saving the queued jobs, so a bulk import
+    # does not write the jobs file for every asset.
+    JOBS_SAVING_DELAY = 1000
 
     def __init__(self, app):
         GObject.Object.__init__(self)
         Loggable.__init__(self)
 
         self.app = app
+        self.max_jobs = app.settings.numTranscodingJobs
+        # The CPU usage in percent each transcoder is throttled to.
+        self.cpu_usage = app.settings.max_cpu_usage
         # Total time to transcode in seconds.
         self._total_time_to_transcode = 0
         # Transcoded time per asset in seconds.
         self._transcoded_durations = {}
         self._start_proxying_time = 0
-        self.__running_transcoders = []
-        self.__pending_transcoders = []
+        # The running transcoders, by the URI of the transcoded asset.
+        self.__running_transcoders = collections.OrderedDict()
+        # The assets waiting to be transcoded, by URI.
+        self.__pending_assets = collections.OrderedDict()
+        # The URIs of the assets to be transcoded before the others.
+        self.__pinned_uris = set()
+        # The file where the queued jobs are saved.
+        self.__jobs_file = None
+        self.__save_jobs_id = 0
+        # The size of the assets and the existence of their proxies.
+        self.__file_infos = FileInfoCache()
 
         self.__encoding_target_file = None
         self.proxyingUnsupported = False
@@ -235,18 +612,16 @@ class ProxyManager(GObject.Object, Loggable):
         The name looks like:
             <filename>.<file_size>.<proxy_extension>
         """
-        asset_file = Gio.File.new_for_uri(asset.get_id())
-        try:
-            file_size = asset_file.query_info(Gio.FILE_ATTRIBUTE_STANDARD_SIZE,
-                                              Gio.FileQueryInfoFlags.NONE,
-                                              None).get_size()
-        except GLib.Error as err:
-            if err.matches(Gio.io_error_quark(), Gio.IOErrorEnum.NOT_FOUND):
-                return None
-            else:
-                raise
+        file_info = self.__file_infos.query(asset.get_id())
+        if not file_info:
+            return None
+
+        return "%s.%s.%s" % (asset.get_id(), file_info.size, self.proxy_extension)
 
-        return "%s.%s.%s" % (asset.get_id(), file_size, self.proxy_extension)
+    def has_proxy_file(self, asset):
+        """Returns whether the proxy file of the specified asset exists."""
+        proxy_uri = self.getProxyUri(asset)
+        return bool(proxy_uri) and self.__file_infos.exists(proxy_uri)
 
     def isAssetFormatWellSupported(self, asset):
         for encoding_format in self.WHITELIST_FORMATS:
@@ -285,7 +660,7 @@ class ProxyManager(GObject.Object, Loggable):
         if self._start_proxying_time == 0:
             self._start_proxying_time = time.time()
         transcoder.run_async()
-        self.__running_transcoders.append(transcoder)
+        self.__running_transcoders[transcoder.props.src_uri] = transcoder
 
     def __assetsMatch(self, asset, proxy):
         if self.__assetNeedsTranscoding(proxy):
@@ -305,16 +680,17 @@ class ProxyManager(GObject.Object, Loggable):
                 self.emit("error-preparing-asset", asset, proxy, e)
                 del transcoder
             else:
-                self.__createTranscoder(asset)
+                self.__queue_job(asset)
 
             return
 
         if not transcoder:
             if not self.__assetsMatch(asset, proxy):
-                return self.__createTranscoder(asset)
+                return self.__queue_job(asset)
         else:
-            transcoder.props.pipeline.props.video_filter.finalize(proxy)
-            transcoder.props.pipeline.props.audio_filter.finalize(proxy)
+            if isinstance(transcoder, GstTranscoder.Transcoder):
+                transcoder.props.pipeline.props.video_filter.finalize(proxy)
+                transcoder.props.pipeline.props.audio_filter.finalize(proxy)
 
             del transcoder
 
@@ -331,11 +707,13 @@ class ProxyManager(GObject.Object, Loggable):
 
         self.debug("Transcoder done with %s", asset.get_id())
 
-        self.__running_transcoders.remove(transcoder)
+        del self.__running_transcoders[asset.props.id]
 
         proxy_uri = self.getProxyUri(asset)
         os.rename(Gst.uri_get_location(transcoder.props.dest_uri),
                   Gst.uri_get_location(proxy_uri))
+        # Don't wait for the directory monitor to notice the new file.
+        self.__file_infos.invalidate(proxy_uri)
 
         # Make sure that if it first failed loading, the proxy is forced to be
         # reloaded in the GES cache.
@@ -343,13 +721,13 @@ class ProxyManager(GObject.Object, Loggable):
         GES.Asset.request_async(GES.UriClip, proxy_uri, None,
                                 self.__assetLoadedCb, asset, transcoder)
 
-        try:
-            self.__startTranscoder(self.__pending_transcoders.pop())
-        except IndexError:
-            if not self.__running_transcoders:
-                self._transcoded_durations = {}
-                self._total_time_to_transcode = 0
-                self._start_proxying_time = 0
+        self.__pinned_uris.discard(asset.props.id)
+        self.__start_next_jobs()
+        if not self.__running_transcoders:
+            self._transcoded_durations = {}
+            self._total_time_to_transcode = 0
+            self._start_proxying_time = 0
+        self.__schedule_jobs_saving()
 
     def __emitProgress(self, asset, creation_progress):
         """Handles the transcoding progress of the specified asset."""
@@ -365,7 +743,7 @@ class ProxyManager(GObject.Object, Loggable):
         self.emit("progress", asset, asset.creation_progress, estimated_time)
 
     def __proxyingPositionChangedCb(self, transcoder, position, asset):
-        if transcoder not in self.__running_transcoders:
+        if self.__running_transcoders.get(asset.props.id) is not transcoder:
             self.info("Position changed after job cancelled!")
             return
 
@@ -390,46 +768,204 @@ class ProxyManager(GObject.Object, Loggable):
         Returns:
             bool: True iff the asset is being transcoded or pending.
         """
-        all_transcoders = self.__running_transcoders + self.__pending_transcoders
-        for transcoder in all_transcoders:
-            if asset.props.id == transcoder.props.src_uri:
-                return True
+        return asset.props.id in self.__pending_assets or \
+            asset.props.id in self.__running_transcoders
+
+    def state_for(self, assets):
+        """Gets the transcoding state of the specified assets.
+
+        Args:
+            assets (List[GES.Asset]): The assets to check.
+
+        Returns:
+            dict: The `ProxyJobState` of each asset.
+        """
+        states = {}
+        for asset in assets:
+            uri = asset.props.id
+            if uri in self.__running_transcoders:
+                states[asset] = ProxyJobState.RUNNING
+            elif uri in self.__pending_assets:
+                states[asset] = ProxyJobState.PENDING
+            else:
+                states[asset] = ProxyJobState.NONE
+        return states
+
+    def set_max_jobs(self, max_jobs):
+        """Sets the maximum number of concurrent transcoders.
+
+        The running transcoders are not stopped when lowering it.
+        """
+        self.max_jobs = max_jobs
+        self.__start_next_jobs()
+
+    def set_cpu_usage(self, cpu_usage):
+        """Sets the CPU usage the transcoders are throttled to.
+
+        Also applies to the running transcoders.
+        """
+        self.cpu_usage = cpu_usage
+        for transcoder in self.__running_transcoders.values():
+            transcoder.set_cpu_usage(cpu_usage)
+
+    def pin_job(self, asset):
+        """Makes the job of the specified asset the next one to be started.
+
+        Args:
+            asset (GES.Asset): The asset queued for transcoding.
+        """
+        self.__pinned_uris.add(asset.props.id)
+        self.__schedule_jobs_saving()
+
+    def __get_timeline_uris(self):
+        """Gets the URIs of the assets used by the current timeline."""
+        uris = set()
+        project = self.app.project_manager.current_project
+        if not project or not project.ges_timeline:
+            return uris
+
+        for layer in project.ges_timeline.get_layers():
+            for clip in layer.get_clips():
+                if isinstance(clip, GES.UriClip):
+                    uris.add(get_proxy_target(clip).props.id)
+        return uris
+
+    def __pop_next_job(self):
+        """Gets the pending asset to be transcoded next.
+
+        The pinned assets come first, then the assets used in the timeline,
+        each group shortest first.
+        """
+        timeline_uris = self.__get_timeline_uris()
+
+        def priority(asset):
+            return (asset.props.id not in self.__pinned_uris,
+                    asset.props.id not in timeline_uris,
+                    asset.get_duration())
+
+        asset = min(self.__pending_assets.values(), key=priority)
+        del self.__pending_assets[asset.props.id]
+        return asset
+
+    def __start_next_jobs(self):
+        while self.__pending_assets and \
+                len(self.__running_transcoders) < self.max_jobs:
+            self.__startTranscoder(self.__createTranscoder(self.__pop_next_job()))
+
+    def __queue_job(self, asset):
+        self._total_time_to_transcode += asset.get_duration() / Gst.SECOND
+        self.__pending_assets[asset.props.id] = asset
+        self.__start_next_jobs()
+        self.__schedule_jobs_saving()
 
+    @classmethod
+    def get_jobs_file(cls, project_uri):
+        """Gets the path of the file listing the jobs queued for a project.
+
+        Args:
+            project_uri (str): The URI of the project file.
+        """
+        return "%s.%s" % (Gst.uri_get_location(project_uri), cls.jobs_extension)
+
+    def set_jobs_file(self, jobs_file):
+        """Sets the file where the queued jobs are saved.
+
+        Args:
+            jobs_file (Optional[str]): The path returned by `get_jobs_file`,
+                or None to stop saving the jobs, for example when the project
+                is closed, so they can be resumed when it's opened again.
+        """
+        self.__jobs_file = jobs_file
+        if jobs_file:
+            self.__schedule_jobs_saving()
+
+    def load_jobs(self, jobs_file):
+        """Reads the jobs saved in the specified file.
+
+        Args:
+            jobs_file (str): The path returned by `get_jobs_file`.
+
+        Returns:
+            dict: Whether the job is pinned, by asset URI.
+        """
+        try:
+            with open(jobs_file) as jobs:
+                return {job["uri"]: job["pinned"] for job in json.load(jobs)["jobs"]}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self.warning("Ignoring the invalid jobs file %s: %s", jobs_file, e)
+            return {}
+
+    def __schedule_jobs_saving(self):
+        if self.__jobs_file and not self.__save_jobs_id:
+            self.__save_jobs_id = GLib.timeout_add(self.JOBS_SAVING_DELAY,
+                                                   self.__save_jobs_cb)
+
+    def __save_jobs_cb(self):
+        self.__save_jobs_id = 0
+        if not self.__jobs_file:
+            return False
+
+        uris = list(self.__running_transcoders.keys())
+        uris.extend(self.__pending_assets.keys())
+        try:
+            if not uris:
+                if os.path.exists(self.__jobs_file):
+                    os.remove(self.__jobs_file)
+                return False
+
+            jobs = [{"uri": uri, "pinned": uri in self.__pinned_uris} for uri in uris]
+            temp_file = self.__jobs_file + ".tmp"
+            with open(temp_file, "w") as jobs_file:
+                json.dump({"jobs": jobs}, jobs_file)
+            os.replace(temp_file, self.__jobs_file)
+        except OSError as e:
+            self.warning("Failed to save the proxying jobs to %s: %s",
+                         self.__jobs_file, e)
         return False
 
+    def __use_segments(self, asset):
+        """Returns whether the asset should be transcoded in segments."""
+        return self.app.settings.numProxyingSegments > 1 and \
+            asset.get_duration() >= self.app.settings.segmentedProxyingMinDuration * Gst.SECOND
+
     def __createTranscoder(self, asset):
-        self._total_time_to_transcode += asset.get_duration() / Gst.SECOND
         asset_uri = asset.get_id()
         proxy_uri = self.getProxyUri(asset)
 
-        dispatcher = GstTranscoder.TranscoderGMainContextSignalDispatcher.new()
         encoding_profile = self.__getEncodingProfile(self.__encoding_target_file, asset)
-        transcoder = GstTranscoder.Transcoder.new_full(
-            asset_uri, proxy_uri + ".part", encoding_profile,
-            dispatcher)
-        transcoder.props.position_update_interval = 1000
+        if self.__use_segments(asset):
+            # The thumbnails and the waveform are not created along,
+            # the previewers will create them from the proxy.
+            transcoder = SegmentedTranscoder(
+                asset_uri, proxy_uri + ".part", encoding_profile,
+                asset.get_duration(), self.app.settings.numProxyingSegments)
+        else:
+            dispatcher = GstTranscoder.TranscoderGMainContextSignalDispatcher.new()
+            transcoder = GstTranscoder.Transcoder.new_full(
+                asset_uri, proxy_uri + ".part", encoding_profile,
+                dispatcher)
 
-        thumbnailbin = Gst.ElementFactory.make("teedthumbnailbin")
-        thumbnailbin.props.uri = asset.get_id()
+            thumbnailbin = Gst.ElementFactory.make("teedthumbnailbin")
+            thumbnailbin.props.uri = asset.get_id()
 
-        waveformbin = Gst.ElementFactory.make("waveformbin")
-        waveformbin.props.uri = asset.get_id()
-        waveformbin.props.duration = asset.get_duration()
+            waveformbin = Gst.ElementFactory.make("waveformbin")
+            waveformbin.props.uri = asset.get_id()
+            waveformbin.props.duration = asset.get_duration()
 
-        transcoder.props.pipeline.props.video_filter = thumbnailbin
-        transcoder.props.pipeline.props.audio_filter = waveformbin
+            transcoder.props.pipeline.props.video_filter = thumbnailbin
+            transcoder.props.pipeline.props.audio_filter = waveformbin
+        transcoder.props.position_update_interval = 1000
 
-        transcoder.set_cpu_usage(self.app.settings.max_cpu_usage)
+        transcoder.set_cpu_usage(self.cpu_usage)
         transcoder.connect("position-updated",
                            self.__proxyingPositionChangedCb,
                            asset)
 
         transcoder.connect("done", self.__transcoderDoneCb, asset)
         transcoder.connect("error", self.__transcoderErrorCb, asset)
-        if len(self.__running_transcoders) < self.app.settings.numTranscodingJobs:
-            self.__startTranscoder(transcoder)
-        else:
-            self.__pending_transcoders.append(transcoder)
+        return transcoder
 
     def cancel_job(self, asset):
         """Cancels the transcoding job for the specified asset, if any.
@@ -437,35 +973,37 @@ class ProxyManager(GObject.Object, Loggable):
         Args:
             asset (GES.Asset): The original asset.
         """
-        if not self.is_asset_queued(asset):
+        transcoder = self.__running_transcoders.pop(asset.props.id, None)
+        if transcoder:
+            self.info("Cancelling running transcoder %s %s",
+                      transcoder.props.src_uri,
+                      transcoder.__grefcount__)
+            if isinstance(transcoder, SegmentedTranscoder):
+                # Nothing else holds its pipelines.
+                transcoder.cancel()
+            self.__pinned_uris.discard(asset.props.id)
+            self.__schedule_jobs_saving()
+            self.emit("asset-preparing-cancelled", asset)
             return
 
-        for transcoder in self.__running_transcoders:
-            if asset.props.id == transcoder.props.src_uri:
-                self.info("Cancelling running transcoder %s %s",
-                          transcoder.props.src_uri,
-                          transcoder.__grefcount__)
-                self.__running_transcoders.remove(transcoder)
-                self.emit("asset-preparing-cancelled", asset)
-                return
+        if self.__pending_assets.pop(asset.props.id, None):
+            self.info("Cancelling pending job %s", asset.props.id)
+            self._total_time_to_transcode -= asset.get_duration() / Gst.SECOND
+            self.__pinned_uris.discard(asset.props.id)
+            self.__schedule_jobs_saving()
+            self.emit("asset-preparing-cancelled", asset)
 
-        for transcoder in self.__pending_transcoders:
-            if asset.props.id == transcoder.props.src_uri:
-                self.info("Cancelling pending transcoder %s",
-                          transcoder.props.src_uri)
-                # Removing the transcoder from the list
-                # will lead to its destruction (only reference)
-                # here, which means it will be stopped.
-                self.__pending_transcoders.remove(transcoder)
-                self.emit("asset-preparing-cancelled", asset)
-                return
-
-    def add_job(self, asset):
+    def add_job(self, asset, pinned=False):
         """Adds a transcoding job for the specified asset if needed.
 
         Args:
             asset (GES.Asset): The asset to be transcoded.
+            pinned (Optional[bool]): Whether to transcode the asset before
+                the others, see `pin_job`.
         """
+        if pinned:
+            self.pin_job(asset)
+
         if self.is_asset_queued(asset):
             self.log("Asset already queued for proxying: %s", asset)
             return
@@ -478,8 +1016,8 @@ class ProxyManager(GObject.Object, Loggable):
             self.emit("proxy-ready", asset, None)
             return
 
-        proxy_uri = self.getProxyUri(asset)
-        if Gio.File.new_for_uri(proxy_uri).query_exists(None):
+        if self.has_proxy_file(asset):
+            proxy_uri = self.getProxyUri(asset)
             self.debug("Using proxy already generated: %s", proxy_uri)
             GES.Asset.request_async(GES.UriClip,
                                     proxy_uri, None,
@@ -490,7 +1028,7 @@ class ProxyManager(GObject.Object, Loggable):
         self.debug("Creating a proxy for %s (strategy: %s, force: %s)",
                    asset.get_id(), self.app.settings.proxyingStrategy,
                    force_proxying)
-        self.__createTranscoder(asset)
+        self.__queue_job(asset)
         return
 
 
@@ -20,13 +20,29 @@ import os
 import resource
 import sys
 
+from gi.repository import GLib
 from gi.repository import GObject
 
 from pitivi.check import missing_soft_deps
 from pitivi.configure import APPNAME
+from pitivi.settings import GlobalSettings
 from pitivi.utils.loggable import Loggable
 
 
+GlobalSettings.addConfigSection("concurrency")
+# Whether the number of transcoders and previewers adapts to the load,
+# their settings being the maximums. The transcoders are then throttled
+# to the target CPU usage instead of their max CPU usage setting.
+GlobalSettings.addConfigOption("adaptive_concurrency",
+                               section="concurrency",
+                               key="adaptive",
+                               default=True)
+GlobalSettings.addConfigOption("target_cpu_usage",
+                               section="concurrency",
+                               key="target-cpu-usage",
+                               default=80)
+
+
 class System(GObject.Object, Loggable):
     """A base class for systems in which Pitivi runs."""
 
@@ -143,6 +159,8 @@ class CPUUsageTracker(object):
 
     def usage(self):
         delta_time = (datetime.datetime.now() - self.last_moment).total_seconds()
+        if delta_time <= 0:
+            return 0
         delta_usage = resource.getrusage(
             resource.RUSAGE_SELF).ru_utime - self.last_usage.ru_utime
         usage = float(delta_usage) / delta_time * 100
@@ -151,3 +169,180 @@ class CPUUsageTracker(object):
     def reset(self):
         self.last_moment = datetime.datetime.now()
         self.last_usage = resource.getrusage(resource.RUSAGE_SELF)
+
+
+class SystemLoadTracker(object):
+    """Tracks the I/O wait and the available memory of the whole system.
+
+    Only works on Linux, elsewhere the values are None.
+    """
+
+    def __init__(self):
+        self.last_times = None
+        self.reset()
+
+    @staticmethod
+    def _read_cpu_times():
+        try:
+            with open("/proc/stat") as stat:
+                # cpu  user nice system idle iowait irq softirq ...
+                return [int(value) for value in stat.readline().split()[1:]]
+        except (OSError, ValueError):
+            return None
+
+    def iowait(self):
+        """Gets the percentage of time spent waiting for I/O since the reset."""
+        times = self._read_cpu_times()
+        if not times or not self.last_times or len(times) < 5:
+            return None
+        deltas = [current - last for current, last in zip(times, self.last_times)]
+        total = sum(deltas)
+        if total <= 0:
+            return None
+        return deltas[4] * 100 / total
+
+    @staticmethod
+    def available_memory():
+        """Gets the percentage of the memory available for new processes."""
+        values = {}
+        try:
+            with open("/proc/meminfo") as meminfo:
+                for line in meminfo:
+                    name, value = line.split(":", 1)
+                    values[name] = int(value.split()[0])
+        except (OSError, ValueError):
+            return None
+        if not values.get("MemTotal") or "MemAvailable" not in values:
+            return None
+        return values["MemAvailable"] * 100 / values["MemTotal"]
+
+    def reset(self):
+        self.last_times = self._read_cpu_times()
+
+
+class ConcurrencyController(Loggable):
+    """Adapts the number of concurrent jobs to the load of the system.
+
+    Periodically checks the CPU usage of Pitivi, the I/O wait and the
+    available memory, and scales the number of jobs of the consumers,
+    for example the transcoders and the previewers, between 1 and their
+    maximum. The number of jobs is increased by small steps while the
+    CPU usage is below the target and decreased quickly when the CPU
+    usage is above it, the disks are saturated or the memory is low.
+
+    The consumers throttling their jobs below the target would keep the
+    CPU usage from ever reaching it, so they are made to throttle their
+    jobs to the target instead.
+
+    Attributes:
+        target_cpu_usage (int): The CPU usage in percent to reach.
+        level (float): The fraction of the maximum jobs of each consumer
+            currently allowed.
+    """
+
+    # Millis between two checks of the load.
+    CONTROL_INTERVAL = 2000
+    # The CPU usage can be this far from the target without acting.
+    TOLERANCE = 10
+    # The I/O wait percentage above which the disks are considered saturated.
+    MAX_IOWAIT = 25
+    # The available memory percentage below which the memory is low.
+    MIN_AVAILABLE_MEMORY = 10
+    # How the level changes when increasing and decreasing.
+    INCREASE_STEP = 0.1
+    DECREASE_FACTOR = 0.7
+
+    def __init__(self, target_cpu_usage):
+        Loggable.__init__(self)
+        self.target_cpu_usage = target_cpu_usage
+        self.level = 0.5
+        # The [name, max jobs, setter, current jobs] of the consumers.
+        self.__consumers = []
+        self.__cpu_usage_tracker = CPUUsageTracker()
+        self.__system_load_tracker = SystemLoadTracker()
+        self.__control_id = 0
+
+    def add_consumer(self, name, max_jobs, set_max_jobs, set_cpu_usage=None):
+        """Makes the number of jobs of a consumer follow the load.
+
+        Args:
+            name (str): The name of the consumer, for the logs.
+            max_jobs (int): The maximum number of jobs of the consumer.
+            set_max_jobs (function): The function called with the number
+                of jobs allowed.
+            set_cpu_usage (Optional[function]): The function called with
+                the CPU usage the jobs should be throttled to, for the
+                consumers throttling their jobs.
+        """
+        consumer = [name, max_jobs, set_max_jobs, None]
+        self.__consumers.append(consumer)
+        if set_cpu_usage:
+            set_cpu_usage(self.target_cpu_usage)
+        self.__apply(consumer, "new consumer")
+
+    def start(self):
+        """Starts checking the load periodically."""
+        if self.__control_id:
+            return
+        self.__cpu_usage_tracker.reset()
+        self.__system_load_tracker.reset()
+        self.__control_id = GLib.timeout_add(self.CONTROL_INTERVAL, self.__control_cb)
+
+    def stop(self):
+        """Stops checking the load."""
+        if self.__control_id:
+            GLib.source_remove(self.__control_id)
+            self.__control_id = 0
+
+    def update(self, cpu_usage, iowait, available_memory):
+        """Updates the level based on the specified load.
+
+        Args:
+            cpu_usage (float): The CPU usage of Pitivi, in percent.
+            iowait (Optional[float]): The I/O wait, in percent.
+            available_memory (Optional[float]): The available memory,
+                in percent.
+
+        Returns:
+            str: The reason of the decision.
+        """
+        if available_memory is not None and available_memory < self.MIN_AVAILABLE_MEMORY:
+            self.level *= self.DECREASE_FACTOR
+            reason = "low memory"
+        elif iowait is not None and iowait > self.MAX_IOWAIT:
+            self.level *= self.DECREASE_FACTOR
+            reason = "I/O bound"
+        elif cpu_usage > self.target_cpu_usage + self.TOLERANCE:
+            self.level *= self.DECREASE_FACTOR
+            reason = "CPU above target"
+        elif cpu_usage < self.target_cpu_usage - self.TOLERANCE:
+            self.level += self.INCREASE_STEP
+            reason = "CPU below target"
+        else:
+            reason = "CPU on target"
+        self.level = min(1.0, max(0.0, self.level))
+
+        for consumer in self.__consumers:
+            self.__apply(consumer, reason)
+        return reason
+
+    def __apply(self, consumer, reason):
+        name, max_jobs, set_max_jobs, jobs = consumer
+        new_jobs = max(1, round(max_jobs * self.level))
+        if new_jobs != jobs:
+            consumer[3] = new_jobs
+            self.info("Allowing %d/%d %s (%s)", new_jobs, max_jobs, name, reason)
+            set_max_jobs(new_jobs)
+
+    def __control_cb(self):
+        cpu_usage = self.__cpu_usage_tracker.usage()
+        iowait = self.__system_load_tracker.iowait()
+        available_memory = self.__system_load_tracker.available_memory()
+        self.__cpu_usage_tracker.reset()
+        self.__system_load_tracker.reset()
+
+        reason = self.update(cpu_usage, iowait, available_memory)
+        self.debug("CPU: %.1f%%, I/O wait: %s%%, available memory: %s%%, "
+                   "level: %.2f (%s)", cpu_usage, iowait, available_memory,
+                   self.level, reason)
+        return True
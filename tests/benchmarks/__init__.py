@@ -0,0 +1,8 @@
+"""Pitivi benchmarks.
+
+The benchmarks are not run with the unit tests, run them individually:
+
+    python3 -m tests.benchmarks.alignment
+    python3 -m tests.benchmarks.loading
+    python3 -m tests.benchmarks.renderer
+"""
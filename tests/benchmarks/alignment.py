@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+# Pitivi video editor
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+# Boston, MA 02110-1301, USA.
+"""Benchmark of the cross-correlation of the auto aligner.
+
+Aligns synthetic envelopes of several camera angles recorded at the same
+event, and compares correlating them one by one with power of 2 FFTs, as
+`rigidalign` did, with the batched 5-smooth FFTs and with the coarse to
+fine search of `pyramidalign`.
+"""
+import argparse
+import time
+
+import numpy
+
+from pitivi.autoaligner import AutoAligner
+from pitivi.autoaligner import nextpow2
+from pitivi.autoaligner import pyramidalign
+from pitivi.autoaligner import rigidalign
+from pitivi.autoaligner import submax
+
+
+def rigidalign_loop(reference, targets):
+    """Aligns the targets one by one, as rigidalign did."""
+    L = nextpow2(len(reference) + max(len(t) for t in targets) - 1)
+    reference = reference - numpy.mean(reference)
+    fref = numpy.fft.rfft(reference, L).conj()
+    shifts = []
+    for t in targets:
+        t = t - numpy.mean(t)
+        xcorr = numpy.fft.irfft(fref * numpy.fft.rfft(t, L))
+        shift = int(numpy.argmax(xcorr))
+        shift += submax(xcorr[(shift - 1) % L],
+                        xcorr[shift],
+                        xcorr[(shift + 1) % L])
+        if shift >= len(t):
+            shift -= L
+        shifts.append(-shift)
+    return shifts
+
+
+def make_envelopes(n_targets, duration):
+    """Creates the envelopes of the recordings of the same event.
+
+    Args:
+        n_targets (int): The number of recordings to align.
+        duration (int): The duration of the event, in seconds.
+
+    Returns:
+        Tuple[numpy.ndarray, List[numpy.ndarray], List[int]]: The reference
+            envelope, the envelopes to align and their expected shifts.
+    """
+    numpy.random.seed(0)
+    length = duration * AutoAligner.BLOCKRATE
+    event = numpy.abs(numpy.random.standard_normal(length))
+    targets = []
+    expected = []
+    for unused_i in range(n_targets):
+        start = numpy.random.randint(0, length // 10)
+        end = numpy.random.randint(length - length // 10, length)
+        noise = 0.5 * numpy.abs(numpy.random.standard_normal(end - start))
+        targets.append(event[start:end] + noise)
+        expected.append(start)
+    return event, targets, expected
+
+
+def benchmark(n_targets, duration, repeat):
+    """Prints the time spent aligning the envelopes."""
+    reference, targets, expected = make_envelopes(n_targets, duration)
+    print("%d targets, %d blocks each" % (n_targets, len(reference)))
+    for name, align in (("loop", rigidalign_loop), ("batched", rigidalign),
+                        ("pyramid", pyramidalign)):
+        # Warm up, the first run pays for allocating the arrays.
+        align(reference, targets)
+        start = time.perf_counter()
+        for unused_i in range(repeat):
+            shifts = align(reference, targets)
+        elapsed = (time.perf_counter() - start) / repeat
+        error = max(abs(shift - exp) for shift, exp in zip(shifts, expected))
+        print("%12s: %9.3f s, max error %.3f blocks" % (name, elapsed, error))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--targets", type=int, default=12,
+                        help="number of recordings to align")
+    parser.add_argument("--duration", type=int, default=2 * 3600,
+                        help="duration of the event, in seconds")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="number of times each alignment is run")
+    args = parser.parse_args()
+    benchmark(args.targets, args.duration, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
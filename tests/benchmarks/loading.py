@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# Pitivi video editor
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+# Boston, MA 02110-1301, USA.
+"""Benchmark of the asset loading progress accounting.
+
+Simulates importing many assets which report their transcoding progress
+concurrently, and compares computing the progress by going over all the
+loading assets for each event, as `Project` did, with the running totals
+kept by `LoadingAssets`.
+"""
+import argparse
+import random
+import time
+
+from pitivi.project import LoadingAssets
+
+
+class FakeAsset(object):
+    """An asset being imported."""
+
+    def __init__(self, duration):
+        self.duration = duration
+        self.creation_progress = 0
+
+    def get_duration(self):
+        return self.duration
+
+
+def rescan_progress(assets):
+    """Computes the progress by going over all the assets."""
+    total_duration = sum(asset.get_duration() for asset in assets)
+    progress = 0
+    all_ready = True
+    for asset in assets:
+        progress += asset.get_duration() / total_duration * asset.creation_progress
+        if asset.creation_progress < 100:
+            all_ready = False
+    return 100 if all_ready else progress
+
+
+def simulate(n_assets, n_updates, account):
+    """Runs the import simulation.
+
+    Args:
+        n_assets (int): The number of imported assets.
+        n_updates (int): The number of progress events of each asset.
+        account (function): Called with the asset for each event, returns
+            the progress of the import.
+
+    Returns:
+        float: The time spent accounting, in seconds.
+    """
+    random.seed(0)
+    assets = [FakeAsset(random.randint(1, 3600)) for unused_i in range(n_assets)]
+    events = [(asset, (i + 1) * 100 // n_updates)
+              for asset in assets for i in range(n_updates)]
+    # The assets are transcoded concurrently, their events are interleaved.
+    events.sort(key=lambda event: event[1])
+
+    loading_assets = LoadingAssets()
+    for asset in assets:
+        loading_assets.add(asset)
+
+    start = time.perf_counter()
+    for asset, creation_progress in events:
+        asset.creation_progress = creation_progress
+        progress = account(loading_assets, asset)
+    assert progress == 100, progress
+    return time.perf_counter() - start
+
+
+def benchmark(n_assets, n_updates):
+    """Prints the time spent accounting the progress of the import."""
+    def rescan(loading_assets, unused_asset):
+        return rescan_progress(loading_assets)
+
+    def incremental(loading_assets, asset):
+        loading_assets.update(asset)
+        return loading_assets.progress_by_duration()
+
+    events = n_assets * n_updates
+    print("%d assets, %d progress events" % (n_assets, events))
+    for name, account in (("rescan", rescan), ("incremental", incremental)):
+        duration = simulate(n_assets, n_updates, account)
+        print("%12s: %9.3f s total, %9.3f us/event" %
+              (name, duration, duration * 10 ** 6 / events))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--assets", type=int, default=2000,
+                        help="number of imported assets")
+    parser.add_argument("--updates", type=int, default=20,
+                        help="number of progress events of each asset")
+    args = parser.parse_args()
+    benchmark(args.assets, args.updates)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# Pitivi video editor
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+# Boston, MA 02110-1301, USA.
+"""Benchmark of the waveform drawing at several zoom levels.
+
+Compares drawing the samples as a list, as done before `fill_surface`
+accepted buffers, with drawing the `WaveformPeaks` views directly.
+"""
+import argparse
+import timeit
+
+import numpy
+from gi.repository import Gst
+
+from pitivi.timeline.previewers import renderer
+from pitivi.timeline.previewers import SAMPLE_DURATION
+from pitivi.timeline.previewers import WaveformPeaks
+from pitivi.utils.ui import EXPANDED_SIZE
+
+SURFACE_WIDTH = 2000
+ZOOMS = (1, 4, 16, 64, 256)
+
+
+def benchmark(duration, repeat):
+    """Prints the time spent drawing a surface for each zoom level.
+
+    Args:
+        duration (int): The duration of the waveform, in seconds.
+        repeat (int): The number of draws measured for each case.
+    """
+    samples = numpy.random.random(int(duration * Gst.SECOND / SAMPLE_DURATION)) * 100
+    waveform = WaveformPeaks.from_samples(samples)
+
+    print("samples/pixel   list (ms)  rms (ms)  envelope (ms)")
+    for samples_per_pixel in ZOOMS:
+        end = min(waveform.n_samples, SURFACE_WIDTH * samples_per_pixel)
+        base = waveform.rms(0, end).tolist()
+        rms = waveform.rms(0, end, samples_per_pixel)
+        envelope = waveform.envelope(0, end, samples_per_pixel)
+
+        cases = (
+            # What AudioPreviewer.do_draw did: draw a list of the samples.
+            lambda: renderer.fill_surface(base, SURFACE_WIDTH, EXPANDED_SIZE),
+            lambda: renderer.fill_surface(rms, SURFACE_WIDTH, EXPANDED_SIZE),
+            lambda: renderer.fill_surface(envelope, SURFACE_WIDTH, EXPANDED_SIZE, envelope=True))
+        times = [timeit.timeit(case, number=repeat) * 1000 / repeat for case in cases]
+        print("%13d %11.3f %9.3f %14.3f" % (samples_per_pixel, *times))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--duration", type=int, default=3600,
+                        help="duration of the waveform, in seconds")
+    parser.add_argument("--repeat", type=int, default=20,
+                        help="number of draws measured for each case")
+    args = parser.parse_args()
+    benchmark(args.duration, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+# Pitivi video editor
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+# Boston, MA 02110-1301, USA.
+"""Tests for the autoaligner module."""
+# pylint: disable=protected-access
+import os
+import tempfile
+from unittest import mock
+
+import numpy
+from gi.repository import Gst
+
+from pitivi.autoaligner import affinealign
+from pitivi.autoaligner import AutoAligner
+from pitivi.autoaligner import DRIFT_META
+from pitivi.autoaligner import EnvelopeCache
+from pitivi.autoaligner import EnvelopeExtractee
+from pitivi.autoaligner import next_fast_len
+from pitivi.autoaligner import pyramidalign
+from pitivi.autoaligner import rigidalign
+from pitivi.timeline.previewers import WaveformPeaks
+from tests import common
+
+
+class TestEnvelopeExtractee(common.TestCase):
+    """Tests for the EnvelopeExtractee class."""
+
+    def test_blocks(self):
+        """Checks the envelope sums the absolute samples of each block."""
+        callback = mock.Mock()
+        extractee = EnvelopeExtractee(4, callback)
+        extractee._threshold = 8
+        extractee.receive(numpy.array([1, -1, 1, -1, 2], dtype=numpy.float32))
+        extractee.receive(numpy.array([-2, 2, 2, 3], dtype=numpy.float32))
+        extractee.receive(numpy.array([3, 3, 3, 5], dtype=numpy.float32))
+        extractee.finalize()
+
+        envelope = callback.call_args[0][0]
+        self.assertEqual(list(envelope), [4, 8, 12])
+
+
+class TestEnvelopeCache(common.TestCase):
+    """Tests for the EnvelopeCache class."""
+
+    def test_envelope(self):
+        """Checks the envelopes of the media files are saved and sliced."""
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with tempfile.NamedTemporaryFile() as media:
+                media.write(b"audio")
+                media.flush()
+                uri = Gst.filename_to_uri(media.name)
+
+                cache = EnvelopeCache(cache_dir)
+                with mock.patch("pitivi.autoaligner.PreviewsCacheManager"):
+                    self.assertIsNone(cache.get_envelope(uri, 25, 0, Gst.SECOND))
+
+                    cache.save(uri, 25, numpy.arange(100))
+                    path = cache.location(uri, 25)
+                    self.assertTrue(os.path.exists(path))
+                    self.assertEqual(numpy.load(path).dtype, numpy.float32)
+
+                    envelope = cache.get_envelope(uri, 25, Gst.SECOND, 2 * Gst.SECOND)
+                    self.assertEqual(list(envelope), list(range(25, 75)))
+                    # Another block rate has its own envelope.
+                    self.assertIsNone(cache.get_envelope(uri, 50, 0, Gst.SECOND))
+
+            # The media file is missing, for example only its proxy is left.
+            self.assertIsNone(cache.get_envelope(uri, 25, 0, Gst.SECOND))
+
+
+class TestAutoAligner(common.TestCase):
+    """Tests for the AutoAligner class."""
+
+    def test_waveform_envelope(self):
+        """Checks the waveform of the asset is reused when available."""
+        # 10 ms samples, aggregated by 4 into 40 ms blocks.
+        samples = numpy.repeat([1, 2, 3, 4, 5], 4).astype(numpy.float64)
+        audiotrack = mock.Mock()
+        audiotrack.props.in_point = 4 * Gst.SECOND // 100
+        audiotrack.props.duration = 12 * Gst.SECOND // 100
+
+        aligner = AutoAligner([], mock.Mock())
+        with tempfile.NamedTemporaryFile(suffix=".peaks.npy") as wavefile:
+            WaveformPeaks.from_samples(samples).save(wavefile.name)
+            with mock.patch("pitivi.autoaligner.get_wavefile_location_for_uri",
+                            return_value=wavefile.name):
+                envelope = aligner._envelopeFromWaveform(mock.Mock(), audiotrack)
+        self.assertEqual(list(envelope), [2, 3, 4])
+
+        with mock.patch("pitivi.autoaligner.get_wavefile_location_for_uri",
+                        return_value="/nonexistent.peaks.npy"):
+            self.assertIsNone(aligner._envelopeFromWaveform(mock.Mock(), audiotrack))
+
+    def test_extracted_envelope(self):
+        """Checks the envelope of an asset is cached and sliced for its clips."""
+        clip1 = mock.Mock()
+        clip1.props.in_point = 0
+        clip1.props.duration = 2 * Gst.SECOND
+        clip2 = mock.Mock()
+        clip2.props.in_point = Gst.SECOND
+        clip2.props.duration = 2 * Gst.SECOND
+
+        aligner = AutoAligner([clip1, clip2], mock.Mock())
+        aligner._envelope_cache = mock.Mock()
+        envelope = numpy.arange(4 * AutoAligner.BLOCKRATE, dtype=numpy.float32)
+
+        def receive(array, duration):
+            aligner._clips = dict.fromkeys([clip1, clip2])
+            aligner._clips_by_uri["file:///a.ogg"] = [clip1, clip2]
+            aligner._running_extractions["file:///a.ogg"] = (mock.Mock(), duration)
+            aligner._envelope_cache.reset_mock()
+            with mock.patch("pitivi.autoaligner.getAudioTrack", side_effect=lambda clip: clip), \
+                    mock.patch.object(aligner, "_finish") as finish:
+                aligner._envelopeCb(array, "file:///a.ogg")
+            finish.assert_called_once_with()
+
+        receive(envelope, 4 * Gst.SECOND)
+        aligner._envelope_cache.save.assert_called_once_with(
+            "file:///a.ogg", AutoAligner.BLOCKRATE, envelope)
+        self.assertEqual(list(aligner._clips[clip1]),
+                         list(range(0, 2 * AutoAligner.BLOCKRATE)))
+        self.assertEqual(list(aligner._clips[clip2]),
+                         list(range(AutoAligner.BLOCKRATE, 3 * AutoAligner.BLOCKRATE)))
+
+        # A truncated envelope is used but not cached.
+        receive(envelope, 10 * Gst.SECOND)
+        aligner._envelope_cache.save.assert_not_called()
+        self.assertEqual(len(aligner._clips[clip1]), 2 * AutoAligner.BLOCKRATE)
+
+        # The clips are not aligned when the extraction failed.
+        receive(None, 4 * Gst.SECOND)
+        aligner._envelope_cache.save.assert_not_called()
+        self.assertEqual(aligner._clips, {clip1: None, clip2: None})
+
+    def test_drift(self):
+        """Checks the drift of the aligned clips is saved."""
+        reference = mock.Mock()
+        reference.get_layer.return_value.get_priority.return_value = 0
+        reference.props.start = 10 * Gst.SECOND
+        movable = mock.Mock()
+        movable.get_layer.return_value.get_priority.return_value = 1
+
+        aligner = AutoAligner([reference, movable], mock.Mock(), drift=True)
+        aligner._clips = {reference: numpy.zeros(10), movable: numpy.zeros(10)}
+        with mock.patch("pitivi.autoaligner.affinealign",
+                        return_value=([-50], [0.001])):
+            aligner._performShifts()
+        reference.set_double.assert_called_once_with(DRIFT_META, 0.0)
+        movable.set_double.assert_called_once_with(DRIFT_META, 0.001)
+        movable.set_start.assert_called_once_with(8 * Gst.SECOND)
+
+
+class TestRigidAlign(common.TestCase):
+    """Tests for the rigidalign function."""
+
+    def test_shift(self):
+        """Checks the shift between two envelopes is found."""
+        numpy.random.seed(1)
+        reference = numpy.random.rand(1000)
+        target = reference[37:537]
+        shift, = rigidalign(reference, [target])
+        self.assertAlmostEqual(shift, 37, delta=0.5)
+
+    def test_multiple_targets(self):
+        """Checks targets of different lengths are aligned together."""
+        numpy.random.seed(1)
+        reference = numpy.random.rand(1001)
+        targets = [reference[37:537],
+                   numpy.concatenate([numpy.random.rand(20), reference[:300]]),
+                   reference[5:]]
+        shifts = rigidalign(reference, targets)
+        for shift, expected in zip(shifts, [37, -20, 5]):
+            self.assertAlmostEqual(shift, expected, delta=0.5)
+
+    def test_next_fast_len(self):
+        """Checks the FFT sizes only have 2, 3 and 5 as prime factors."""
+        self.assertEqual(next_fast_len(1), 1)
+        self.assertEqual(next_fast_len(7), 8)
+        self.assertEqual(next_fast_len(11), 12)
+        self.assertEqual(next_fast_len(1025), 1080)
+        self.assertEqual(next_fast_len(1080), 1080)
+
+
+class TestPyramidAlign(common.TestCase):
+    """Tests for the pyramidalign function."""
+
+    def test_shifts(self):
+        """Checks the coarse to fine search finds the same shifts."""
+        numpy.random.seed(1)
+        events = numpy.convolve(numpy.random.rand(20000), numpy.ones(5) / 5)
+        reference = events[:10000]
+        targets = [events[1234:9000] + 0.5 * numpy.random.rand(7766),
+                   numpy.concatenate([numpy.random.rand(77), events[:5000]])]
+        with mock.patch("pitivi.autoaligner.PYRAMID_MAX_BLOCKS", 500), \
+                mock.patch("pitivi.autoaligner.PYRAMID_CHUNK", 1000), \
+                mock.patch("pitivi.autoaligner.rigidalign") as rigidalign_mock:
+            shifts = pyramidalign(reference, targets)
+        rigidalign_mock.assert_not_called()
+        for shift, expected in zip(shifts, [1234, -77]):
+            self.assertAlmostEqual(shift, expected, delta=0.5)
+        self.assertEqual(pyramidalign(reference, targets),
+                         rigidalign(reference, targets))
+
+
+class TestAffineAlign(common.TestCase):
+    """Tests for the affinealign function."""
+
+    @staticmethod
+    def record(event, offset, drift, length):
+        """Records the event with a clock drifting relative to the reference."""
+        positions = offset + (1 + drift) * numpy.arange(length)
+        samples = numpy.interp(positions, numpy.arange(len(event)), event)
+        return samples + 0.3 * numpy.random.rand(length)
+
+    def test_drift(self):
+        """Checks the offsets and the drifts of drifted signals are found."""
+        numpy.random.seed(2)
+        event = numpy.convolve(numpy.random.rand(60000), numpy.ones(4) / 4)
+        reference = event[:50000]
+        targets = [self.record(event, 1234.5, 0.0005, 40000),
+                   self.record(event, 300, -0.001, 20000),
+                   self.record(event, 100, 0.01, 10000),
+                   self.record(event, 50, 0, 10000)]
+        with mock.patch("pitivi.autoaligner.AFFINE_MAX_FFT", 2 ** 10):
+            offsets, drifts = affinealign(reference, targets)
+        for offset, expected in zip(offsets, [1234.5, 300, 100, 50]):
+            self.assertAlmostEqual(offset, expected, delta=0.5)
+        for drift, expected in zip(drifts, [0.0005, -0.001, 0.01, 0]):
+            self.assertAlmostEqual(drift, expected, delta=0.0001)
+
+    def test_unmatched(self):
+        """Checks the rigid shift is used when the drift can't be measured."""
+        numpy.random.seed(2)
+        reference = numpy.random.rand(5000)
+        target = reference[100:300]
+        offsets, drifts = affinealign(reference, [target])
+        self.assertAlmostEqual(offsets[0], 100, delta=0.5)
+        self.assertEqual(drifts, [0.0])
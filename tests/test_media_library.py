@@ -16,21 +16,67 @@
 # License along with this program; if not, write to the
 # Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
 # Boston, MA 02110-1301, USA.
+import contextlib
 import os
 import tempfile
 from gettext import gettext as _
 from unittest import mock
 
+from gi.repository import GdkPixbuf
 from gi.repository import GES
+from gi.repository import GLib
 from gi.repository import Gst
 
 from pitivi import medialibrary
 from pitivi.project import ProjectManager
 from pitivi.timeline import timeline
 from pitivi.utils.proxy import ProxyingStrategy
+from pitivi.utils.proxy import ProxyJobState
 from tests import common
 
 
+class TestAssetThumbnail(common.TestCase):
+    """Tests for the AssetThumbnail class."""
+
+    def test_decorations(self):
+        """Checks the thumbnails are read and decorated when needed."""
+        asset = mock.Mock()
+        asset.props.id = "file:///asset"
+        asset.proxying_error = None
+        proxy_manager = mock.Mock()
+        proxy_manager.is_proxy_asset.return_value = False
+        small = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, True, 8, 64, 36)
+        large = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, True, 8, 128, 72)
+
+        with mock.patch.object(medialibrary.AssetThumbnail, "get_placeholder_icons",
+                               return_value=(None, None)), \
+                mock.patch.object(medialibrary.AssetThumbnail,
+                                  "_AssetThumbnail__get_thumbnails",
+                                  return_value=(small, large)) as get_thumbnails:
+            thumb = medialibrary.AssetThumbnail(asset, proxy_manager,
+                                                ProxyJobState.NONE, lazy=True)
+            get_thumbnails.assert_not_called()
+            self.assertFalse(thumb.loaded)
+            self.assertEqual(thumb.state, medialibrary.AssetThumbnail.NO_PROXY)
+
+            thumb.load(ProxyJobState.NONE)
+            self.assertIs(thumb.small_thumb, small)
+            self.assertFalse(thumb.needs_decorating)
+
+            thumb.update_state(ProxyJobState.RUNNING)
+            self.assertEqual(thumb.state, medialibrary.AssetThumbnail.IN_PROGRESS)
+            self.assertTrue(thumb.needs_decorating)
+            thumb.decorate(ProxyJobState.RUNNING)
+            decorated = thumb.small_thumb
+            self.assertIsNot(decorated, small)
+
+            # The decorated thumbnails are reused.
+            thumb.decorate(ProxyJobState.NONE)
+            self.assertIs(thumb.small_thumb, small)
+            thumb.decorate(ProxyJobState.PENDING)
+            self.assertIs(thumb.small_thumb, decorated)
+
+
 class BaseTestMediaLibrary(common.TestCase):
 
     def __init__(self, *args):
@@ -228,3 +274,75 @@ class TestMediaLibrary(BaseTestMediaLibrary):
             with common.created_project_file(asset_uri) as uri:
                 self._customSetUp(project_uri=uri)
         self.assertTrue(self.medialibrary._import_warning_infobar.props.visible)
+
+    @staticmethod
+    def create_assets(count):
+        """Creates fake assets, in reverse order of their URIs."""
+        assets = []
+        for i in reversed(range(count)):
+            asset = mock.Mock()
+            asset.props.id = "file:///asset%04d" % i
+            asset.proxying_error = None
+            assets.append(asset)
+        return assets
+
+    @staticmethod
+    def patch_rows():
+        """Patches the creation of the rows for fake assets."""
+        patches = contextlib.ExitStack()
+        patches.enter_context(mock.patch.object(medialibrary, "beautify_asset", return_value=""))
+        patches.enter_context(mock.patch.object(medialibrary, "info_name", return_value=""))
+        patches.enter_context(mock.patch.object(medialibrary.AssetThumbnail,
+                                                "get_placeholder_icons",
+                                                return_value=(None, None)))
+        return patches
+
+    def test_bulk_import(self):
+        """Checks many assets are added in chunks, then sorted."""
+        self._customSetUp()
+        mlib = self.medialibrary
+        assets = self.create_assets(mlib.IMPORT_CHUNK_SIZE * 2 + 1)
+
+        with self.patch_rows():
+            mlib._pending_assets.extend(assets)
+            mlib._flushPendingAssets()
+            self.assertEqual(len(mlib.storemodel), 0)
+
+            mlib._MediaLibraryWidget__flush_chunk_cb()
+            self.assertEqual(len(mlib.storemodel), mlib.IMPORT_CHUNK_SIZE)
+
+            while mlib._MediaLibraryWidget__flush_id:
+                GLib.MainContext.default().iteration(False)
+
+        self.assertEqual([row[medialibrary.COL_URI] for row in mlib.storemodel],
+                         sorted(asset.props.id for asset in assets))
+        # The rows are not displayed, their thumbnails are not read.
+        self.assertFalse([row for row in mlib.storemodel
+                          if row[medialibrary.COL_THUMB_DECORATOR].loaded])
+
+    def test_bulk_import_project_closed(self):
+        """Checks the bulk import stops when the project is closed."""
+        self._customSetUp()
+        mlib = self.medialibrary
+        assets = self.create_assets(mlib.IMPORT_CHUNK_SIZE * 2 + 1)
+
+        with self.patch_rows():
+            mlib._pending_assets.extend(assets)
+            mlib._flushPendingAssets()
+            mlib._MediaLibraryWidget__flush_chunk_cb()
+            self.assertEqual(len(mlib.storemodel), mlib.IMPORT_CHUNK_SIZE)
+
+            project_manager = self.app.project_manager
+            project_manager.connect("closing-project", lambda *unused_args: True)
+            self.assertTrue(project_manager.closeRunningProject())
+            self.assertFalse(mlib._MediaLibraryWidget__flush_id)
+            self.assertEqual(mlib._pending_assets, [])
+            self.assertEqual(mlib.storemodel.get_sort_column_id()[0], medialibrary.COL_URI)
+
+            project_manager.newBlankProject()
+            project_manager.current_project.connect("loaded", self.projectLoadedCb)
+            self.mainloop.run()
+            # Let any leftover chunk callback run.
+            self.mainloop.run(until_empty=True)
+
+        self.assertEqual(len(mlib.storemodel), 0)
@@ -18,20 +18,43 @@
 # Boston, MA 02110-1301, USA.
 """Tests for the timeline.previewers module."""
 # pylint: disable=protected-access
+import collections
+import concurrent.futures
 import os
+import sqlite3
+import sys
 import tempfile
 from unittest import mock
 
+import cairo
 import numpy
 from gi.repository import GdkPixbuf
 from gi.repository import GES
+from gi.repository import GLib
 from gi.repository import Gst
 
+from pitivi.timeline.previewers import AssetAnalyzer
+from pitivi.timeline.previewers import AudioPreviewer
+from pitivi.timeline.previewers import CacheEvictionThread
 from pitivi.timeline.previewers import get_wavefile_location_for_uri
+from pitivi.timeline.previewers import migrate_legacy_wavefile
+from pitivi.timeline.previewers import PreviewGeneratorManager
+from pitivi.timeline.previewers import PreviewsCacheManager
+from pitivi.timeline.previewers import renderer
+from pitivi.timeline.previewers import SAMPLE_DURATION
+from pitivi.timeline.previewers import SEEK_COST
+from pitivi.timeline.previewers import SWEEP_MIN_THUMBS
 from pitivi.timeline.previewers import THUMB_HEIGHT
 from pitivi.timeline.previewers import THUMB_PERIOD
 from pitivi.timeline.previewers import ThumbnailCache
+from pitivi.timeline.previewers import ThumbnailStore
 from pitivi.timeline.previewers import VideoPreviewer
+from pitivi.timeline.previewers import WAVEFORM_LEVELS
+from pitivi.timeline.previewers import WAVEFORM_TILE_WIDTH
+from pitivi.timeline.previewers import WaveformPeaks
+from pitivi.timeline.previewers import WaveformPreviewer
+from pitivi.utils.misc import hash_file
+from pitivi.utils.timeline import Zoomable
 from tests import common
 from tests.test_media_library import BaseTestMediaLibrary
 
@@ -92,10 +115,276 @@ class TestAudioPreviewer(BaseTestMediaLibrary):
 
         self.assertTrue(os.path.exists(wavefile), wavefile)
 
-        with open(wavefile, "rb") as fsamples:
-            samples = list(numpy.load(fsamples))
+        waveform = WaveformPeaks.load(wavefile)
+        self.assertEqual(waveform.n_samples, len(SIMPSON_WAVFORM_VALUES))
+        # The peaks are stored as float16.
+        numpy.testing.assert_array_equal(
+            waveform.rms(), numpy.array(SIMPSON_WAVFORM_VALUES).astype(numpy.float16))
 
-        self.assertEqual(samples, SIMPSON_WAVFORM_VALUES)
+    def test_fill_surface(self):
+        """Checks the waveform views are drawn without converting them."""
+        waveform = WaveformPeaks.from_samples(numpy.arange(100, dtype=numpy.float64))
+        for samples, envelope in ((list(range(100)), False),
+                                  (waveform.rms(), False),
+                                  (waveform.rms(samples_per_pixel=4), False),
+                                  (waveform.envelope(samples_per_pixel=4), True)):
+            surface = renderer.fill_surface(samples, 10, 20, envelope=envelope)
+            self.assertEqual((surface.get_width(), surface.get_height()), (10, 20))
+
+        with self.assertRaises(TypeError):
+            renderer.fill_surface(numpy.arange(10), 10, 20)
+        with self.assertRaises(ValueError):
+            renderer.fill_surface(waveform.rms(), 10, 20, envelope=True)
+
+    def test_fill_surface_envelope(self):
+        """Checks the min/max band is drawn over the RMS filled from the bottom."""
+        # The (min, max, RMS) rows.
+        samples = numpy.tile([5.0, 15.0, 10.0], (10, 1))
+        surface = renderer.fill_surface(samples, 10, 20, envelope=True)
+        data = surface.get_data()
+        stride = surface.get_stride()
+
+        def alpha(x, y):
+            # ARGB32 pixels are stored in native endianness.
+            return data[y * stride + x * 4 + (3 if sys.byteorder == "little" else 0)]
+
+        # Below the min, only the RMS fill.
+        self.assertEqual(alpha(5, 17), 255)
+        # Between the RMS and the max, only the translucent band.
+        self.assertTrue(0 < alpha(5, 7) < 255)
+        # Above the max.
+        self.assertEqual(alpha(5, 2), 0)
+
+        with self.assertRaises(ValueError):
+            renderer.fill_surface(samples[:, :2], 10, 20, envelope=True)
+
+    @staticmethod
+    def create_previewer():
+        ges_elem = mock.Mock()
+        ges_elem.props.id = common.get_sample_uri("1sec_simpsons_trailer.mp4")
+        ges_elem.props.in_point = 0
+        asset = ges_elem.get_parent.return_value.get_asset.return_value
+        asset.get_duration.return_value = Gst.SECOND
+        with mock.patch.object(AudioPreviewer, "become_controlled"):
+            previewer = AudioPreviewer(ges_elem, 90)
+        previewer.waveform = WaveformPeaks.from_samples(numpy.arange(100, dtype=numpy.float64))
+        previewer.discovered = True
+        previewer.props.width_request = 300
+        previewer.get_parent = mock.Mock()
+        previewer.get_parent.return_value.get_allocation.return_value.height = 20
+        previewer.queue_draw = mock.Mock()
+        return previewer
+
+    def test_tile_keys(self):
+        """Checks the tiles are keyed by their width."""
+        previewer = self.create_previewer()
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, 300, 20)
+        with mock.patch.object(AudioPreviewer, "tiles", collections.OrderedDict()), \
+                mock.patch.object(Zoomable, "zoomratio", 100), \
+                mock.patch.object(AudioPreviewer, "_AudioPreviewer__draw_tile") as draw_tile:
+            previewer.do_draw(cairo.Context(surface))
+
+        uri = previewer._uri
+        self.assertEqual([args[0] for args, unused_kwargs in draw_tile.call_args_list],
+                         [(uri, 100, 20, 0, 0, WAVEFORM_TILE_WIDTH),
+                          (uri, 100, 20, 0, 1, 300 - WAVEFORM_TILE_WIDTH)])
+
+    def test_release_tiles(self):
+        """Checks the tiles being drawn are dropped on release."""
+        previewer = self.create_previewer()
+        pool = mock.Mock()
+        queued_future = concurrent.futures.Future()
+        running_future = concurrent.futures.Future()
+        running_future.set_running_or_notify_cancel()
+        pool.submit.side_effect = [queued_future, running_future]
+        queued_key = (previewer._uri, 100, 20, 0, 0, 100)
+        running_key = (previewer._uri, 100, 20, 0, 0, 50)
+        tiles = collections.OrderedDict()
+        with mock.patch.object(AudioPreviewer, "tiles", tiles), \
+                mock.patch.object(AudioPreviewer, "tiles_pool", pool), \
+                mock.patch.object(Zoomable, "zoomratio", 100), \
+                mock.patch.object(GLib, "idle_add"):
+            previewer._AudioPreviewer__draw_tile(queued_key)
+            previewer._AudioPreviewer__draw_tile(running_key)
+            self.assertEqual(pool.submit.call_count, 2)
+
+            previewer.release()
+            self.assertTrue(queued_future.cancelled())
+
+            running_future.set_result(mock.Mock())
+            previewer._AudioPreviewer__tile_drawn_cb(running_key, running_future)
+            self.assertEqual(tiles, {})
+            previewer.queue_draw.assert_not_called()
+
+    def test_legacy_wavefile_migration(self):
+        """Checks the legacy .wave.npy files are converted."""
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            wavefile = os.path.join(tmpdirname, "hash.peaks.npy")
+            with open(os.path.join(tmpdirname, "hash.wave.npy"), "wb") as legacy:
+                numpy.save(legacy, numpy.array(SIMPSON_WAVFORM_VALUES))
+
+            migrate_legacy_wavefile(wavefile)
+
+            self.assertEqual(os.listdir(tmpdirname), ["hash.peaks.npy"])
+            waveform = WaveformPeaks.load(wavefile)
+            numpy.testing.assert_allclose(waveform.rms(), SIMPSON_WAVFORM_VALUES, rtol=1e-3)
+
+
+class TestWaveformPeaks(common.TestCase):
+    """Tests for the `WaveformPeaks` class."""
+
+    def test_levels(self):
+        """Checks the levels aggregate the base samples."""
+        samples = numpy.arange(1, 11, dtype=numpy.float64)
+        waveform = WaveformPeaks.from_samples(samples)
+        self.assertEqual(WaveformPeaks.level_lengths(10), [10, 3, 1, 1])
+        self.assertEqual(waveform.n_samples, 10)
+
+        level = waveform.get(0, 10, level=1)
+        self.assertEqual(level[:, WaveformPeaks.MIN].tolist(), [1, 5, 9])
+        self.assertEqual(level[:, WaveformPeaks.MAX].tolist(), [4, 8, 10])
+        numpy.testing.assert_allclose(level[:, WaveformPeaks.RMS],
+                                      [numpy.sqrt(7.5), numpy.sqrt(43.5), numpy.sqrt(90.5)],
+                                      rtol=1e-3)
+
+        # A range of base samples maps to the samples of the level covering it.
+        self.assertEqual(len(waveform.get(4, 9, level=1)), 2)
+
+    def test_level_for(self):
+        """Checks the coarsest level with a sample per pixel is chosen."""
+        self.assertEqual(WaveformPeaks.level_for(0.5), 0)
+        self.assertEqual(WaveformPeaks.level_for(3.9), 0)
+        self.assertEqual(WaveformPeaks.level_for(4), 1)
+        self.assertEqual(WaveformPeaks.level_for(20), 2)
+        self.assertEqual(WaveformPeaks.level_for(10 ** 6), WAVEFORM_LEVELS - 1)
+
+    def test_empty(self):
+        """Checks an empty waveform can be saved and loaded."""
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            path = os.path.join(tmpdirname, "empty.peaks.npy")
+            WaveformPeaks.from_samples([]).save(path)
+            waveform = WaveformPeaks.load(path)
+            self.assertEqual(waveform.n_samples, 0)
+            self.assertEqual(len(waveform.rms()), 0)
+            self.assertEqual(waveform.loudness(), (float("-inf"), float("-inf")))
+
+    def test_loudness(self):
+        """Checks the loudness is computed from the RMS values."""
+        waveform = WaveformPeaks.from_samples([100, 10, 0])
+        peak, mean = waveform.loudness()
+        self.assertAlmostEqual(peak, 0, places=2)
+        self.assertAlmostEqual(mean, 20 * numpy.log10(numpy.sqrt(10100 / 3) / 100), places=2)
+
+
+def interpolate_levels(levels, n_samples):
+    """Interpolates the levels sample by sample, as WaveformPreviewer used to."""
+    peaks = None
+    prev_pos = 0
+    for stream_time, rms in levels:
+        if peaks is None:
+            peaks = [[0] * n_samples for unused_channel in rms]
+
+        pos = int(stream_time / SAMPLE_DURATION)
+        if pos >= len(peaks[0]):
+            continue
+
+        for i, val in enumerate(rms):
+            if val < 0:
+                val = 10 ** (val / 20) * 100
+            else:
+                val = peaks[i][pos - 1]
+
+            unknowns = range(prev_pos + 1, pos)
+            if unknowns:
+                prev_val = peaks[i][prev_pos]
+                linear_const = (val - prev_val) / len(unknowns)
+                for temppos in unknowns:
+                    peaks[i][temppos] = peaks[i][temppos - 1] + linear_const
+
+            peaks[i][pos] = val
+        prev_pos = pos
+    return peaks
+
+
+class TestWaveformPreviewer(common.TestCase):
+    """Tests for the `WaveformPreviewer` class."""
+
+    def test_level_messages(self):
+        """Checks the gaps between the levels are interpolated exactly."""
+        n_samples = 40
+        previewer = WaveformPreviewer()
+        previewer.props.duration = n_samples * SAMPLE_DURATION
+        # The (stream-time, rms) of the level messages, with gaps, a
+        # non-negative value reusing the previous one, and a position
+        # after the end.
+        levels = [(0, [-20.0, -30.0]),
+                  (SAMPLE_DURATION, [-10.5, -12.25]),
+                  (5 * SAMPLE_DURATION, [-3.0, 0.0]),
+                  (6 * SAMPLE_DURATION + 1, [-50.0, -0.5]),
+                  (17 * SAMPLE_DURATION, [-7.0, -44.0]),
+                  (18 * SAMPLE_DURATION, [0.0, -1.0]),
+                  (39 * SAMPLE_DURATION, [-60.0, -2.0]),
+                  (45 * SAMPLE_DURATION, [-1.0, -1.0])]
+
+        with mock.patch.object(Gst.Bin, "do_post_message"):
+            for stream_time, rms in levels:
+                message = mock.Mock()
+                message.type = Gst.MessageType.ELEMENT
+                message.src = previewer.level
+                message.get_structure.return_value.get_value.side_effect = \
+                    {"rms": rms, "stream-time": stream_time}.get
+                previewer.do_post_message(message)
+
+        numpy.testing.assert_array_equal(previewer.peaks,
+                                         interpolate_levels(levels, n_samples))
+
+
+class TestAssetAnalyzer(common.TestCase):
+    """Tests for the `AssetAnalyzer` class."""
+
+    def test_analysis(self):
+        """Checks the thumbnails and the waveform are created in one pass."""
+        sample_name = "1sec_simpsons_trailer.mp4"
+        mainloop = common.create_main_loop()
+        with tempfile.TemporaryDirectory() as tmpdirname, \
+                common.cloned_sample(sample_name), \
+                mock.patch("pitivi.timeline.previewers.xdg_cache_home",
+                           return_value=tmpdirname), \
+                mock.patch.object(AssetAnalyzer, "pending", collections.deque()), \
+                mock.patch.object(AssetAnalyzer, "running", set()):
+            uri = common.get_sample_uri(sample_name)
+            asset = GES.UriClipAsset.request_sync(uri)
+
+            analyzer = AssetAnalyzer.analyze(asset)
+            self.assertIsNotNone(analyzer)
+            self.assertEqual(AssetAnalyzer.running, {analyzer})
+            analyzer.connect("done", lambda unused_analyzer: mainloop.quit())
+            mainloop.run(timeout_seconds=20)
+            # Process the thumbnails still waiting to be added.
+            mainloop.run(until_empty=True)
+
+            self.assertFalse(AssetAnalyzer.running)
+            self.assertTrue(ThumbnailCache.get(uri, THUMB_HEIGHT).positions)
+            self.assertTrue(os.path.exists(get_wavefile_location_for_uri(uri)))
+            # Nothing is missing anymore.
+            self.assertIsNone(AssetAnalyzer.analyze(asset))
+
+    def test_legacy_wavefile(self):
+        """Checks the legacy waveform is migrated instead of recreated."""
+        sample_name = "1sec_simpsons_trailer.mp4"
+        with tempfile.TemporaryDirectory() as tmpdirname, \
+                common.cloned_sample(sample_name), \
+                mock.patch("pitivi.timeline.previewers.xdg_cache_home",
+                           return_value=tmpdirname):
+            uri = common.get_sample_uri(sample_name)
+            asset = GES.UriClipAsset.request_sync(uri)
+            wavefile = get_wavefile_location_for_uri(uri)
+            with open(wavefile[:-len(".peaks.npy")] + ".wave.npy", "wb") as legacy:
+                numpy.save(legacy, numpy.array(SIMPSON_WAVFORM_VALUES))
+
+            analyzer = AssetAnalyzer(asset)
+            self.assertFalse(analyzer.waveform)
+            self.assertTrue(os.path.exists(wavefile))
 
 
 class TestVideoPreviewer(common.TestCase):
@@ -123,6 +412,122 @@ class TestVideoPreviewer(common.TestCase):
         self.assertEqual(run_thumb_interval(2 * THUMB_PERIOD - 1), 2 * THUMB_PERIOD)
         self.assertEqual(run_thumb_interval(2 * THUMB_PERIOD), 2 * THUMB_PERIOD)
 
+    def test_should_sweep(self):
+        """Checks when the thumbnails are created by decoding sequentially."""
+        ges_elem = mock.Mock()
+        ges_elem.props.uri = common.get_sample_uri("1sec_simpsons_trailer.mp4")
+        ges_elem.props.id = common.get_sample_uri("1sec_simpsons_trailer.mp4")
+        previewer = VideoPreviewer(ges_elem, 94)
+
+        previewer.queue = [position * THUMB_PERIOD
+                           for position in range(SWEEP_MIN_THUMBS - 1)]
+        self.assertFalse(previewer._should_sweep())
+
+        previewer.queue = [position * THUMB_PERIOD
+                           for position in range(SWEEP_MIN_THUMBS)]
+        self.assertTrue(previewer._should_sweep())
+
+        # Too sparse, seeking is cheaper.
+        previewer.queue = [position * 2 * SEEK_COST
+                           for position in range(SWEEP_MIN_THUMBS)]
+        self.assertFalse(previewer._should_sweep())
+
+
+class TestPreviewGeneratorManager(common.TestCase):
+    """Tests for the PreviewGeneratorManager class."""
+
+    @staticmethod
+    def create_previewer(start):
+        previewer = mock.Mock()
+        previewer.track_type = GES.TrackType.VIDEO
+        previewer.ges_elem.props.start = start
+        previewer.ges_elem.props.duration = 10
+        return previewer
+
+    def test_concurrent_jobs(self):
+        """Checks several previewers are run at the same time."""
+        manager = PreviewGeneratorManager()
+        manager.max_jobs = 2
+        manager._cpu_usage_tracker = mock.Mock()
+        manager._cpu_usage_tracker.usage.return_value = 0
+
+        previewers = [self.create_previewer(i * 10) for i in range(3)]
+        for previewer in previewers:
+            manager.add_previewer(previewer)
+        self.assertEqual(manager.running_jobs, 2)
+        self.assertEqual(manager.queued_jobs, 1)
+        previewers[0].start_generation.assert_called_once_with()
+        previewers[1].start_generation.assert_called_once_with()
+        previewers[2].start_generation.assert_not_called()
+
+        # Simulate the first previewer is done.
+        done_cb = previewers[0].connect.call_args[0][1]
+        done_cb(previewers[0])
+        self.assertEqual(manager.running_jobs, 2)
+        self.assertEqual(manager.queued_jobs, 0)
+        previewers[2].start_generation.assert_called_once_with()
+
+    def test_cpu_usage(self):
+        """Checks no previewer is added when the CPU is busy."""
+        manager = PreviewGeneratorManager()
+        manager.max_jobs = 2
+        manager._cpu_usage_tracker = mock.Mock()
+        manager._cpu_usage_tracker.usage.return_value = manager.max_cpu_usage
+
+        manager.add_previewer(self.create_previewer(0))
+        manager.add_previewer(self.create_previewer(10))
+        self.assertEqual(manager.running_jobs, 1)
+        self.assertEqual(manager.queued_jobs, 1)
+
+    def test_cpu_usage_sampled_once(self):
+        """Checks the CPU usage is sampled once per scheduling pass."""
+        manager = PreviewGeneratorManager()
+        manager.max_jobs = 1
+        manager._cpu_usage_tracker = mock.Mock()
+        manager._cpu_usage_tracker.usage.return_value = 0
+
+        for i in range(4):
+            manager.add_previewer(self.create_previewer(i * 10))
+        self.assertEqual(manager.running_jobs, 1)
+        manager._cpu_usage_tracker.usage.assert_not_called()
+
+        manager.set_max_jobs(4)
+        self.assertEqual(manager.running_jobs, 4)
+        self.assertEqual(manager._cpu_usage_tracker.usage.call_count, 1)
+        self.assertEqual(manager._cpu_usage_tracker.reset.call_count, 1)
+
+    def test_visible_first(self):
+        """Checks the previewers of the visible clips are started first."""
+        manager = PreviewGeneratorManager()
+        manager.max_jobs = 1
+        manager.viewport = (100, 200)
+
+        previewers = [self.create_previewer(start) for start in (0, 10, 150)]
+        for previewer in previewers:
+            manager.add_previewer(previewer)
+
+        done_cb = previewers[0].connect.call_args[0][1]
+        done_cb(previewers[0])
+        previewers[1].start_generation.assert_not_called()
+        previewers[2].start_generation.assert_called_once_with()
+
+    def test_rerank(self):
+        """Checks the queue is re-ranked when the viewport changes."""
+        manager = PreviewGeneratorManager()
+        manager.max_jobs = 1
+        manager.playhead = 35
+
+        previewers = [self.create_previewer(start) for start in (0, 10, 20, 50)]
+        for previewer in previewers:
+            manager.add_previewer(previewer)
+        # Closest to the playhead first.
+        self.assertEqual(manager._pop_next_previewer(GES.TrackType.VIDEO), previewers[2])
+
+        manager.set_viewport(0, 15)
+        self.assertEqual(manager._pop_next_previewer(GES.TrackType.VIDEO), previewers[1])
+        self.assertEqual(manager._pop_next_previewer(GES.TrackType.VIDEO), previewers[3])
+        self.assertEqual(manager.queued_jobs, 0)
+
 
 class TestThumbnailCache(BaseTestMediaLibrary):
     """Tests for the ThumbnailCache class."""
@@ -178,3 +583,134 @@ class TestThumbnailCache(BaseTestMediaLibrary):
                 thumb_cache = ThumbnailCache(sample_uri)
                 self.assertTrue(Gst.SECOND in thumb_cache)
                 self.assertIsNotNone(thumb_cache[Gst.SECOND])
+
+    def test_get_range(self):
+        """Checks the thumbnails in a range are decoded in the background."""
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            with mock.patch("pitivi.timeline.previewers.xdg_cache_home") as xdg_cache_home:
+                xdg_cache_home.return_value = tmpdirname
+                sample_uri = common.get_sample_uri("1sec_simpsons_trailer.mp4")
+                thumb_cache = ThumbnailCache(sample_uri)
+                pixbuf = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB,
+                                              False, 8, 20, 10)
+                for position in range(0, 4 * Gst.SECOND, THUMB_PERIOD):
+                    thumb_cache[position] = pixbuf
+                thumb_cache.commit()
+                ThumbnailCache.pixbufs.clear()
+
+                mainloop = common.create_main_loop()
+                decoded = {}
+
+                def decoded_cb(position, pixbuf):
+                    decoded[position] = pixbuf
+                    if len(decoded) == 2:
+                        mainloop.quit()
+
+                pixbufs = thumb_cache.get_range(Gst.SECOND, 3 * Gst.SECOND,
+                                                Gst.SECOND, decoded_cb)
+                self.assertEqual(pixbufs, {})
+                mainloop.run()
+                self.assertEqual(set(decoded.keys()), {Gst.SECOND, 2 * Gst.SECOND})
+
+                # The decoded pixbufs are kept in memory.
+                pixbufs = thumb_cache.get_range(Gst.SECOND, 3 * Gst.SECOND,
+                                                Gst.SECOND, decoded_cb)
+                self.assertEqual(pixbufs, decoded)
+
+    def test_legacy_migration(self):
+        """Checks the per-asset databases are imported in the shared store."""
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            with mock.patch("pitivi.timeline.previewers.xdg_cache_home") as xdg_cache_home:
+                xdg_cache_home.return_value = tmpdirname
+                sample_uri = common.get_sample_uri("1sec_simpsons_trailer.mp4")
+                filehash = hash_file(Gst.uri_get_location(sample_uri))
+                legacy_dir = os.path.join(tmpdirname, "thumbs")
+                os.makedirs(legacy_dir)
+                legacy_dbfile = os.path.join(legacy_dir, filehash)
+
+                pixbuf = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB,
+                                              False, 8, 20, 10)
+                unused_success, jpeg = pixbuf.save_to_bufferv(
+                    "jpeg", ["quality", None], ["90"])
+                legacy_db = sqlite3.connect(legacy_dbfile)
+                legacy_db.execute("CREATE TABLE Thumbs "
+                                  "(Time INTEGER NOT NULL PRIMARY KEY, "
+                                  " Jpeg BLOB NOT NULL)")
+                legacy_db.execute("INSERT INTO Thumbs VALUES (?, ?)",
+                                  (Gst.SECOND, sqlite3.Binary(jpeg)))
+                legacy_db.commit()
+                legacy_db.close()
+
+                thumb_cache = ThumbnailCache(sample_uri)
+                self.assertFalse(os.path.exists(legacy_dbfile))
+                self.assertTrue(Gst.SECOND in thumb_cache)
+                self.assertEqual(thumb_cache.image_size, (20, 10))
+
+    def test_copy(self):
+        """Checks a copied cache shares the thumbnails of the original."""
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            with mock.patch("pitivi.timeline.previewers.xdg_cache_home") as xdg_cache_home:
+                xdg_cache_home.return_value = tmpdirname
+                sample_uri = common.get_sample_uri("1sec_simpsons_trailer.mp4")
+                other_uri = common.get_sample_uri("tears_of_steel.webm")
+                thumb_cache = ThumbnailCache(sample_uri)
+                pixbuf = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB,
+                                              False, 8, 20, 10)
+                thumb_cache[Gst.SECOND] = pixbuf
+                thumb_cache.commit()
+
+                thumb_cache.copy(other_uri)
+                other_cache = ThumbnailCache(other_uri)
+                self.assertTrue(Gst.SECOND in other_cache)
+
+
+class TestPreviewsCacheManager(BaseTestMediaLibrary):
+    """Tests for the PreviewsCacheManager class."""
+
+    def test_evict(self):
+        """Checks the least recently used entries are evicted first."""
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            with mock.patch("pitivi.timeline.previewers.xdg_cache_home") as xdg_cache_home:
+                xdg_cache_home.return_value = tmpdirname
+                manager = PreviewsCacheManager(tmpdirname)
+                waves_dir = os.path.join(tmpdirname, "waves")
+                os.makedirs(waves_dir)
+                for name in ("old.peaks.npy", "new.peaks.npy"):
+                    with open(os.path.join(waves_dir, name), "wb") as wavefile:
+                        wavefile.write(b"0" * 100)
+
+                accesses = {(PreviewsCacheManager.KIND_WAVE, "old.peaks.npy"): 1,
+                            (PreviewsCacheManager.KIND_WAVE, "new.peaks.npy"): 2}
+                manager.max_size = 150
+                self.assertEqual(manager.evict(accesses, set()), (1, 100))
+                self.assertEqual(os.listdir(waves_dir), ["new.peaks.npy"])
+
+                manager.max_size = 100
+                self.assertEqual(manager.evict({}, set()), (0, 0))
+                self.assertEqual(os.listdir(waves_dir), ["new.peaks.npy"])
+
+    def test_eviction_thread_connection(self):
+        """Checks the eviction thread closes its connection to the store."""
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            manager = PreviewsCacheManager(tmpdirname)
+            thread = CacheEvictionThread(manager, {}, set())
+            with mock.patch.object(ThumbnailStore, "close") as close:
+                thread.start()
+                thread.join()
+            close.assert_called_once_with()
+
+    def test_store_close(self):
+        """Checks closing a connection saves the changes."""
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            store = ThumbnailStore(os.path.join(tmpdirname, "thumbs.db"))
+            db = store.connection()
+            db.execute("INSERT INTO Aliases VALUES ('a', 'b')")
+            store.close()
+            with self.assertRaises(sqlite3.ProgrammingError):
+                db.execute("SELECT 1")
+
+            self.assertIsNot(store.connection(), db)
+            self.assertEqual(store.resolve("a"), "b")
+            # Closing again without a connection does nothing.
+            store.close()
+            store.close()
@@ -27,6 +27,7 @@ from gi.repository import GES
 from gi.repository import Gst
 
 from pitivi import medialibrary
+from pitivi.project import LoadingAssets
 from pitivi.project import Project
 from pitivi.project import ProjectManager
 from pitivi.utils.misc import path_from_uri
@@ -539,6 +540,51 @@ class TestProjectLoading(common.TestCase):
                              medialibrary.AssetThumbnail.IN_PROGRESS)
 
 
+class TestLoadingAssets(common.TestCase):
+    """Tests for the LoadingAssets class."""
+
+    @staticmethod
+    def create_asset(duration):
+        asset = mock.Mock()
+        asset.get_duration.return_value = duration
+        asset.creation_progress = 0
+        return asset
+
+    def test_progress(self):
+        """Checks the running totals follow the assets updates."""
+        loading_assets = LoadingAssets()
+        assets = [self.create_asset(duration) for duration in (0, 0)]
+        for asset in assets:
+            self.assertFalse(loading_assets.add(asset))
+        self.assertEqual(loading_assets.progress_by_count(), 0)
+        # The assets have not been discovered yet.
+        self.assertIsNone(loading_assets.progress_by_duration())
+
+        assets[0].get_duration.return_value = 10
+        assets[1].get_duration.return_value = 30
+        assets[1].creation_progress = 50
+        self.assertFalse(loading_assets.update(assets[0]))
+        self.assertFalse(loading_assets.update(assets[1]))
+        self.assertEqual(loading_assets.total_duration, 40)
+        self.assertEqual(loading_assets.progress_by_duration(), 37.5)
+
+        assets[0].creation_progress = 100
+        self.assertTrue(loading_assets.update(assets[0]))
+        # Already accounted as loaded.
+        self.assertFalse(loading_assets.update(assets[0]))
+        self.assertEqual(loading_assets.progress_by_count(), 50)
+        self.assertEqual(loading_assets.progress_by_duration(), 62.5)
+
+        loading_assets.remove(assets[1])
+        self.assertTrue(loading_assets.all_loaded)
+        self.assertEqual(loading_assets.progress_by_duration(), 100)
+        self.assertFalse(loading_assets.update(assets[1]))
+
+        loading_assets.clear()
+        self.assertFalse(loading_assets)
+        self.assertEqual(loading_assets.total_duration, 0)
+
+
 class TestProjectSettings(common.TestCase):
 
     def testAudio(self):
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+# Pitivi video editor
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+# Boston, MA 02110-1301, USA.
+"""Tests for the utils.proxy module."""
+# pylint: disable=protected-access
+import os
+import tempfile
+from unittest import mock
+
+from gi.repository import GES
+from gi.repository import Gio
+from gi.repository import Gst
+
+from pitivi.utils.proxy import FileInfoCache
+from pitivi.utils.proxy import ProxyJobState
+from pitivi.utils.proxy import SegmentedTranscoder
+from tests import common
+
+
+def create_asset(uri, duration):
+    """Creates a fake asset."""
+    asset = mock.Mock()
+    asset.props.id = uri
+    asset.get_id.return_value = uri
+    asset.get_duration.return_value = duration
+    return asset
+
+
+class TestProxyManager(common.TestCase):
+    """Tests for the ProxyManager class."""
+
+    def queue_assets(self, app, assets):
+        """Queues the specified assets without starting any job."""
+        manager = app.proxy_manager
+        for asset in assets:
+            manager._ProxyManager__queue_job(asset)
+            self.assertTrue(manager.is_asset_queued(asset))
+
+    def test_jobs_priority(self):
+        """Checks the order in which the jobs are started."""
+        app = common.create_pitivi_mock(numTranscodingJobs=0)
+        manager = app.proxy_manager
+        long_asset = create_asset("file:///long", 10 * Gst.SECOND)
+        short_asset = create_asset("file:///short", Gst.SECOND)
+        used_asset = create_asset("file:///used", 20 * Gst.SECOND)
+        pinned_asset = create_asset("file:///pinned", 30 * Gst.SECOND)
+        self.queue_assets(app, [long_asset, short_asset, used_asset, pinned_asset])
+        manager.pin_job(pinned_asset)
+
+        clip = mock.Mock(spec=GES.UriClip)
+        clip.get_asset.return_value = used_asset
+        layer = mock.Mock()
+        layer.get_clips.return_value = [clip]
+        project = app.project_manager.current_project
+        project.ges_timeline.get_layers.return_value = [layer]
+
+        order = [manager._ProxyManager__pop_next_job() for unused_i in range(4)]
+        self.assertEqual(order, [pinned_asset, used_asset, short_asset, long_asset])
+        self.assertFalse(manager.is_asset_queued(long_asset))
+
+    def test_jobs_file(self):
+        """Checks the queued jobs are saved and can be loaded."""
+        app = common.create_pitivi_mock(numTranscodingJobs=0)
+        manager = app.proxy_manager
+        asset1 = create_asset("file:///asset1", Gst.SECOND)
+        asset2 = create_asset("file:///asset2", Gst.SECOND)
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            jobs_file = os.path.join(tmpdirname, "project.xges.proxy-jobs")
+            self.assertEqual(manager.load_jobs(jobs_file), {})
+
+            manager.set_jobs_file(jobs_file)
+            self.queue_assets(app, [asset1, asset2])
+            manager.pin_job(asset2)
+            manager._ProxyManager__save_jobs_cb()
+            self.assertEqual(manager.load_jobs(jobs_file),
+                             {"file:///asset1": False, "file:///asset2": True})
+
+            manager.cancel_job(asset1)
+            manager.cancel_job(asset2)
+            manager._ProxyManager__save_jobs_cb()
+            self.assertFalse(os.path.exists(jobs_file))
+
+            with open(jobs_file, "w") as jobs:
+                jobs.write("garbage")
+            self.assertEqual(manager.load_jobs(jobs_file), {})
+
+    def test_state_for(self):
+        """Checks the state of the assets in the transcoding queue."""
+        app = common.create_pitivi_mock(numTranscodingJobs=0)
+        manager = app.proxy_manager
+        running_asset = create_asset("file:///running", Gst.SECOND)
+        pending_asset = create_asset("file:///pending", Gst.SECOND)
+        other_asset = create_asset("file:///other", Gst.SECOND)
+        self.queue_assets(app, [running_asset, pending_asset])
+        project = app.project_manager.current_project
+        project.ges_timeline.get_layers.return_value = []
+        transcoder = mock.Mock()
+        transcoder.props.src_uri = running_asset.props.id
+        with mock.patch.object(manager, "_ProxyManager__createTranscoder",
+                               return_value=transcoder):
+            manager.set_max_jobs(1)
+
+        self.assertEqual(manager.state_for([running_asset, pending_asset, other_asset]),
+                         {running_asset: ProxyJobState.RUNNING,
+                          pending_asset: ProxyJobState.PENDING,
+                          other_asset: ProxyJobState.NONE})
+
+        manager.cancel_job(running_asset)
+        self.assertFalse(manager.is_asset_queued(running_asset))
+        transcoder.run_async.assert_called_once_with()
+
+    def test_set_cpu_usage(self):
+        """Checks the CPU usage is applied to the running transcoders."""
+        app = common.create_pitivi_mock(numTranscodingJobs=0)
+        manager = app.proxy_manager
+        asset = create_asset("file:///running", Gst.SECOND)
+        self.queue_assets(app, [asset])
+        project = app.project_manager.current_project
+        project.ges_timeline.get_layers.return_value = []
+        transcoder = mock.Mock()
+        transcoder.props.src_uri = asset.props.id
+        with mock.patch.object(manager, "_ProxyManager__createTranscoder",
+                               return_value=transcoder):
+            manager.set_max_jobs(1)
+
+        manager.set_cpu_usage(80)
+        self.assertEqual(manager.cpu_usage, 80)
+        transcoder.set_cpu_usage.assert_called_once_with(80)
+
+
+class TestFileInfoCache(common.TestCase):
+    """Tests for the FileInfoCache class."""
+
+    def test_query(self):
+        """Checks the files are stat-ed once until they change."""
+        cache = FileInfoCache()
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            uri = Gst.filename_to_uri(os.path.join(tmpdirname, "file"))
+            self.assertIsNone(cache.query(uri))
+
+            with open(Gst.uri_get_location(uri), "wb") as tmpfile:
+                tmpfile.write(b"1234")
+            # Until the monitor notices, the cached info is used.
+            self.assertFalse(cache.exists(uri))
+            cache.invalidate(uri)
+            self.assertEqual(cache.query(uri).size, 4)
+
+            with mock.patch.object(Gio.File, "query_info") as query_info:
+                self.assertEqual(cache.query(uri).size, 4)
+                query_info.assert_not_called()
+
+
+class TestSegmentedTranscoder(common.TestCase):
+    """Tests for the SegmentedTranscoder class."""
+
+    def test_segments(self):
+        """Checks the ranges cover the whole file."""
+        duration = 10 * Gst.SECOND + 1
+        transcoder = SegmentedTranscoder("file:///source", "file:///dest.part",
+                                         mock.Mock(), duration, 3)
+        segments = transcoder._SegmentedTranscoder__segments
+        self.assertEqual([(start, stop) for start, stop, unused_part in segments],
+                         [(0, duration // 3),
+                          (duration // 3, 2 * (duration // 3)),
+                          (2 * (duration // 3), duration)])
+        self.assertEqual([part for unused_start, unused_stop, part in segments],
+                         ["/dest.part.0", "/dest.part.1", "/dest.part.2"])
+        self.assertEqual(transcoder.props.src_uri, "file:///source")
+        self.assertEqual(transcoder.props.duration, duration)
+
+    def test_transcoding(self):
+        """Checks the parts are transcoded and joined into the destination."""
+        app = common.create_pitivi_mock()
+        encoding_profile = app.proxy_manager._ProxyManager__encoding_profile
+        uri = common.get_sample_uri("1sec_simpsons_trailer.mp4")
+        asset = GES.UriClipAsset.request_sync(uri)
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            dest_uri = Gst.filename_to_uri(os.path.join(tmpdirname, "dest.part"))
+            transcoder = SegmentedTranscoder(uri, dest_uri, encoding_profile,
+                                             asset.get_duration(), 2)
+            transcoder.set_cpu_usage(50)
+            mainloop = common.create_main_loop()
+            transcoder.connect("done", lambda unused_transcoder: mainloop.quit())
+            transcoder.connect("error", lambda *unused_args: mainloop.quit())
+            positions = []
+            transcoder.connect("position-updated",
+                               lambda unused_transcoder, position: positions.append(position))
+            transcoder.run_async()
+
+            # The pipelines of the segments share a single throttling clock.
+            pipelines = transcoder._SegmentedTranscoder__pipelines.values()
+            clocks = {pipeline.get_pipeline_clock() for pipeline in pipelines}
+            self.assertEqual(len(clocks), 1)
+            transcoder.set_cpu_usage(20)
+            self.assertEqual(clocks.pop().props.cpu_usage, 20)
+
+            mainloop.run(timeout_seconds=30)
+
+            self.assertEqual(os.listdir(tmpdirname), ["dest.part"])
+            self.assertTrue(positions)
+            self.assertLessEqual(positions[-1], asset.get_duration())
+            dest_asset = GES.UriClipAsset.request_sync(dest_uri)
+            self.assertAlmostEqual(dest_asset.get_duration(), asset.get_duration(),
+                                   delta=Gst.SECOND // 10)
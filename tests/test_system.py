@@ -18,8 +18,12 @@
 # Boston, MA 02110-1301, USA.
 """Tests for the utils.system module."""
 # pylint: disable=missing-docstring
+import datetime
+from unittest import mock
 from unittest import TestCase
 
+from pitivi.utils.system import ConcurrencyController
+from pitivi.utils.system import CPUUsageTracker
 from pitivi.utils.system import System
 
 
@@ -34,3 +38,48 @@ class TestSystem(TestCase):
         self.assertNotEqual(system.getUniqueFilename("a%/b"),
                             system.getUniqueFilename("a%37%3747b"))
         self.assertEqual("a b", system.getUniqueFilename("a b"))
+
+
+class TestCPUUsageTracker(TestCase):
+
+    def testUsageRightAfterReset(self):
+        tracker = CPUUsageTracker()
+        tracker.last_moment += datetime.timedelta(seconds=1)
+        self.assertEqual(tracker.usage(), 0)
+
+
+class TestConcurrencyController(TestCase):
+
+    def testUpdate(self):
+        controller = ConcurrencyController(target_cpu_usage=80)
+        set_max_jobs = mock.Mock()
+        controller.add_consumer("jobs", 10, set_max_jobs)
+        set_max_jobs.assert_called_once_with(5)
+
+        # Below the target, the jobs increase step by step.
+        self.assertEqual(controller.update(20, 0, 50), "CPU below target")
+        set_max_jobs.assert_called_with(6)
+        controller.update(75, 0, 50)
+        set_max_jobs.assert_called_with(6)
+        for unused_i in range(10):
+            controller.update(20, None, None)
+        set_max_jobs.assert_called_with(10)
+
+        # The jobs decrease quickly when the system is overloaded.
+        self.assertEqual(controller.update(95, 0, 50), "CPU above target")
+        set_max_jobs.assert_called_with(7)
+        self.assertEqual(controller.update(20, 60, 50), "I/O bound")
+        set_max_jobs.assert_called_with(5)
+        self.assertEqual(controller.update(20, 0, 5), "low memory")
+        set_max_jobs.assert_called_with(3)
+        for unused_i in range(10):
+            controller.update(20, 0, 5)
+        # There is always at least one job.
+        set_max_jobs.assert_called_with(1)
+
+    def testCpuUsage(self):
+        controller = ConcurrencyController(target_cpu_usage=80)
+        set_cpu_usage = mock.Mock()
+        controller.add_consumer("jobs", 10, mock.Mock(), set_cpu_usage)
+        # The jobs are throttled to the target, not below it.
+        set_cpu_usage.assert_called_once_with(80)
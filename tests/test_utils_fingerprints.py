@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# Pitivi video editor
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+# Boston, MA 02110-1301, USA.
+"""Tests for the utils.fingerprints module."""
+# pylint: disable=protected-access
+import hashlib
+import os
+import tempfile
+from unittest import mock
+
+from pitivi.utils.fingerprints import FingerprintIndex
+from pitivi.utils.misc import hash_file
+from tests import common
+
+
+class TestFingerprintIndex(common.TestCase):
+    """Tests for the FingerprintIndex class."""
+
+    def test_hash_file(self):
+        """Checks only the first 256KB are hashed."""
+        with tempfile.NamedTemporaryFile() as media:
+            data = os.urandom(300 * 1024)
+            media.write(data)
+            media.flush()
+            self.assertEqual(hash_file(media.name),
+                             hashlib.sha256(data[:256 * 1024]).hexdigest())
+
+    def test_fingerprint(self):
+        """Checks the hashes are remembered until the files change."""
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with tempfile.NamedTemporaryFile() as media:
+                media.write(b"first")
+                media.flush()
+                first_hash = hash_file(media.name)
+
+                index = FingerprintIndex.get(cache_dir)
+                with mock.patch("pitivi.utils.fingerprints.hash_file",
+                                side_effect=hash_file) as hash_file_mock:
+                    self.assertEqual(index.fingerprint(media.name), first_hash)
+                    self.assertEqual(index.fingerprint(media.name), first_hash)
+                    self.assertEqual(hash_file_mock.call_count, 1)
+
+                    # A new process finds the hash in the database.
+                    other_index = FingerprintIndex(index.dbfile)
+                    self.assertEqual(other_index.fingerprint(media.name), first_hash)
+                    self.assertEqual(hash_file_mock.call_count, 1)
+
+                    media.write(b" and second")
+                    media.flush()
+                    self.assertNotEqual(index.fingerprint(media.name), first_hash)
+                    self.assertEqual(hash_file_mock.call_count, 2)
+
+    def test_prefetch(self):
+        """Checks the hashes are computed in a thread."""
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with tempfile.NamedTemporaryFile() as media:
+                index = FingerprintIndex.get(cache_dir)
+                missing = os.path.join(cache_dir, "missing")
+                fingerprints = index.prefetch([media.name, missing]).result()
+                self.assertEqual(fingerprints, {media.name: hash_file(media.name)})